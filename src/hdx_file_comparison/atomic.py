@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Write files so that a reader never sees one half written.
+
+Content goes to a temporary file next to the target, with a name unique to the write so that
+concurrent writers of the same path do not share it, and is renamed over the target with
+os.replace, which is atomic. If writing fails the temporary file is removed and the target is
+left as it was.
+"""
+
+import os
+import uuid
+
+from contextlib import contextmanager, suppress
+from typing import IO, Iterator
+
+TEMPORARY_SUFFIX = ".tmp"
+
+
+@contextmanager
+def atomic_output(path: str, mode: str = "wb", **open_options) -> Iterator[IO]:
+    """Open a temporary file to write in place of path, which replaces path when the with block
+    ends without an exception
+
+    Arguments:
+        path {str} -- the file to write
+
+    Keyword Arguments:
+        mode {str} -- "wb" or "w" (default: {"wb"})
+        **open_options -- passed to open, such as encoding and newline
+
+    Yields:
+        IO -- the open temporary file
+    """
+    temporary_path = f"{path}.{uuid.uuid4().hex}{TEMPORARY_SUFFIX}"
+    try:
+        with open(temporary_path, mode.replace("w", "x"), **open_options) as output_handle:
+            yield output_handle
+        os.replace(temporary_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(temporary_path)
+        raise
+
+
+def write_atomic(path: str, content: bytes):
+    """Write bytes to path with atomic_output"""
+    with atomic_output(path) as output_handle:
+        output_handle.write(content)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Run many theme and country comparisons as one batch.
+
+Downloads are network bound and comparisons are CPU bound, so they run on separate pools whose
+sizes are set independently: downloads on a thread pool and comparisons on a process pool. A job
+is handed to the process pool as soon as its download finishes. Jobs are started largest first,
+using the file sizes recorded in the previous batch report, so that the slowest jobs do not start
+last and hold up the end of the batch. The outcome of every job is collected into a single JSON
+report which is also the input for ordering the next batch.
+"""
+
+import datetime
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import multiprocess
+
+from hdx_file_comparison.atomic import atomic_output
+
+DEFAULT_DOWNLOAD_WORKERS = 2
+DEFAULT_CPU_WORKERS = os.cpu_count() or 1
+
+
+def expand_jobs(themes: list[str], countries: Optional[list[str]] = None) -> list[dict]:
+    """The theme by country matrix of jobs, a country of None fetches all countries"""
+    return [
+        {"theme": theme, "country": country}
+        for theme in themes
+        for country in (countries or [None])
+    ]
+
+
+def read_jobs_file(jobs_file: str) -> list[dict]:
+    """Read jobs from a JSON file holding either a list of {"theme": ..., "country": ...} objects
+    or a matrix {"themes": [...], "countries": [...]}"""
+    with open(jobs_file, encoding="utf-8") as jobs_handle:
+        jobs = json.load(jobs_handle)
+    if isinstance(jobs, dict):
+        return expand_jobs(jobs["themes"], jobs.get("countries"))
+    return [{"theme": x["theme"], "country": x.get("country")} for x in jobs]
+
+
+def job_id(job: dict) -> str:
+    return f"{job['theme']}|{job['country'] or ''}"
+
+
+def read_report(report_path: str) -> Optional[dict]:
+    try:
+        with open(report_path, encoding="utf-8") as report_handle:
+            return json.load(report_handle)
+    except (OSError, ValueError):
+        return None
+
+
+def write_report(report_path: str, report: dict):
+    """Write the report to a temporary file and rename it, so an interrupted batch does not leave
+    a truncated report to order the next one"""
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with atomic_output(report_path, "w", encoding="utf-8") as report_handle:
+        json.dump(report, report_handle, indent=2)
+
+
+def order_largest_first(jobs: list[dict], previous_report: Optional[dict] = None) -> list[dict]:
+    """Sort jobs by their size in the previous report, largest first. Jobs with no previous size
+    could be of any size so they are started first."""
+    sizes = {}
+    if previous_report is not None:
+        sizes = {x["job_id"]: x.get("size") for x in previous_report.get("jobs", [])}
+
+    def sort_key(job: dict) -> tuple:
+        size = sizes.get(job_id(job))
+        return (size is not None, -(size or 0))
+
+    return sorted(jobs, key=sort_key)
+
+
+def run_batch(
+    jobs: list[dict],
+    download: Callable[[dict], tuple[str, str]],
+    compare: Callable[[str, str], dict],
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    cpu_workers: int = DEFAULT_CPU_WORKERS,
+    previous_report: Optional[dict] = None,
+) -> dict:
+    """Download and compare each job, downloads on a thread pool and comparisons on a process
+    pool
+
+    Arguments:
+        jobs {list[dict]} -- jobs with theme and country keys
+        download {Callable} -- called with a job in a download thread, returning the paths of the
+        two files to compare
+        compare {Callable} -- called with the two file paths in a worker process, returning a
+        JSON serialisable dict of results
+
+    Keyword Arguments:
+        download_workers {int} -- number of concurrent downloads
+        (default: {DEFAULT_DOWNLOAD_WORKERS})
+        cpu_workers {int} -- number of comparison processes (default: {DEFAULT_CPU_WORKERS})
+        previous_report {Optional[dict]} -- report from the previous run, used to order jobs
+        largest first (default: {None})
+
+    Returns:
+        dict -- the batch report, with one entry per job in the order the jobs were started
+    """
+    t0 = time.time()
+    started = datetime.datetime.now().isoformat()
+    ordered_jobs = order_largest_first(jobs, previous_report)
+    entries = {job_id(x): {"job_id": job_id(x), **x, "status": "pending"} for x in ordered_jobs}
+
+    with multiprocess.Pool(processes=cpu_workers) as cpu_pool, ThreadPoolExecutor(
+        max_workers=download_workers
+    ) as download_pool:
+        downloads = {download_pool.submit(_timed, download, x): x for x in ordered_jobs}
+        comparisons = {}
+        for future in as_completed(downloads):
+            entry = entries[job_id(downloads[future])]
+            try:
+                (filepath_1, filepath_2), entry["download_seconds"] = future.result()
+            except Exception as error:
+                entry["status"] = "download_failed"
+                entry["error"] = repr(error)
+                print(f"Download for {entry['job_id']} failed: {error!r}", flush=True)
+                continue
+            entry["filepath_1"] = filepath_1
+            entry["filepath_2"] = filepath_2
+            entry["size"] = os.path.getsize(filepath_1) + os.path.getsize(filepath_2)
+            comparisons[entry["job_id"]] = cpu_pool.apply_async(
+                _timed, (compare, filepath_1, filepath_2)
+            )
+
+        for key, async_result in comparisons.items():
+            entry = entries[key]
+            try:
+                entry["result"], entry["compare_seconds"] = async_result.get()
+                entry["status"] = "complete"
+            except Exception as error:
+                entry["status"] = "compare_failed"
+                entry["error"] = repr(error)
+                print(f"Comparison for {key} failed: {error!r}", flush=True)
+
+    return {
+        "started": started,
+        "elapsed_seconds": time.time() - t0,
+        "download_workers": download_workers,
+        "cpu_workers": cpu_workers,
+        "jobs": list(entries.values()),
+    }
+
+
+def _timed(function: Callable, *args) -> tuple:
+    t0 = time.time()
+    result = function(*args)
+    return result, time.time() - t0
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Benchmarks of the comparison engines on synthetic files.
+
+For each file size and edit profile a pair of synthetic files is generated and every engine is
+run on it in a fresh process, so that the peak RSS of one run does not carry over to the next and
+a run which takes too long can be stopped. The results can be saved as a baseline and later runs
+compared against it to catch regressions.
+"""
+
+import datetime
+import json
+import os
+import platform
+import time
+
+from typing import Callable, Optional
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.columnar import columnar_compare
+from hdx_file_comparison.instrumentation import peak_rss_bytes
+from hdx_file_comparison.merkle import merkle_compare
+from hdx_file_comparison.row_index import indexed_compare
+from hdx_file_comparison.streaming import streaming_compare
+from hdx_file_comparison.synthetic import EDIT_PROFILES, KEY_COLUMNS, generate_pair
+from hdx_file_comparison.time_limiter import TimeExceededException, run_with_timer
+from hdx_file_comparison.utilities import (
+    compute_diff_metrics,
+    difflib_column_changes,
+    difflib_compare,
+    hash_based_file_comparison,
+    keyed_compare,
+    process,
+)
+
+DEFAULT_TIMEOUT = 300
+# Slowdowns or memory growth beyond this fraction of the baseline are regressions
+DEFAULT_TOLERANCE = 0.25
+# Runs shorter than this in the baseline are too noisy to compare times
+MIN_BASELINE_SECONDS = 0.05
+# Memory growth smaller than this is allocator noise rather than a regression
+MIN_RSS_INCREASE_BYTES = 4 * 1024 * 1024
+
+
+BENCHMARK_ENGINES: dict[str, Callable[[str, str], object]] = {
+    "difflib_compare": lambda x, y: compute_diff_metrics(difflib_compare(x, y)),
+    "difflib_compare_myers": lambda x, y: compute_diff_metrics(
+        difflib_compare(x, y, line_diff="myers")
+    ),
+    "hash_based_file_comparison": hash_based_file_comparison,
+    "difflib_column_changes": difflib_column_changes,
+    "process": process,
+    "keyed_compare": lambda x, y: keyed_compare(x, y, KEY_COLUMNS),
+    "streaming_compare": lambda x, y: streaming_compare(x, y, KEY_COLUMNS),
+    "indexed_compare": lambda x, y: indexed_compare(x, y, KEY_COLUMNS),
+    "merkle_compare": lambda x, y: merkle_compare(x, y, KEY_COLUMNS),
+    "columnar_compare": lambda x, y: columnar_compare(x, y, KEY_COLUMNS),
+}
+
+
+def case_id(engine: str, edit_profile: str, n_rows: int) -> str:
+    return f"{engine}/{edit_profile}/{n_rows}"
+
+
+def run_benchmarks(
+    data_directory: str,
+    row_counts: list[int],
+    edit_profiles: Optional[list[str]] = None,
+    engines: Optional[list[str]] = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    rate: float = 0.01,
+    seed: int = 0,
+) -> dict:
+    """Generate synthetic file pairs and time each engine on each of them
+
+    Arguments:
+        data_directory {str} -- directory for the synthetic files
+        row_counts {list[int]} -- file sizes in rows
+
+    Keyword Arguments:
+        edit_profiles {Optional[list[str]]} -- edit profiles, all if None (default: {None})
+        engines {Optional[list[str]]} -- keys of BENCHMARK_ENGINES, all if None (default: {None})
+        timeout {float} -- seconds after which an engine run is stopped
+        (default: {DEFAULT_TIMEOUT})
+        rate {float} -- fraction of rows edited by the edit profile (default: {0.01})
+        seed {int} -- random seed for the synthetic files (default: {0})
+
+    Returns:
+        dict -- the environment and one result per engine, edit profile and size
+    """
+    edit_profiles = edit_profiles or EDIT_PROFILES
+    engines = engines or list(BENCHMARK_ENGINES)
+    unknown = [x for x in engines if x not in BENCHMARK_ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown engine(s) {unknown}, expected some of {list(BENCHMARK_ENGINES)}")
+
+    os.makedirs(data_directory, exist_ok=True)
+    results = []
+    for n_rows in row_counts:
+        for edit_profile in edit_profiles:
+            filepath_1 = os.path.join(data_directory, f"synthetic-{n_rows}-{edit_profile}-1.csv")
+            filepath_2 = os.path.join(data_directory, f"synthetic-{n_rows}-{edit_profile}-2.csv")
+            t0 = time.time()
+            expected = generate_pair(
+                filepath_1, filepath_2, n_rows, edit_profile=edit_profile, rate=rate, seed=seed
+            )
+            print(
+                f"Generated {n_rows} row '{edit_profile}' files in {time.time() - t0:0.2f} seconds",
+                flush=True,
+            )
+            for engine in engines:
+                result = run_case(engine, filepath_1, filepath_2, timeout)
+                result.update(
+                    {
+                        "case_id": case_id(engine, edit_profile, n_rows),
+                        "engine": engine,
+                        "edit_profile": edit_profile,
+                        "n_rows": n_rows,
+                        "expected": expected,
+                    }
+                )
+                print(_format_result(result), flush=True)
+                results.append(result)
+
+    return {
+        "started": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rate": rate,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def run_case(engine: str, filepath_1: str, filepath_2: str, timeout: float) -> dict:
+    """Run one engine in a new process, stopping it after timeout seconds
+
+    Returns:
+        dict -- status, wall and CPU time and peak RSS of the run, the RSS being the growth over
+        the RSS of the new process when it started
+    """
+    try:
+        return run_with_timer(max_execution_time=timeout)(_timed_run)(
+            engine, filepath_1, filepath_2
+        )
+    except TimeExceededException:
+        return {"status": "timeout", "wall_seconds": timeout}
+    except Exception as error:
+        return {"status": "error", "error": repr(error)}
+
+
+def _timed_run(engine: str, filepath_1: str, filepath_2: str) -> dict:
+    start_rss = peak_rss_bytes()
+    t0 = time.perf_counter()
+    cpu_0 = time.process_time()
+    BENCHMARK_ENGINES[engine](filepath_1, filepath_2)
+    wall_seconds = time.perf_counter() - t0
+    cpu_seconds = time.process_time() - cpu_0
+    end_rss = peak_rss_bytes()
+    return {
+        "status": "ok",
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_bytes": end_rss - start_rss if end_rss is not None else None,
+    }
+
+
+def _format_result(result: dict) -> str:
+    if result["status"] != "ok":
+        return f"{result['case_id']}: {result['status']} {result.get('error', '')}"
+    peak_rss = result["peak_rss_bytes"]
+    peak_rss = f"{peak_rss / (1024 * 1024):0.1f}MB" if peak_rss is not None else "n/a"
+    return f"{result['case_id']}: {result['wall_seconds']:0.3f} seconds, peak RSS +{peak_rss}"
+
+
+def compare_to_baseline(
+    benchmark: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> list[dict]:
+    """Find cases which are slower, use more memory or have started failing compared to the
+    baseline
+
+    Returns:
+        list[dict] -- one entry per regression with the case, the measure and both values
+    """
+    baseline_results = {x["case_id"]: x for x in baseline.get("results", [])}
+    regressions = []
+    for result in benchmark["results"]:
+        previous = baseline_results.get(result["case_id"])
+        if previous is None or previous["status"] != "ok":
+            continue
+        if result["status"] != "ok":
+            regressions.append(
+                {
+                    "case_id": result["case_id"],
+                    "measure": "status",
+                    "baseline": previous["status"],
+                    "value": result["status"],
+                }
+            )
+            continue
+        for measure, minimum, min_increase in [
+            ("wall_seconds", MIN_BASELINE_SECONDS, 0),
+            ("peak_rss_bytes", 0, MIN_RSS_INCREASE_BYTES),
+        ]:
+            if previous.get(measure) is None or result.get(measure) is None:
+                continue
+            if (
+                previous[measure] > minimum
+                and result[measure] > previous[measure] * (1 + tolerance)
+                and result[measure] - previous[measure] > min_increase
+            ):
+                regressions.append(
+                    {
+                        "case_id": result["case_id"],
+                        "measure": measure,
+                        "baseline": previous[measure],
+                        "value": result[measure],
+                    }
+                )
+    return regressions
+
+
+def read_benchmark(filepath: str) -> dict:
+    with open(filepath, encoding="utf-8") as benchmark_handle:
+        return json.load(benchmark_handle)
+
+
+def write_benchmark(filepath: str, benchmark: dict):
+    with atomic_output(filepath, "w", encoding="utf-8") as benchmark_handle:
+        json.dump(benchmark, benchmark_handle, indent=2)
@@ -5,7 +5,10 @@ import datetime
 import os
 import time
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Callable, Iterator, Optional, TextIO, Union
 
 import click
 
@@ -14,10 +17,290 @@ from hdx_file_comparison.utilities import (
     difflib_compare,
     compute_diff_metrics,
     hash_based_file_comparison,
+    iter_difflib_cell_changes,
+    iter_keyed_compare,
+    keyed_compare,
+    KeyColumnError,
+)
+from hdx_file_comparison.batch import (
+    DEFAULT_CPU_WORKERS,
+    DEFAULT_DOWNLOAD_WORKERS,
+    expand_jobs,
+    read_jobs_file,
+    read_report,
+    run_batch,
+    write_report,
+)
+from hdx_file_comparison.benchmark import (
+    BENCHMARK_ENGINES,
+    DEFAULT_TIMEOUT,
+    DEFAULT_TOLERANCE,
+    compare_to_baseline,
+    read_benchmark,
+    run_benchmarks,
+    write_benchmark,
+)
+from hdx_file_comparison.columnar import columnar_compare
+from hdx_file_comparison.digests import load_or_compute_digest, write_digest_sidecar
+from hdx_file_comparison.discovery import (
+    DEFAULT_HDX_SITE,
+    download_resource,
+    fetch_dataset_metadata,
+    read_metadata_snapshot,
+    read_state,
+    run_discovery,
+    write_state,
+)
+from hdx_file_comparison.downloader import DEFAULT_WORKERS, checkpoint_path, download_to_file
+from hdx_file_comparison.fast_path import files_identical, offset_rows, trimmed_files
+from hdx_file_comparison.history import DEFAULT_REBASE_INTERVAL, HistoryStore
+from hdx_file_comparison.instrumentation import RECORDER, profile, stage
+from hdx_file_comparison.line_diff import LINE_DIFF_ENGINES
+from hdx_file_comparison.merkle import DEFAULT_N_BUCKETS, iter_merkle_compare, merkle_compare
+from hdx_file_comparison.page_cache import DEFAULT_MAX_BYTES, DEFAULT_TTL_SECONDS, PageCache
+from hdx_file_comparison.pipeline import PageComparator
+from hdx_file_comparison.report import REPORT_FORMATS, open_report, report_to_stdout
+from hdx_file_comparison.row_index import indexed_compare, iter_indexed_compare
+from hdx_file_comparison.snapshot import (
+    SNAPSHOT_FORMATS,
+    is_snapshot,
+    projected_files,
+    snapshot_path,
+    write_snapshot,
+)
+from hdx_file_comparison.service import (
+    DEFAULT_CACHE_ENTRIES,
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    DEFAULT_SERVICE_WORKERS,
+    ComparisonService,
+    create_server,
+    iter_remote_changes,
+    run_remote_job,
+    server_available,
+    server_url,
+)
+from hdx_file_comparison.sketches import DEFAULT_K, DEFAULT_PRECISION, sketch_file_comparison
+from hdx_file_comparison.synthetic import EDIT_PROFILES
+from hdx_file_comparison.streaming import (
+    DEFAULT_MEMORY_LIMIT,
+    iter_streaming_compare,
+    streaming_compare,
+    streaming_file_comparison,
 )
 
 
 LIMIT = 1000
+ENGINES = ["difflib", "keyed", "streaming", "indexed", "merkle", "columnar"]
+# The columnar engine compares a column at a time for all rows, so it has found every change
+# before it could yield the first, and is not used for reports
+STREAMED_ENGINES = ["difflib", "keyed", "streaming", "indexed", "merkle"]
+
+
+def comparison_options(function):
+    """Options shared by the compare and process commands which select the comparison engine"""
+    function = click.option(
+        "--columns",
+        is_flag=False,
+        default=None,
+        help="Comma separated list of columns to compare, with the key columns, only these "
+        "columns are read from columnar snapshots",
+    )(function)
+    function = click.option(
+        "--fast_path/--no_fast_path",
+        default=True,
+        help="Check for byte identical files and trim lines common to the start and end of both "
+        "files before running the engine",
+    )(function)
+    function = click.option(
+        "--abs_tol",
+        is_flag=False,
+        type=float,
+        default=None,
+        help="Absolute tolerance for numeric columns in the columnar engine",
+    )(function)
+    function = click.option(
+        "--rel_tol",
+        is_flag=False,
+        type=float,
+        default=None,
+        help="Relative tolerance for numeric columns in the columnar engine",
+    )(function)
+    function = click.option(
+        "--n_buckets",
+        is_flag=False,
+        type=int,
+        default=DEFAULT_N_BUCKETS,
+        help="Number of buckets, a power of 2, used by the merkle engine",
+    )(function)
+    function = click.option(
+        "--line_diff",
+        is_flag=False,
+        type=click.Choice(list(LINE_DIFF_ENGINES)),
+        default="ndiff",
+        help="Line diff algorithm used by the difflib engine",
+    )(function)
+    function = click.option(
+        "--memory_limit",
+        is_flag=False,
+        type=int,
+        default=DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+        help="Memory ceiling in MB for the streaming engine, sorted runs are spilled to disk "
+        "above this",
+    )(function)
+    function = click.option(
+        "--key_columns",
+        is_flag=False,
+        default=None,
+        help="Comma separated list of columns identifying a row, used by the keyed, streaming, "
+        "indexed, merkle and columnar engines",
+    )(function)
+    function = click.option(
+        "--engine",
+        is_flag=False,
+        type=click.Choice(ENGINES),
+        default="difflib",
+        help="Comparison engine, keyed matches rows on --key_columns, streaming compares in "
+        "bounded memory, indexed is keyed using a row index sidecar cached next to each file, "
+        "merkle only diffs rows in hash buckets which differ, columnar is keyed comparing a "
+        "column at a time with optional numeric tolerance",
+    )(function)
+    return function
+
+
+def sketch_options(function):
+    """Options shared by the triage and batch commands which size the sketches"""
+    function = click.option(
+        "--k",
+        is_flag=False,
+        type=int,
+        default=DEFAULT_K,
+        help="Number of line hashes kept by the MinHash sketch",
+    )(function)
+    function = click.option(
+        "--precision",
+        is_flag=False,
+        type=int,
+        default=DEFAULT_PRECISION,
+        help="HyperLogLog precision, the sketch has 2**precision registers",
+    )(function)
+    return function
+
+
+def report_options(function):
+    """Options shared by the compare and process commands which stream the cell changes to a
+    report as the engine finds them. With --report_out - the command is passed the stdout stream
+    as report_out and everything else it prints goes to stderr."""
+
+    @wraps(function)
+    def wrapper(*args, report_out: Optional[str] = None, **kwargs):
+        if report_out is not None and kwargs.get("engine") not in STREAMED_ENGINES:
+            raise click.UsageError(
+                f"--report_out can not be used with the {kwargs.get('engine')} engine, which "
+                f"finds every change before the first is written, use one of "
+                f"{', '.join(STREAMED_ENGINES)}"
+            )
+        if report_out != "-":
+            return function(*args, report_out=report_out, **kwargs)
+        with report_to_stdout() as stdout:
+            return function(*args, report_out=stdout, **kwargs)
+
+    wrapper = click.option(
+        "--report_format",
+        is_flag=False,
+        type=click.Choice(REPORT_FORMATS),
+        default="ndjson",
+        help="ndjson or csv write a line for each cell change, summary only writes the counts "
+        "of changes when the comparison ends",
+    )(wrapper)
+    wrapper = click.option(
+        "--report_out",
+        is_flag=False,
+        default=None,
+        help="Write cell changes to this file, or to stdout if -, as they are found, with "
+        "everything else printed to stderr",
+    )(wrapper)
+    return wrapper
+
+
+def metrics_options(function):
+    """Options shared by the compare and process commands which record the time and resources
+    used by each stage"""
+
+    @wraps(function)
+    def wrapper(
+        *args, metrics_out: Optional[str] = None, profile_out: Optional[str] = None, **kwargs
+    ):
+        if metrics_out is not None:
+            RECORDER.open_output(metrics_out)
+        try:
+            with profile(profile_out):
+                return function(*args, **kwargs)
+        finally:
+            RECORDER.close_output()
+            if metrics_out is not None or profile_out is not None:
+                print_stage_summary(RECORDER.summary())
+
+    wrapper = click.option(
+        "--profile_out",
+        is_flag=False,
+        default=None,
+        help="Write cProfile stats for the whole command to this file",
+    )(wrapper)
+    wrapper = click.option(
+        "--metrics_out",
+        is_flag=False,
+        default=None,
+        help="Append wall time, CPU time, peak RSS, bytes read and rows for each stage to this "
+        "file as NDJSON",
+    )(wrapper)
+    return wrapper
+
+
+def cache_options(function):
+    """Options shared by the commands which download from HAPI which set up a page cache, passed
+    to the command as cache, None if --cache_directory is not given"""
+
+    @wraps(function)
+    def wrapper(
+        *args,
+        cache_directory: Optional[str] = None,
+        cache_ttl: float = DEFAULT_TTL_SECONDS,
+        cache_max_mb: int = DEFAULT_MAX_BYTES // (1024 * 1024),
+        **kwargs,
+    ):
+        cache = None
+        if cache_directory is not None:
+            cache = PageCache(
+                cache_directory, ttl_seconds=cache_ttl, max_bytes=cache_max_mb * 1024 * 1024
+            )
+        try:
+            return function(*args, cache=cache, **kwargs)
+        finally:
+            if cache is not None:
+                print(cache.summary(), flush=True)
+
+    wrapper = click.option(
+        "--cache_max_mb",
+        is_flag=False,
+        type=int,
+        default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help="Size in MB above which the least recently used pages are evicted from the cache",
+    )(wrapper)
+    wrapper = click.option(
+        "--cache_ttl",
+        is_flag=False,
+        type=float,
+        default=DEFAULT_TTL_SECONDS,
+        help="Age in seconds after which cached pages are revalidated with the server",
+    )(wrapper)
+    wrapper = click.option(
+        "--cache_directory",
+        is_flag=False,
+        default=None,
+        help="Directory of a cache of downloaded pages, pages are not cached if this is not given",
+    )(wrapper)
+    return wrapper
 
 
 @click.group()
@@ -42,9 +325,46 @@ def hdx_compare() -> None:
     default=None,
     help="HDX HAPI endpoint prefix, .humdata.org/api/v1/ is appended",
 )
-def download(theme: str = "", download_directory: Optional[str] = None, hapi_site: str = "hapi"):
-    """Download HDX HAPI responses as CSV files"""
-    download_file(theme, download_directory, hapi_site)
+@click.option(
+    "--max_workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="Maximum number of pages downloaded concurrently",
+)
+@click.option(
+    "--force_download",
+    is_flag=True,
+    default=False,
+    help="Download again even if a complete file for today already exists",
+)
+@click.option(
+    "--snapshot_format",
+    is_flag=False,
+    type=click.Choice(SNAPSHOT_FORMATS),
+    default="csv",
+    help="Store downloads as CSV or as compressed columnar snapshots",
+)
+@cache_options
+def download(
+    theme: str = "",
+    download_directory: Optional[str] = None,
+    hapi_site: str = "hapi",
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    snapshot_format: str = "csv",
+    cache: Optional[PageCache] = None,
+):
+    """Download HDX HAPI responses as CSV files or columnar snapshots"""
+    download_file(
+        theme,
+        download_directory,
+        hapi_site,
+        max_workers=max_workers,
+        force_download=force_download,
+        cache=cache,
+        snapshot_format=snapshot_format,
+    )
 
 
 @hdx_compare.command(name="compare")
@@ -72,24 +392,121 @@ def download(theme: str = "", download_directory: Optional[str] = None, hapi_sit
     default="2024-08-06-metadata_admin1-hapi-temporary.csv",
     help="Filename for first file in comparison",
 )
+@click.option(
+    "--server",
+    is_flag=False,
+    default=None,
+    envvar="HDX_COMPARE_SERVER",
+    help="URL of a comparison service started with serve, used if it is running, for example "
+    f"{server_url()}",
+)
+@report_options
+@metrics_options
+@comparison_options
 def compare(
     theme: str = "",
     download_directory: Optional[str] = None,
     file_1: str = "hapi",
     file_2: str = "hapi",
+    server: Optional[str] = None,
+    report_out: Optional[Union[str, TextIO]] = None,
+    report_format: str = "ndjson",
+    **engine_options,
 ):
     """Compare files"""
     filepath_1 = os.path.join(download_directory, file_1)
     filepath_2 = os.path.join(download_directory, file_2)
 
-    diff = difflib_compare(filepath_1, filepath_2, encoding="utf-8")
-
-    # Process diff
-    diff_metrics = compute_diff_metrics(diff)
+    job = {
+        "filepath_1": os.path.abspath(filepath_1),
+        "filepath_2": os.path.abspath(filepath_2),
+        "options": engine_options,
+    }
+    remote = server is not None and server_available(server)
+    if remote and report_out is not None:
+        # Changes are streamed from the service into the report as the engine finds them
+        diff_metrics = {}
+        try:
+            with open_report(report_out, report_format) as report:
+                report.write_changes(iter_remote_changes(server, job, diff_metrics))
+                report.write_summary(diff_metrics)
+        except ValueError as error:
+            click.secho(str(error), fg="red", color=True)
+            click.get_current_context().exit(1)
+    elif remote:
+        record = run_remote_job(server, job)
+        if record["status"] != "complete":
+            click.secho(f"Comparison failed on {server}: {record['error']}", fg="red", color=True)
+            click.get_current_context().exit(1)
+        diff_metrics = record["result"]["diff_metrics"]
+    else:
+        if server is not None:
+            print(f"No comparison service at {server}, comparing here", flush=True)
+        with key_column_usage():
+            if report_out is not None:
+                diff_metrics, _ = report_diff_engine(
+                    filepath_1, filepath_2, report_out, report_format, **engine_options
+                )
+            else:
+                diff_metrics, _ = run_diff_engine(filepath_1, filepath_2, **engine_options)
 
     print(diff_metrics, flush=True)
 
 
+@hdx_compare.command(name="triage")
+@click.option(
+    "--download_directory",
+    is_flag=False,
+    default="output",
+    help="Directory where files to compare are stored",
+)
+@click.option(
+    "--file_1",
+    is_flag=False,
+    default="2024-08-06-metadata_admin1-hapi.csv",
+    help="Filename for first file in comparison",
+)
+@click.option(
+    "--file_2",
+    is_flag=False,
+    default="2024-08-06-metadata_admin1-hapi-temporary.csv",
+    help="Filename for second file in comparison",
+)
+@sketch_options
+def triage(
+    download_directory: Optional[str] = None,
+    file_1: str = "hapi",
+    file_2: str = "hapi",
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+):
+    """Estimate how different two files are from sketches, stored next to each file"""
+    filepath_1 = os.path.join(download_directory, file_1)
+    filepath_2 = os.path.join(download_directory, file_2)
+
+    sketch_metrics = sketch_file_comparison(filepath_1, filepath_2, precision=precision, k=k)
+    print_sketch_metrics(sketch_metrics)
+
+
+def print_sketch_metrics(sketch_metrics: dict):
+    relative_error = sketch_metrics["unique_relative_error"]
+    print(
+        f"file_1_length:{sketch_metrics['file_1_length']}\n"
+        f"file_2_length:{sketch_metrics['file_2_length']}\n"
+        f"file_1_unique:~{sketch_metrics['file_1_unique']} "
+        f"± {relative_error * sketch_metrics['file_1_unique']:0.0f}\n"
+        f"file_2_unique:~{sketch_metrics['file_2_unique']} "
+        f"± {relative_error * sketch_metrics['file_2_unique']:0.0f}\n"
+        f"jaccard:{sketch_metrics['jaccard']:0.4f} ± {sketch_metrics['jaccard_error']:0.4f}\n"
+        f"n_differing:~{sketch_metrics['n_differing']} ± {sketch_metrics['n_differing_error']}",
+        flush=True,
+    )
+    if sketch_metrics["hashes_match"]:
+        click.secho("Order independent file hashes match", fg="green", color=True)
+    else:
+        click.secho("Order independent file hash mismatch", fg="red", color=True)
+
+
 @hdx_compare.command(name="process")
 @click.option(
     "--theme",
@@ -101,19 +518,116 @@ def compare(
 @click.option(
     "--country", is_flag=False, default=None, help="Country filter code (ISO 3166 alpha-3)"
 )
+@click.option(
+    "--max_workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="Maximum number of pages downloaded concurrently",
+)
+@click.option(
+    "--force_download",
+    is_flag=True,
+    default=False,
+    help="Download again even if a complete file for today already exists",
+)
+@click.option(
+    "--pipelined",
+    is_flag=True,
+    default=False,
+    help="Download from both endpoints at once, hashing and comparing pages as they arrive",
+)
+@click.option(
+    "--snapshot_format",
+    is_flag=False,
+    type=click.Choice(SNAPSHOT_FORMATS),
+    default="csv",
+    help="Store downloads as CSV or as compressed columnar snapshots",
+)
+@report_options
+@metrics_options
+@cache_options
+@comparison_options
 def process(
     theme: str = "metadata/admin1",
     download_directory: Optional[str] = None,
     country: Optional[str] = None,
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    pipelined: bool = False,
+    snapshot_format: str = "csv",
+    cache: Optional[PageCache] = None,
+    report_out: Optional[Union[str, TextIO]] = None,
+    report_format: str = "ndjson",
+    **engine_options,
 ):
     """Download and compare files from the hapi and hapi-temporary endpoints"""
+    engine = engine_options["engine"]
     print_banner("process")
-    filepath_1 = download_file(theme, download_directory, "hapi", country=country)
-    filepath_2 = download_file(theme, download_directory, "hapi-temporary", country=country)
+    page_metrics = None
+    if pipelined:
+        filepath_1, filepath_2, page_metrics = download_pipelined(
+            theme,
+            download_directory,
+            country=country,
+            max_workers=max_workers,
+            force_download=force_download,
+            cache=cache,
+            snapshot_format=snapshot_format,
+        )
+    else:
+        filepath_1 = download_file(
+            theme,
+            download_directory,
+            "hapi",
+            country=country,
+            max_workers=max_workers,
+            force_download=force_download,
+            cache=cache,
+            snapshot_format=snapshot_format,
+        )
+        filepath_2 = download_file(
+            theme,
+            download_directory,
+            "hapi-temporary",
+            country=country,
+            max_workers=max_workers,
+            force_download=force_download,
+            cache=cache,
+            snapshot_format=snapshot_format,
+        )
+
+    if engine_options["fast_path"] and files_identical(filepath_1, filepath_2):
+        click.secho(
+            f"\nFiles for theme '{theme}' are byte identical",
+            fg="green",
+            color=True,
+        )
+        return
+
+    # Snapshots, and files compared on some of their columns, are analysed as CSV files holding
+    # only those columns, which are removed when the command ends
+    columns = projection_columns(engine_options.pop("columns"), engine_options["key_columns"])
+    prepared = click.get_current_context().with_resource(
+        projected_files(filepath_1, filepath_2, columns)
+    )
+    # Files used as they are have already been found to differ by the byte level fast path
+    engine_options["known_different"] = prepared == (filepath_1, filepath_2)
+    filepath_1, filepath_2 = prepared
+    if columns is not None:
+        page_metrics = None
 
     # Hash based comparisons
     print(f"\nHash analysis started at {datetime.datetime.now().isoformat()} ", flush=True)
-    hash_metrics = hash_based_file_comparison(filepath_1, filepath_2)
+    with stage("hash_analysis", engine=engine):
+        if page_metrics is not None:
+            hash_metrics = page_metrics
+        elif engine == "streaming":
+            hash_metrics = streaming_file_comparison(
+                filepath_1, filepath_2, memory_limit=engine_options["memory_limit"] * 1024 * 1024
+            )
+        else:
+            hash_metrics = hash_based_file_comparison(filepath_1, filepath_2)
     if hash_metrics["file_1_length"] == hash_metrics["file_2_length"]:
         click.secho(
             f"File lengths match at {hash_metrics['file_1_length']} lines",
@@ -128,7 +642,11 @@ def process(
             color=True,
         )
 
-    if hash_metrics["file_1_hash"] == hash_metrics["file_2_hash"]:
+    # The hash analysis computes the same order independent digests, the sidecar files are only
+    # read for metrics without them
+    digest_1 = hash_metrics.get("file_1_hash") or load_or_compute_digest(filepath_1)["digest"]
+    digest_2 = hash_metrics.get("file_2_hash") or load_or_compute_digest(filepath_2)["digest"]
+    if digest_1 == digest_2:
         click.secho(
             "Order independent file hashes match",
             fg="green",
@@ -156,11 +674,18 @@ def process(
         )
 
     t0 = time.time()
-    print(f"\nDifflib analysis started at {datetime.datetime.now().isoformat()} ", flush=True)
-    diff = difflib_compare(filepath_1, filepath_2, encoding="utf-8")
-
-    # Process diff
-    diff_metrics = compute_diff_metrics(diff)
+    print(
+        f"\n{engine.capitalize()} analysis started at {datetime.datetime.now().isoformat()} ",
+        flush=True,
+    )
+    with key_column_usage():
+        if report_out is not None:
+            diff_metrics, n_cell_changes = report_diff_engine(
+                filepath_1, filepath_2, report_out, report_format, **engine_options
+            )
+        else:
+            diff_metrics, cell_changes = run_diff_engine(filepath_1, filepath_2, **engine_options)
+            n_cell_changes = len(cell_changes) if cell_changes is not None else None
     print("\nChanged line counts:", flush=True)
     elapsed_time = time.time() - t0
 
@@ -173,6 +698,8 @@ def process(
         #     print(row, flush=True)
         for key, value in diff_metrics.items():
             print(f"{key}:{value}", flush=True)
+        if n_cell_changes is not None:
+            print(f"n_cell_changes:{n_cell_changes}", flush=True)
         click.secho(
             f"\nFiles for theme '{theme}' are different, {n_changes} changes seen",
             fg="red",
@@ -190,8 +717,858 @@ def process(
     print(f"Analysis took {elapsed_time:0.2f} seconds", flush=True)
 
 
+@hdx_compare.command(name="batch")
+@click.option(
+    "--themes",
+    is_flag=False,
+    default="metadata/admin1",
+    help="Comma separated list of themes",
+)
+@click.option(
+    "--countries",
+    is_flag=False,
+    default=None,
+    help="Comma separated list of country codes (ISO 3166 alpha-3), each theme is run for each",
+)
+@click.option(
+    "--jobs_file",
+    is_flag=False,
+    default=None,
+    help="JSON file of jobs, used instead of --themes and --countries",
+)
+@click.option("--download_directory", is_flag=False, default="output", help="target_directory")
+@click.option(
+    "--report",
+    is_flag=False,
+    default=None,
+    help="Path of the JSON batch report, the previous report here orders jobs largest first "
+    "(default: <download_directory>/batch-report.json)",
+)
+@click.option(
+    "--download_workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_DOWNLOAD_WORKERS,
+    help="Number of jobs downloading at once",
+)
+@click.option(
+    "--cpu_workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_CPU_WORKERS,
+    help="Number of processes comparing files",
+)
+@click.option(
+    "--max_workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="Maximum number of pages downloaded concurrently for each file",
+)
+@click.option(
+    "--force_download",
+    is_flag=True,
+    default=False,
+    help="Download again even if a complete file for today already exists",
+)
+@click.option(
+    "--triage",
+    is_flag=True,
+    default=False,
+    help="Only estimate how different each pair of files is from sketches, without a full diff",
+)
+@sketch_options
+@cache_options
+@comparison_options
+def batch(
+    themes: str = "metadata/admin1",
+    countries: Optional[str] = None,
+    jobs_file: Optional[str] = None,
+    download_directory: Optional[str] = None,
+    report: Optional[str] = None,
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    cpu_workers: int = DEFAULT_CPU_WORKERS,
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    triage: bool = False,
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+    cache: Optional[PageCache] = None,
+    **engine_options,
+):
+    """Download and compare files from the hapi and hapi-temporary endpoints for many themes and
+    countries, writing a single JSON report"""
+    print_banner("batch")
+    if jobs_file is not None:
+        jobs = read_jobs_file(jobs_file)
+    else:
+        jobs = expand_jobs(
+            parse_key_columns(themes),
+            parse_key_columns(countries) if countries is not None else None,
+        )
+    report_path = report or os.path.join(download_directory, "batch-report.json")
+
+    batch_report = run_batch(
+        jobs,
+        partial(
+            download_job,
+            download_directory=download_directory,
+            max_workers=max_workers,
+            force_download=force_download,
+            cache=cache,
+        ),
+        (
+            partial(triage_job, precision=precision, k=k)
+            if triage
+            else partial(compare_job, **engine_options)
+        ),
+        download_workers=download_workers,
+        cpu_workers=cpu_workers,
+        previous_report=read_report(report_path),
+    )
+    write_report(report_path, batch_report)
+
+    for entry in batch_report["jobs"]:
+        if entry["status"] != "complete":
+            click.secho(f"{entry['job_id']}: {entry['status']}", fg="red", color=True)
+        elif triage and not entry["result"]["hashes_match"]:
+            click.secho(
+                f"{entry['job_id']}: similarity {entry['result']['jaccard']:0.4f} "
+                f"± {entry['result']['jaccard_error']:0.4f}, "
+                f"~{entry['result']['n_differing']} differing lines",
+                fg="red",
+                color=True,
+            )
+        elif entry["result"]["n_changes"] != 0:
+            click.secho(
+                f"{entry['job_id']}: {entry['result']['n_changes']} changes seen",
+                fg="red",
+                color=True,
+            )
+        else:
+            click.secho(f"{entry['job_id']}: identical", fg="green", color=True)
+    print(f"Report written to {report_path}", flush=True)
+    print(f"Batch took {batch_report['elapsed_seconds']:0.2f} seconds", flush=True)
+
+
+@hdx_compare.command(name="discover")
+@click.option(
+    "--datasets",
+    is_flag=False,
+    default=None,
+    help="Comma separated list of HDX dataset names or ids to fetch metadata for",
+)
+@click.option(
+    "--metadata_files",
+    is_flag=False,
+    default=None,
+    help="Comma separated list of stored dataset metadata JSON files, used instead of --datasets",
+)
+@click.option(
+    "--hdx_site",
+    is_flag=False,
+    default=DEFAULT_HDX_SITE,
+    help="HDX site to fetch metadata from, data or stage for example",
+)
+@click.option("--download_directory", is_flag=False, default="output", help="target_directory")
+@click.option(
+    "--state",
+    is_flag=False,
+    default=None,
+    help="State store recording the metadata last seen for each resource "
+    "(default: <download_directory>/discovery-state.json)",
+)
+@click.option(
+    "--dry_run",
+    is_flag=True,
+    default=False,
+    help="Only report which resources have changed, without downloading or updating the state",
+)
+@comparison_options
+def discover(
+    datasets: Optional[str] = None,
+    metadata_files: Optional[str] = None,
+    hdx_site: str = DEFAULT_HDX_SITE,
+    download_directory: str = "output",
+    state: Optional[str] = None,
+    dry_run: bool = False,
+    **engine_options,
+):
+    """Download and compare only the HDX resources whose metadata shows a change since the last
+    run"""
+    print_banner("discover")
+    if metadata_files is not None:
+        dataset_metadata = [
+            dataset
+            for filepath in parse_key_columns(metadata_files)
+            for dataset in read_metadata_snapshot(filepath)
+        ]
+    elif datasets is not None:
+        dataset_metadata = fetch_dataset_metadata(parse_key_columns(datasets), hdx_site=hdx_site)
+    else:
+        raise click.UsageError("One of --datasets or --metadata_files must be supplied")
+    state_path = state or os.path.join(download_directory, "discovery-state.json")
+    discovery_state = read_state(state_path)
+
+    def report_change(change: dict):
+        resource = change["resource"] or change["state"]
+        label = f"{resource['dataset_name']}/{resource['name']}"
+        if change["status"] == "unchanged":
+            click.secho(f"{label}: unchanged", fg="green", color=True)
+            return
+        fields = f" ({', '.join(change['changed_fields'])})" if change["changed_fields"] else ""
+        click.secho(f"{label}: {change['status']}{fields}", fg="red", color=True)
+        if "result" in change:
+            for key, value in change["result"].items():
+                print(f"{key}:{value}", flush=True)
+        if not dry_run:
+            write_state(state_path, discovery_state)
+
+    changes = run_discovery(
+        dataset_metadata,
+        discovery_state,
+        partial(download_resource, download_directory=download_directory),
+        compare=lambda x, y: run_diff_engine(x, y, **engine_options)[0],
+        dry_run=dry_run,
+        on_change=None if dry_run else report_change,
+    )
+    if dry_run:
+        for change in changes:
+            report_change(change)
+    else:
+        write_state(state_path, discovery_state)
+        print(f"State written to {state_path}", flush=True)
+
+    n_changed = sum(1 for x in changes if x["status"] != "unchanged")
+    print(f"{n_changed} of {len(changes)} resources new, changed or removed", flush=True)
+
+
+@hdx_compare.command(name="serve")
+@click.option("--host", is_flag=False, default=DEFAULT_HOST, help="Address to listen on")
+@click.option("--port", is_flag=False, type=int, default=DEFAULT_PORT, help="Port to listen on")
+@click.option(
+    "--workers",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_SERVICE_WORKERS,
+    help="Number of comparison jobs run at once",
+)
+@click.option(
+    "--cache_entries",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_CACHE_ENTRIES,
+    help="Number of parsed files kept in memory",
+)
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    workers: int = DEFAULT_SERVICE_WORKERS,
+    cache_entries: int = DEFAULT_CACHE_ENTRIES,
+):
+    """Run a local comparison service which keeps parsed files in memory, compare --server sends
+    jobs to it"""
+    print_banner("serve")
+    service = ComparisonService(
+        run_diff_engine,
+        max_workers=workers,
+        cache_entries=cache_entries,
+        iter_diff_engine=iter_diff_engine,
+    )
+    server = create_server(service, host=host, port=port)
+    print(f"Serving on {server_url(host, server.server_address[1])}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        print(f"Stopped, {service.status()['jobs']}", flush=True)
+
+
+@hdx_compare.group(name="history")
+def history():
+    """Keep the snapshots of a file as a base and keyed deltas"""
+
+
+@history.command(name="add")
+@click.option(
+    "--history_directory", is_flag=False, default="history", help="Directory of the history store"
+)
+@click.option("--file", "filepath", is_flag=False, required=True, help="CSV snapshot to add")
+@click.option(
+    "--version",
+    is_flag=False,
+    default=None,
+    help="Label for the snapshot (default: the date its filename starts with)",
+)
+@click.option(
+    "--key_columns",
+    is_flag=False,
+    default=None,
+    help="Comma separated list of columns identifying a row, required for a new store",
+)
+@click.option(
+    "--rebase_interval",
+    is_flag=False,
+    type=int,
+    default=DEFAULT_REBASE_INTERVAL,
+    help="Most snapshots stored as deltas before a full base is stored again, for a new store",
+)
+def history_add(
+    history_directory: str = "history",
+    filepath: str = "",
+    version: Optional[str] = None,
+    key_columns: Optional[str] = None,
+    rebase_interval: int = DEFAULT_REBASE_INTERVAL,
+):
+    """Add a snapshot to a history store"""
+    store = HistoryStore(
+        history_directory,
+        parse_key_columns(key_columns) if key_columns is not None else None,
+        rebase_interval=rebase_interval,
+    )
+    stored = store.add_version(filepath, version_id=version)
+    print(
+        f"Stored {stored['version_id']} as a {stored['kind']} of {stored['bytes']} bytes: "
+        f"{stored['n_added']} rows added, {stored['n_removed']} removed, "
+        f"{stored['n_changed']} changed",
+        flush=True,
+    )
+
+
+@history.command(name="list")
+@click.option(
+    "--history_directory", is_flag=False, default="history", help="Directory of the history store"
+)
+def history_list(history_directory: str = "history"):
+    """List the snapshots in a history store"""
+    store = HistoryStore(history_directory)
+    for stored in store.versions:
+        print(
+            f"{stored['version_id']}: {stored['kind']}, {stored['n_rows']} rows, "
+            f"{stored['bytes']} bytes, {stored['n_added']} added, {stored['n_removed']} removed, "
+            f"{stored['n_changed']} changed",
+            flush=True,
+        )
+
+
+@history.command(name="rebuild")
+@click.option(
+    "--history_directory", is_flag=False, default="history", help="Directory of the history store"
+)
+@click.option("--version", is_flag=False, required=True, help="Snapshot to rebuild")
+@click.option("--output_file", is_flag=False, required=True, help="CSV file to write")
+def history_rebuild(history_directory: str = "history", version: str = "", output_file: str = ""):
+    """Rebuild a snapshot from a history store as a CSV file"""
+    n_rows = HistoryStore(history_directory).write_version(version, output_file)
+    print(f"Wrote {n_rows} rows of {version} to {output_file}", flush=True)
+
+
+@history.command(name="last_changed")
+@click.option(
+    "--history_directory", is_flag=False, default="history", help="Directory of the history store"
+)
+@click.option(
+    "--key",
+    is_flag=False,
+    required=True,
+    help="Comma separated values of the key columns of the row, in the order of the key columns",
+)
+@click.option(
+    "--column", is_flag=False, default=None, help="Column of the cell (default: the whole row)"
+)
+def history_last_changed(
+    history_directory: str = "history", key: str = "", column: Optional[str] = None
+):
+    """Report the snapshot in which a cell or row last changed"""
+    store = HistoryStore(history_directory)
+    key_values = [x.strip() for x in key.split(",")]
+    if len(key_values) != len(store.key_columns):
+        raise click.UsageError(f"--key needs values for {','.join(store.key_columns)}")
+    version = store.last_changed(key_values, column=column)
+    if version is None:
+        click.secho("Row not found in any snapshot", fg="red", color=True)
+    else:
+        print(version, flush=True)
+
+
+@hdx_compare.command(name="benchmark")
+@click.option(
+    "--rows",
+    is_flag=False,
+    default="10000,100000",
+    help="Comma separated list of synthetic file sizes in rows",
+)
+@click.option(
+    "--edit_profiles",
+    is_flag=False,
+    default=",".join(EDIT_PROFILES),
+    help=f"Comma separated list of edit profiles from {', '.join(EDIT_PROFILES)}",
+)
+@click.option(
+    "--engines",
+    is_flag=False,
+    default=",".join(BENCHMARK_ENGINES),
+    help="Comma separated list of engines to time",
+)
+@click.option(
+    "--data_directory",
+    is_flag=False,
+    default=os.path.join("output", "benchmark"),
+    help="Directory for the synthetic files",
+)
+@click.option(
+    "--output", is_flag=False, default=None, help="Write the benchmark results to this JSON file"
+)
+@click.option(
+    "--baseline",
+    is_flag=False,
+    default=None,
+    help="Benchmark results to compare against, exits with status 1 if there are regressions",
+)
+@click.option(
+    "--tolerance",
+    is_flag=False,
+    type=float,
+    default=DEFAULT_TOLERANCE,
+    help="Fractional slowdown or memory growth over the baseline reported as a regression",
+)
+@click.option(
+    "--timeout",
+    is_flag=False,
+    type=float,
+    default=DEFAULT_TIMEOUT,
+    help="Seconds after which an engine run is stopped",
+)
+@click.option(
+    "--rate",
+    is_flag=False,
+    type=float,
+    default=0.01,
+    help="Fraction of rows edited, appended, deleted or duplicated",
+)
+def benchmark(
+    rows: str = "10000,100000",
+    edit_profiles: str = ",".join(EDIT_PROFILES),
+    engines: str = ",".join(BENCHMARK_ENGINES),
+    data_directory: str = os.path.join("output", "benchmark"),
+    output: Optional[str] = None,
+    baseline: Optional[str] = None,
+    tolerance: float = DEFAULT_TOLERANCE,
+    timeout: float = DEFAULT_TIMEOUT,
+    rate: float = 0.01,
+):
+    """Time the comparison engines on synthetic files"""
+    print_banner("benchmark")
+    results = run_benchmarks(
+        data_directory,
+        [int(x) for x in parse_key_columns(rows)],
+        edit_profiles=parse_key_columns(edit_profiles),
+        engines=parse_key_columns(engines),
+        timeout=timeout,
+        rate=rate,
+    )
+    if output is not None:
+        write_benchmark(output, results)
+        print(f"Benchmark results written to {output}", flush=True)
+    if baseline is None:
+        return
+
+    regressions = compare_to_baseline(results, read_benchmark(baseline), tolerance=tolerance)
+    if len(regressions) == 0:
+        click.secho(f"No regressions against {baseline}", fg="green", color=True)
+        return
+    for regression in regressions:
+        click.secho(
+            f"{regression['case_id']}: {regression['measure']} {regression['baseline']} -> "
+            f"{regression['value']}",
+            fg="red",
+            color=True,
+        )
+    click.get_current_context().exit(1)
+
+
+def download_job(
+    job: dict,
+    download_directory: Optional[str] = None,
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    cache: Optional[PageCache] = None,
+) -> tuple[str, str]:
+    return tuple(
+        download_file(
+            job["theme"],
+            download_directory,
+            hapi_site,
+            country=job["country"],
+            max_workers=max_workers,
+            force_download=force_download,
+            cache=cache,
+        )
+        for hapi_site in ["hapi", "hapi-temporary"]
+    )
+
+
+def compare_job(filepath_1: str, filepath_2: str, **engine_options) -> dict:
+    """Hash check and diff for one batch job, run in a worker process"""
+    digest_1 = load_or_compute_digest(filepath_1)
+    digest_2 = load_or_compute_digest(filepath_2)
+    diff_metrics, cell_changes = run_diff_engine(filepath_1, filepath_2, **engine_options)
+    return {
+        "file_1_length": digest_1["n_rows"],
+        "file_2_length": digest_2["n_rows"],
+        "hashes_match": digest_1["digest"] == digest_2["digest"],
+        "diff_metrics": diff_metrics,
+        "n_changes": sum(diff_metrics.values()),
+        "n_cell_changes": len(cell_changes) if cell_changes is not None else None,
+    }
+
+
+def triage_job(
+    filepath_1: str, filepath_2: str, precision: int = DEFAULT_PRECISION, k: int = DEFAULT_K
+) -> dict:
+    """Sketch comparison for one batch job, run in a worker process"""
+    sketch_metrics = sketch_file_comparison(filepath_1, filepath_2, precision=precision, k=k)
+    sketch_metrics["n_changes"] = sketch_metrics["n_differing"]
+    return sketch_metrics
+
+
+def run_diff_engine(
+    filepath_1: str,
+    filepath_2: str,
+    engine: str = "difflib",
+    key_columns: Optional[str] = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+    line_diff: str = "ndiff",
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    rel_tol: Optional[float] = None,
+    abs_tol: Optional[float] = None,
+    fast_path: bool = True,
+    columns: Optional[str] = None,
+    known_different: bool = False,
+) -> tuple[dict, Optional[list]]:
+    """Run the selected comparison engine, returning line change counts and, for engines which
+    produce them, cell changes. The keyword arguments are the options added by
+    comparison_options.
+
+    With fast_path byte identical files are reported as unchanged without being parsed, and
+    otherwise the lines common to the start and end of both files are trimmed before the engine
+    is run. The indexed engine is run on the whole files so that its cached row indexes are used.
+    Columnar snapshots, and files compared on some of their columns, are written out as CSV
+    files with only those columns before any of this. A caller which has already found that the
+    files differ passes known_different so that they are not compared again.
+    """
+    engine_options = {
+        "engine": engine,
+        "key_columns": key_columns,
+        "memory_limit": memory_limit,
+        "line_diff": line_diff,
+        "n_buckets": n_buckets,
+        "rel_tol": rel_tol,
+        "abs_tol": abs_tol,
+    }
+    with stage("diff", engine=engine), prepared_files(
+        filepath_1, filepath_2, engine, key_columns, fast_path, columns, known_different
+    ) as prepared:
+        if prepared is None:
+            diff_metrics = {"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0}
+            return diff_metrics, None if engine == "difflib" else []
+        diff_metrics, cell_changes = _run_diff_engine(prepared[0], prepared[1], **engine_options)
+    if cell_changes is not None:
+        offset_rows(cell_changes, prepared[2])
+    return diff_metrics, cell_changes
+
+
+def iter_diff_engine(
+    filepath_1: str,
+    filepath_2: str,
+    diff_metrics: dict,
+    engine: str = "difflib",
+    key_columns: Optional[str] = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+    line_diff: str = "ndiff",
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    rel_tol: Optional[float] = None,
+    abs_tol: Optional[float] = None,
+    fast_path: bool = True,
+    columns: Optional[str] = None,
+    known_different: bool = False,
+) -> Iterator[dict]:
+    """run_diff_engine yielding cell changes as the engine finds them, with the line counts put in
+    diff_metrics once the iterator is exhausted. The difflib engine yields changes in diff order,
+    the streaming engine in key order and the keyed, indexed and merkle engines in file_2 order,
+    and the difflib engine yields the cell changes which run_diff_engine leaves out. The columnar
+    engine finds all its changes before it could yield the first, so raises a ValueError.
+    """
+    if engine not in STREAMED_ENGINES:
+        raise ValueError(
+            f"The {engine} engine can not stream its changes, use one of "
+            f"{', '.join(STREAMED_ENGINES)}"
+        )
+    engine_options = {
+        "engine": engine,
+        "key_columns": key_columns,
+        "memory_limit": memory_limit,
+        "line_diff": line_diff,
+        "n_buckets": n_buckets,
+        "rel_tol": rel_tol,
+        "abs_tol": abs_tol,
+    }
+    with stage("diff", engine=engine), prepared_files(
+        filepath_1, filepath_2, engine, key_columns, fast_path, columns, known_different
+    ) as prepared:
+        if prepared is None:
+            diff_metrics.update({"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0})
+            return
+        filepath_1, filepath_2, line_offset = prepared
+        for cell_change in _iter_diff_engine(
+            filepath_1, filepath_2, diff_metrics, **engine_options
+        ):
+            cell_change["row"] += line_offset
+            yield cell_change
+
+
+def report_diff_engine(
+    filepath_1: str,
+    filepath_2: str,
+    report_out: Union[str, TextIO],
+    report_format: str = "ndjson",
+    **engine_options,
+) -> tuple[dict, int]:
+    """Stream the cell changes of iter_diff_engine to a report, returning the line counts and
+    the number of cell changes"""
+    diff_metrics = {}
+    with open_report(report_out, report_format) as report:
+        report.write_changes(
+            iter_diff_engine(filepath_1, filepath_2, diff_metrics, **engine_options)
+        )
+        report.write_summary(diff_metrics)
+    return diff_metrics, report.n_changes
+
+
+@contextmanager
+def prepared_files(
+    filepath_1: str,
+    filepath_2: str,
+    engine: str,
+    key_columns: Optional[str],
+    fast_path: bool,
+    columns: Optional[str],
+    known_different: bool = False,
+) -> Iterator[Optional[tuple[str, str, int]]]:
+    """The files an engine is run on, and the number of lines trimmed from their start, or None if
+    fast_path finds that they are byte identical, which is not checked if known_different"""
+    with projected_files(filepath_1, filepath_2, projection_columns(columns, key_columns)) as (
+        filepath_1,
+        filepath_2,
+    ):
+        if fast_path and not known_different and files_identical(filepath_1, filepath_2):
+            yield None
+        elif not fast_path or engine == "indexed":
+            yield filepath_1, filepath_2, 0
+        else:
+            with trimmed_files(filepath_1, filepath_2) as prepared:
+                yield prepared
+
+
+def projection_columns(columns: Optional[str], key_columns: Optional[str]) -> Optional[list[str]]:
+    """The columns to read, key columns first, None for all columns"""
+    if columns is None:
+        return None
+    key_column_list = parse_key_columns(key_columns) if key_columns is not None else []
+    return list(dict.fromkeys([*key_column_list, *parse_key_columns(columns)]))
+
+
+def _run_diff_engine(
+    filepath_1: str,
+    filepath_2: str,
+    engine: str,
+    key_columns: Optional[str],
+    memory_limit: int,
+    line_diff: str,
+    n_buckets: int,
+    rel_tol: Optional[float],
+    abs_tol: Optional[float],
+) -> tuple[dict, Optional[list]]:
+    if engine == "merkle":
+        diff_metrics = merkle_compare(
+            filepath_1,
+            filepath_2,
+            parse_key_columns(key_columns) if key_columns is not None else None,
+            n_buckets=n_buckets,
+            encoding="utf-8",
+        )
+        cell_changes = diff_metrics.pop("cell_changes")
+        return diff_metrics, cell_changes
+    if engine == "streaming":
+        diff_metrics = streaming_compare(
+            filepath_1,
+            filepath_2,
+            parse_key_columns(key_columns) if key_columns is not None else None,
+            encoding="utf-8",
+            memory_limit=memory_limit * 1024 * 1024,
+        )
+        cell_changes = diff_metrics.pop("cell_changes")
+        return diff_metrics, cell_changes
+    if engine in ["keyed", "indexed", "columnar"]:
+        if key_columns is None:
+            raise click.UsageError(f"--key_columns must be supplied when using the {engine} engine")
+        if engine == "columnar":
+            diff_metrics = columnar_compare(
+                filepath_1,
+                filepath_2,
+                parse_key_columns(key_columns),
+                encoding="utf-8",
+                rel_tol=rel_tol,
+                abs_tol=abs_tol,
+            )
+        else:
+            keyed_engine = keyed_compare if engine == "keyed" else indexed_compare
+            diff_metrics = keyed_engine(
+                filepath_1, filepath_2, parse_key_columns(key_columns), encoding="utf-8"
+            )
+        cell_changes = diff_metrics.pop("cell_changes")
+        return diff_metrics, cell_changes
+
+    diff = difflib_compare(filepath_1, filepath_2, encoding="utf-8", line_diff=line_diff)
+
+    # Process diff
+    diff_metrics = compute_diff_metrics(diff)
+    return diff_metrics, None
+
+
+def _iter_diff_engine(
+    filepath_1: str,
+    filepath_2: str,
+    diff_metrics: dict,
+    engine: str,
+    key_columns: Optional[str],
+    memory_limit: int,
+    line_diff: str,
+    n_buckets: int,
+    rel_tol: Optional[float],
+    abs_tol: Optional[float],
+) -> Iterator[dict]:
+    if engine == "difflib":
+        yield from iter_difflib_cell_changes(
+            filepath_1, filepath_2, diff_metrics, encoding="utf-8", line_diff=line_diff
+        )
+        return
+    if engine == "streaming":
+        yield from iter_streaming_compare(
+            filepath_1,
+            filepath_2,
+            diff_metrics,
+            parse_key_columns(key_columns) if key_columns is not None else None,
+            encoding="utf-8",
+            memory_limit=memory_limit * 1024 * 1024,
+        )
+        return
+    if engine == "merkle":
+        yield from iter_merkle_compare(
+            filepath_1,
+            filepath_2,
+            diff_metrics,
+            parse_key_columns(key_columns) if key_columns is not None else None,
+            n_buckets=n_buckets,
+            encoding="utf-8",
+        )
+        return
+    if key_columns is None:
+        raise click.UsageError(f"--key_columns must be supplied when using the {engine} engine")
+    keyed_engine = iter_keyed_compare if engine == "keyed" else iter_indexed_compare
+    yield from keyed_engine(
+        filepath_1, filepath_2, parse_key_columns(key_columns), diff_metrics, encoding="utf-8"
+    )
+
+
+@contextmanager
+def key_column_usage() -> Iterator[None]:
+    """Report --key_columns naming columns which are not in the files as a usage error, as when
+    --key_columns is left out, rather than with a traceback"""
+    try:
+        yield
+    except KeyColumnError as error:
+        raise click.UsageError(
+            f"--key_columns {', '.join(error.missing)} not found in the header of the files"
+        ) from error
+
+
+def parse_key_columns(key_columns: str) -> list[str]:
+    return [x.strip() for x in key_columns.split(",") if x.strip() != ""]
+
+
+def download_pipelined(
+    theme: str,
+    download_directory,
+    country: Optional[str] = None,
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    cache: Optional[PageCache] = None,
+    snapshot_format: str = "csv",
+) -> tuple[str, str, Optional[dict]]:
+    """Download from the hapi and hapi-temporary endpoints concurrently, comparing pages as they
+    are written. Page sizes are fixed so that pages at the same offset can be compared.
+
+    Returns:
+        tuple[str, str, Optional[dict]] -- the two file paths and the hash metrics computed from
+        the pages, None if either file was not downloaded from its first page
+    """
+    comparator = PageComparator(labels=("hapi", "hapi-temporary"))
+    hapi_sites = ["hapi", "hapi-temporary"]
+    with ThreadPoolExecutor(max_workers=len(hapi_sites)) as executor:
+        futures = [
+            executor.submit(
+                download_file,
+                theme,
+                download_directory,
+                hapi_site,
+                country=country,
+                max_workers=max_workers,
+                force_download=force_download,
+                on_page=comparator.page_callback(i),
+                adaptive_page_size=False,
+                cache=cache,
+                snapshot_format=snapshot_format,
+            )
+            for i, hapi_site in enumerate(hapi_sites)
+        ]
+        filepaths = [x.result() for x in futures]
+
+    if not comparator.complete:
+        print(
+            "Existing or resumed downloads were used, so hashes are computed from the files",
+            flush=True,
+        )
+        return filepaths[0], filepaths[1], None
+
+    # Digests computed from the pages are stored so they are not computed again from the files,
+    # snapshots are not read line by line so have no digest
+    for i, filepath in enumerate(filepaths):
+        if not is_snapshot(filepath):
+            write_digest_sidecar(filepath, comparator.file_digest(i, filepath))
+    page_metrics = comparator.hash_metrics()
+    print(
+        f"{page_metrics['n_pages_compared']} pages compared, "
+        f"{len(page_metrics['mismatched_pages'])} differ",
+        flush=True,
+    )
+    return filepaths[0], filepaths[1], page_metrics
+
+
 def download_file(
-    theme: str, download_directory, hapi_site: str, country: Optional[str] = None
+    theme: str,
+    download_directory,
+    hapi_site: str,
+    country: Optional[str] = None,
+    max_workers: int = DEFAULT_WORKERS,
+    force_download: bool = False,
+    on_page: Optional[Callable[[int, Optional[str], list], None]] = None,
+    adaptive_page_size: bool = True,
+    cache: Optional[PageCache] = None,
+    snapshot_format: str = "csv",
 ) -> str:
     # Filenaming
     if download_directory is None:
@@ -203,14 +1580,24 @@ def download_file(
     else:
         output_filename = f"{date_}-{theme.replace('/','_')}-{hapi_site}.csv"
     output_file_path = os.path.join(download_directory, output_filename)
+    # Snapshots are written from the downloaded CSV file, which is then removed
+    final_file_path = (
+        snapshot_path(output_file_path) if snapshot_format == "columnar" else output_file_path
+    )
 
-    if os.path.exists(output_file_path):
+    # Interrupted downloads leave a checkpoint and are resumed, the output file itself is only
+    # written once a download is complete
+    if force_download:
+        for path in [final_file_path, output_file_path, checkpoint_path(output_file_path)]:
+            if os.path.exists(path):
+                os.remove(path)
+    elif os.path.exists(final_file_path):
         print(
-            f"Expected file {output_file_path}, "
-            "already exists - delete if you wish it to be re-downloaded",
+            f"Expected file {final_file_path}, "
+            "already downloaded - use --force_download to download it again",
             flush=True,
         )
-        return output_file_path
+        return final_file_path
     # App identifier
     email_address = "ian.hopkinson%40humdata.org"
     app_name = "hdx_file_comparison"
@@ -240,15 +1627,37 @@ def download_file(
     print(f"\nFetching data from: {query_url}", flush=True)
     print(f"Saving to: {output_file_path}", flush=True)
 
-    results = fetch_data_from_hapi(query_url, LIMIT)
+    n_rows = download_to_file(
+        query_url,
+        output_file_path,
+        LIMIT,
+        max_workers=max_workers,
+        adaptive_page_size=adaptive_page_size,
+        on_page=on_page,
+        cache=cache,
+    )
+
+    print(f"Downloaded {n_rows} rows", flush=True)
 
-    print(f"Downloaded {len(results)} rows", flush=True)
+    if final_file_path != output_file_path:
+        write_snapshot(output_file_path, final_file_path)
+        os.remove(output_file_path)
+        print(f"Columnar snapshot written to {final_file_path}", flush=True)
 
-    with open(output_file_path, "w", encoding="utf-8") as output_file:
-        for line in results:
-            output_file.write(f"{line}\n")
+    return final_file_path
 
-    return output_file_path
+
+def print_stage_summary(summary: dict):
+    print("\nStage timings:", flush=True)
+    for name, total in summary.items():
+        peak_rss = total["peak_rss_bytes"]
+        peak_rss = f"{peak_rss / (1024 * 1024):0.1f}MB" if peak_rss is not None else "n/a"
+        print(
+            f"{name}: {total['n_spans']} spans, {total['wall_seconds']:0.2f}s wall, "
+            f"{total['cpu_seconds']:0.2f}s CPU, {total['rows']} rows, "
+            f"{total['bytes_read']} bytes, peak RSS {peak_rss}",
+            flush=True,
+        )
 
 
 def print_banner(action: str):
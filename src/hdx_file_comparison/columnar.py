@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Column at a time comparison of two CSV files.
+
+Each file is read once into one list of values per column, except for the lines the two files
+share at the start, whose rows are paired with each other and so can not hold a change. Rows are
+aligned on key columns as in keyed_compare and then each column is compared for all aligned rows
+in a single pass, a slice of consecutive rows at a time, rather than field by field for each row.
+Numeric columns can be compared with an absolute or relative tolerance so that a value rendered
+differently, 0.3606 and 0.36060 for example, is not reported as a change, only the values which
+differ are parsed into floats. The tolerance applies to a pair of values only when both are
+numbers, and two NaN values are equal.
+"""
+
+import csv
+import io
+import math
+
+from itertools import compress, count, zip_longest
+from operator import ne
+from typing import Optional
+
+from hdx_file_comparison.fast_path import DEFAULT_CHUNK_SIZE, _count_lines, common_affixes
+from hdx_file_comparison.utilities import _column_pairs, _key_indices
+
+
+def load_columns(filepath: str, encoding: str = "utf-8", skip_bytes: int = 0) -> dict:
+    """Read a CSV file into columns
+
+    Arguments:
+        filepath {str} -- path to a CSV file
+
+    Keyword Arguments:
+        encoding {str} -- file encoding (default: {"utf-8"})
+        skip_bytes {int} -- length of whole lines at the start of the file, including the
+        header, whose rows are not read (default: {0})
+
+    Returns:
+        dict -- the header, the number of rows read, a list of values for each column and the
+        number of rows skipped
+    """
+    with open(filepath, "rb") as raw_handle:
+        n_skipped = 0
+        if skip_bytes > 0:
+            header_line = raw_handle.readline()
+            n_skipped = _count_lines(filepath, skip_bytes, DEFAULT_CHUNK_SIZE) - 1
+            raw_handle.seek(skip_bytes)
+        file_handle = io.TextIOWrapper(raw_handle, encoding=encoding, newline="")
+        csv_reader = csv.reader(file_handle)
+        header = next(csv.reader([header_line.decode(encoding)]) if skip_bytes > 0 else csv_reader)
+        rows = list(csv_reader)
+
+    # Short rows are padded with empty values, values beyond the header are dropped
+    columns = {x: () for x in header}
+    columns.update(zip(header, zip_longest(*rows, fillvalue="")))
+    return {"header": header, "n_rows": len(rows), "columns": columns, "n_skipped": n_skipped}
+
+
+def parse_floats(values: tuple) -> list[Optional[float]]:
+    """Parse each value of a column into a float, None if the value is not a number. Empty values
+    and HXL hashtags, as in the second row of HAPI downloads, are not numbers."""
+    return [_parse_float(x) for x in values]
+
+
+def _parse_float(value: str) -> Optional[float]:
+    if value == "" or value[0] == "#":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def align_rows(
+    columns_1: dict, columns_2: dict, key_columns: list[str], sources: tuple[str, str]
+) -> tuple[list[int], list[int], int, int]:
+    """Pair rows of the two files with the same key, repeated keys are paired in order
+
+    Returns:
+        tuple -- the row indices of the matched rows in each file and the number of rows only in
+        the first file and only in the second
+    """
+    _key_indices(columns_1["header"], key_columns, sources[0])
+    _key_indices(columns_2["header"], key_columns, sources[1])
+    keys_1 = list(zip(*[columns_1["columns"][x] for x in key_columns]))
+    keys_2 = list(zip(*[columns_2["columns"][x] for x in key_columns]))
+
+    file_1_keys = dict(zip(keys_1, count()))
+    if len(file_1_keys) == len(keys_1) and len(set(keys_2)) == len(keys_2):
+        # With unique keys rows are matched with a single dictionary lookup each
+        positions = list(map(file_1_keys.get, keys_2))
+        matched_2 = [j for j, i in enumerate(positions) if i is not None]
+        matched_1 = [positions[j] for j in matched_2]
+        return (
+            matched_1,
+            matched_2,
+            len(keys_1) - len(matched_1),
+            len(keys_2) - len(matched_2),
+        )
+
+    file_1_keys = {}
+    for i, key in enumerate(keys_1):
+        file_1_keys.setdefault(key, []).append(i)
+
+    matched_1 = []
+    matched_2 = []
+    n_added = 0
+    for j, key in enumerate(keys_2):
+        matches = file_1_keys.get(key)
+        if not matches:
+            n_added += 1
+            continue
+        matched_1.append(matches.pop(0))
+        matched_2.append(j)
+        if not matches:
+            del file_1_keys[key]
+
+    n_removed = sum(len(x) for x in file_1_keys.values())
+    return matched_1, matched_2, n_removed, n_added
+
+
+def columnar_compare(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: list[str],
+    encoding: str = "utf-8",
+    rel_tol: Optional[float] = None,
+    abs_tol: Optional[float] = None,
+) -> dict:
+    """Keyed comparison of two CSV files a column at a time. If rel_tol or abs_tol is given,
+    columns which are numeric in both files are compared as numbers using math.isclose, otherwise
+    all values are compared as text as in keyed_compare.
+
+    Arguments:
+        filepath_1 {str} -- path to the original file
+        filepath_2 {str} -- path to the new file
+        key_columns {list[str]} -- column names which together identify a row
+
+    Keyword Arguments:
+        encoding {str} -- file encoding (default: {"utf-8"})
+        rel_tol {Optional[float]} -- relative tolerance for numeric columns (default: {None})
+        abs_tol {Optional[float]} -- absolute tolerance for numeric columns (default: {None})
+
+    Returns:
+        dict -- diff metrics in the same form as process()
+    """
+    if not key_columns:
+        raise ValueError("columnar_compare requires at least one key column")
+
+    # Rows in the lines the files share at the start are paired with each other, even if their
+    # keys are repeated later, so they can not hold a change and are not read
+    prefix, _ = common_affixes(filepath_1, filepath_2)
+    return compare_columns(
+        load_columns(filepath_1, encoding=encoding, skip_bytes=prefix),
+        load_columns(filepath_2, encoding=encoding, skip_bytes=prefix),
+        key_columns,
+        rel_tol=rel_tol,
+        abs_tol=abs_tol,
+        sources=(filepath_1, filepath_2),
+    )
+
+
+def compare_columns(
+    columns_1: dict,
+    columns_2: dict,
+    key_columns: list[str],
+    rel_tol: Optional[float] = None,
+    abs_tol: Optional[float] = None,
+    sources: tuple[str, str] = ("file_1", "file_2"),
+) -> dict:
+    """The comparison behind columnar_compare, on files already read by load_columns, which are
+    not modified
+
+    Returns:
+        dict -- diff metrics in the same form as process()
+    """
+    matched_1, matched_2, n_removed, n_added = align_rows(
+        columns_1, columns_2, key_columns, sources
+    )
+    use_tolerance = rel_tol is not None or abs_tol is not None
+    runs = _aligned_runs(matched_1, matched_2)
+
+    changes = []
+    for position, (column, i, j) in enumerate(
+        _column_pairs(columns_1["header"], columns_2["header"])
+    ):
+        values_1 = columns_1["columns"][column] if i is not None else _empty(columns_1)
+        values_2 = columns_2["columns"][column] if j is not None else _empty(columns_2)
+        differing = _differing(values_1, values_2, runs)
+        original_values = [values_1[matched_1[k]] for k in differing]
+        new_values = [values_2[matched_2[k]] for k in differing]
+
+        if use_tolerance and differing and i is not None and j is not None:
+            outside = _outside_tolerance(
+                parse_floats(original_values),
+                parse_floats(new_values),
+                rel_tol or 0.0,
+                abs_tol or 0.0,
+            )
+            differing = list(compress(differing, outside))
+            original_values = list(compress(original_values, outside))
+            new_values = list(compress(new_values, outside))
+
+        for k, original_value, new_value in zip(differing, original_values, new_values):
+            changes.append((matched_1[k], position, column, original_value, new_value))
+    n_skipped = columns_1.get("n_skipped", 0)
+
+    changes.sort()
+    cell_changes = [
+        {
+            "row": n_skipped + row + 1,
+            "column": column,
+            "original_value": original_value,
+            "new_value": new_value,
+        }
+        for row, _, column, original_value, new_value in changes
+    ]
+
+    diff_metrics = {}
+    diff_metrics["n_lines_changed"] = len({x[0] for x in changes})
+    diff_metrics["n_lines_added"] = n_added
+    diff_metrics["n_lines_removed"] = n_removed
+    diff_metrics["cell_changes"] = cell_changes
+    return diff_metrics
+
+
+def _aligned_runs(matched_1: list[int], matched_2: list[int]) -> list[tuple[int, int, int, int]]:
+    """Split the matched rows into runs which are consecutive in both files, so that columns can
+    be compared a slice at a time rather than gathering the matched values of each
+
+    Returns:
+        list[tuple[int, int, int, int]] -- the position of the run in the matched rows, the row
+        it starts at in each file and its length
+    """
+    runs = []
+    start = 0
+    for k in range(1, len(matched_1) + 1):
+        if (
+            k == len(matched_1)
+            or matched_1[k] != matched_1[k - 1] + 1
+            or matched_2[k] != matched_2[k - 1] + 1
+        ):
+            runs.append((start, matched_1[start], matched_2[start], k - start))
+            start = k
+    return runs
+
+
+def _differing(values_1: tuple, values_2: tuple, runs: list[tuple[int, int, int, int]]) -> list:
+    """The positions in the matched rows of the values which differ, comparing each run a slice
+    at a time and skipping runs which are equal"""
+    differing = []
+    for start, start_1, start_2, length in runs:
+        end_1 = start_1 + length
+        end_2 = start_2 + length
+        slice_1 = values_1[start_1:end_1]
+        slice_2 = values_2[start_2:end_2]
+        if slice_1 != slice_2:
+            differing.extend(compress(count(start), map(ne, slice_1, slice_2)))
+    return differing
+
+
+def _empty(columns: dict) -> tuple:
+    return ("",) * columns["n_rows"]
+
+
+def _outside_tolerance(
+    numeric_1: list[Optional[float]],
+    numeric_2: list[Optional[float]],
+    rel_tol: float,
+    abs_tol: float,
+) -> list[bool]:
+    """Whether each pair of differing values is not within tolerance, a pair of values of which
+    either is not a number always differs and a pair of NaN values never does"""
+    outside = []
+    for value_1, value_2 in zip(numeric_1, numeric_2):
+        if value_1 is None or value_2 is None:
+            outside.append(True)
+        elif math.isnan(value_1) and math.isnan(value_2):
+            outside.append(False)
+        else:
+            outside.append(not math.isclose(value_1, value_2, rel_tol=rel_tol, abs_tol=abs_tol))
+    return outside
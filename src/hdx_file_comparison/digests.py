@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Stable, order independent file digests.
+
+Each row is hashed with a 128 bit BLAKE2b hash and the row hashes are summed modulo 2**128. The
+sum does not depend on row order but, unlike a hash of a set, does count duplicate rows. Because
+BLAKE2b is not randomised per interpreter the digest can be stored in a JSON sidecar file next to
+the data file and compared across runs and machines.
+"""
+
+import hashlib
+import json
+import os
+
+from typing import Iterable, Optional
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.instrumentation import stage
+
+DIGEST_ALGORITHM = "blake2b-128-sum"
+DIGEST_BITS = 128
+DIGEST_MASK = (1 << DIGEST_BITS) - 1
+SIDECAR_SUFFIX = ".digest.json"
+
+
+def row_hash(line: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(line.encode("utf-8"), digest_size=DIGEST_BITS // 8).digest(), "big"
+    )
+
+
+def multiset_digest(lines: Iterable[str]) -> str:
+    """Order independent digest of lines, computed in a single pass without building a set
+
+    Arguments:
+        lines {Iterable[str]} -- lines without line endings
+
+    Returns:
+        str -- the digest as a hex string
+    """
+    total = 0
+    for line in lines:
+        total = (total + row_hash(line)) & DIGEST_MASK
+    return format_digest(total)
+
+
+def format_digest(total: int) -> str:
+    return f"{total:0{DIGEST_BITS // 4}x}"
+
+
+def file_digest(filepath: str, encoding: str = "utf-8") -> dict:
+    """Compute the order independent digest of a file by streaming it line by line
+
+    Returns:
+        dict -- the digest, number of rows and the file size and modification time used to
+        check a sidecar is still valid
+    """
+    stat = os.stat(filepath)
+    n_rows = 0
+    total = 0
+    with stage("hash", filepath=filepath) as span, open(filepath, encoding=encoding) as file_handle:
+        for line in file_handle:
+            total = (total + row_hash(line.rstrip("\r\n"))) & DIGEST_MASK
+            n_rows += 1
+        span.add(rows=n_rows, bytes_read=stat.st_size)
+
+    return {
+        "algorithm": DIGEST_ALGORITHM,
+        "digest": format_digest(total),
+        "n_rows": n_rows,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "encoding": encoding,
+    }
+
+
+def sidecar_path(filepath: str) -> str:
+    return f"{filepath}{SIDECAR_SUFFIX}"
+
+
+def write_digest_sidecar(filepath: str, digest: dict) -> str:
+    output_path = sidecar_path(filepath)
+    with atomic_output(output_path, "w", encoding="utf-8") as sidecar_handle:
+        json.dump(digest, sidecar_handle, indent=2)
+    return output_path
+
+
+def read_digest_sidecar(filepath: str, encoding: str = "utf-8") -> Optional[dict]:
+    """Read the digest sidecar for filepath, returning None if it is missing or if the file has
+    changed size or modification time since the digest was computed"""
+    try:
+        with open(sidecar_path(filepath), encoding="utf-8") as sidecar_handle:
+            digest = json.load(sidecar_handle)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(filepath)
+    if (
+        digest.get("algorithm") != DIGEST_ALGORITHM
+        or digest.get("encoding") != encoding
+        or digest.get("size") != stat.st_size
+        or digest.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return digest
+
+
+def load_or_compute_digest(filepath: str, encoding: str = "utf-8") -> dict:
+    """Return the digest for filepath from its sidecar if it is still valid, otherwise compute
+    it and write a new sidecar"""
+    digest = read_digest_sidecar(filepath, encoding=encoding)
+    if digest is None:
+        digest = file_digest(filepath, encoding=encoding)
+        write_digest_sidecar(filepath, digest)
+    return digest
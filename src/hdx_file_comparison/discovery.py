@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Change discovery from HDX dataset metadata.
+
+HDX describes each dataset, and each resource (file) in it, with CKAN metadata which includes
+modification times and, for uploaded files, a size and sometimes a hash. A local state store
+records the metadata last seen for every resource along with the path of the copy last downloaded.
+Comparing fresh metadata against the store says which resources have changed, so only those are
+downloaded and diffed against their previous copy. If a dataset's own metadata_modified time has
+not changed none of its resources are checked.
+
+Metadata comes from the CKAN package_show API or from stored JSON snapshots, which may be a single
+dataset, a list of datasets or a CKAN API response.
+"""
+
+import datetime
+import json
+import os
+
+from typing import Callable, Optional
+from urllib import parse
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.downloader import (
+    ConnectionPool,
+    PageFetchError,
+    download_url_to_file,
+    http_get,
+)
+from hdx_file_comparison.instrumentation import stage
+
+DEFAULT_HDX_SITE = "data"
+# Resource fields which show a change, empty values are not compared
+CHANGE_FIELDS = ["last_modified", "metadata_modified", "size", "hash"]
+STATUSES = ["new", "changed", "unchanged", "removed"]
+
+
+def read_metadata_snapshot(filepath: str) -> list[dict]:
+    """Read datasets from a stored metadata JSON file
+
+    Returns:
+        list[dict] -- the datasets in the file
+    """
+    with open(filepath, encoding="utf-8") as metadata_handle:
+        metadata = json.load(metadata_handle)
+    return _datasets_from_metadata(metadata)
+
+
+def _datasets_from_metadata(metadata) -> list[dict]:
+    if isinstance(metadata, dict) and "result" in metadata:
+        metadata = metadata["result"]
+    if isinstance(metadata, dict) and "results" in metadata:
+        metadata = metadata["results"]
+    if isinstance(metadata, dict):
+        metadata = [metadata]
+    return metadata
+
+
+def fetch_dataset_metadata(
+    dataset_names: list[str],
+    hdx_site: str = DEFAULT_HDX_SITE,
+    pool: Optional[ConnectionPool] = None,
+) -> list[dict]:
+    """Fetch the metadata for each dataset from the CKAN package_show API of an HDX site"""
+    pool = pool or ConnectionPool()
+    datasets = []
+    for dataset_name in dataset_names:
+        url = (
+            f"https://{hdx_site}.humdata.org/api/3/action/package_show?"
+            f"id={parse.quote(dataset_name)}"
+        )
+        with stage("metadata", dataset=dataset_name):
+            status, _, body = http_get(url, pool)
+        if status != 200:
+            raise PageFetchError(f"Failed to fetch {url}: HTTP status {status}")
+        datasets.extend(_datasets_from_metadata(json.loads(body)))
+    return datasets
+
+
+def resource_metadata(dataset: dict, resource: dict) -> dict:
+    """The fields of a resource which are stored in the state"""
+    return {
+        "dataset_id": dataset["id"],
+        "dataset_name": dataset.get("name"),
+        "resource_id": resource["id"],
+        "name": resource.get("name"),
+        "format": resource.get("format"),
+        "download_url": resource.get("download_url") or resource.get("url"),
+        **{x: resource.get(x) for x in CHANGE_FIELDS},
+    }
+
+
+def changed_fields(previous: dict, current: dict) -> list[str]:
+    """Fields which differ between two versions of a resource's metadata, ignoring fields which
+    are empty in either"""
+    return [
+        x
+        for x in CHANGE_FIELDS
+        if previous.get(x) not in [None, ""]
+        and current.get(x) not in [None, ""]
+        and previous[x] != current[x]
+    ]
+
+
+def discover_changes(datasets: list[dict], state: dict) -> list[dict]:
+    """Compare dataset metadata against the state store
+
+    Arguments:
+        datasets {list[dict]} -- CKAN dataset metadata, each with a list of resources
+        state {dict} -- the state store, as read by read_state
+
+    Returns:
+        list[dict] -- one entry per resource with its status, one of STATUSES, the fields which
+        changed, its current metadata and the state recorded for it
+    """
+    changes = []
+    for dataset in datasets:
+        previous_dataset = state["datasets"].get(dataset["id"])
+        dataset_unchanged = (
+            previous_dataset is not None
+            and dataset.get("metadata_modified") is not None
+            and previous_dataset.get("metadata_modified") == dataset.get("metadata_modified")
+        )
+        resource_ids = set()
+        for resource in dataset.get("resources", []):
+            current = resource_metadata(dataset, resource)
+            resource_ids.add(current["resource_id"])
+            previous = state["resources"].get(current["resource_id"])
+            if previous is None:
+                status, fields = "new", []
+            elif dataset_unchanged:
+                status, fields = "unchanged", []
+            else:
+                fields = changed_fields(previous, current)
+                status = "changed" if fields else "unchanged"
+            changes.append(
+                {"status": status, "changed_fields": fields, "resource": current, "state": previous}
+            )
+
+        for resource_id, previous in state["resources"].items():
+            if previous["dataset_id"] == dataset["id"] and resource_id not in resource_ids:
+                changes.append(
+                    {"status": "removed", "changed_fields": [], "resource": None, "state": previous}
+                )
+    return changes
+
+
+def new_state() -> dict:
+    return {"datasets": {}, "resources": {}}
+
+
+def read_state(state_path: str) -> dict:
+    """Read the state store, an empty state if there is none"""
+    try:
+        with open(state_path, encoding="utf-8") as state_handle:
+            return json.load(state_handle)
+    except (OSError, ValueError):
+        return new_state()
+
+
+def write_state(state_path: str, state: dict):
+    """Write the state to a temporary file and rename it, so an interrupted run does not leave a
+    truncated store"""
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    with atomic_output(state_path, "w", encoding="utf-8") as state_handle:
+        json.dump(state, state_handle, indent=2)
+
+
+def record_dataset(state: dict, dataset: dict):
+    state["datasets"][dataset["id"]] = {
+        "name": dataset.get("name"),
+        "metadata_modified": dataset.get("metadata_modified"),
+        "last_modified": dataset.get("last_modified"),
+        "seen": datetime.datetime.now().isoformat(),
+    }
+
+
+def record_resource(state: dict, resource: dict, filepath: Optional[str] = None):
+    state["resources"][resource["resource_id"]] = {
+        **resource,
+        "filepath": filepath,
+        "seen": datetime.datetime.now().isoformat(),
+    }
+
+
+def download_resource(
+    resource: dict, download_directory: str, pool: Optional[ConnectionPool] = None
+) -> str:
+    """Download a resource to <timestamp>-<filename from its URL> in download_directory, the
+    timestamp being the time the resource was last modified without colons, so that each version,
+    including versions from the same day, has its own file. The file is streamed to disk rather
+    than read into memory.
+
+    Returns:
+        str -- path to the downloaded file
+    """
+    url = resource["download_url"]
+    filename = os.path.basename(parse.urlsplit(url).path) or resource["resource_id"]
+    timestamp = (resource.get("last_modified") or datetime.datetime.now().isoformat()).replace(
+        ":", ""
+    )
+    output_file_path = os.path.join(download_directory, f"{timestamp}-{filename}")
+    os.makedirs(download_directory, exist_ok=True)
+
+    print(f"\nFetching data from: {url}", flush=True)
+    with stage("download", output_file_path=output_file_path) as span:
+        span.add(bytes_read=download_url_to_file(url, output_file_path, pool=pool))
+    return output_file_path
+
+
+def run_discovery(
+    datasets: list[dict],
+    state: dict,
+    download: Callable[[dict], str],
+    compare: Optional[Callable[[str, str], dict]] = None,
+    dry_run: bool = False,
+    on_change: Optional[Callable[[dict], None]] = None,
+) -> list[dict]:
+    """Download and diff the resources whose metadata has changed, updating the state in place
+
+    Arguments:
+        datasets {list[dict]} -- CKAN dataset metadata
+        state {dict} -- the state store
+        download {Callable[[dict], str]} -- download(resource) returns the downloaded file path
+
+    Keyword Arguments:
+        compare {Optional[Callable[[str, str], dict]]} -- compare(previous_path, new_path) for
+        CSV resources with a previous copy (default: {None})
+        dry_run {bool} -- only report changes, without downloading or updating the state
+        (default: {False})
+        on_change {Optional[Callable[[dict], None]]} -- called with each change once it has been
+        handled, for example to save the state (default: {None})
+
+    Returns:
+        list[dict] -- the changes from discover_changes, with the downloaded "filepath" and the
+        "result" of compare added where they were run
+    """
+    changes = discover_changes(datasets, state)
+    if dry_run:
+        return changes
+
+    for change in changes:
+        if change["status"] == "removed":
+            state["resources"].pop(change["state"]["resource_id"], None)
+        elif change["status"] in ["new", "changed"]:
+            resource = change["resource"]
+            filepath = download(resource)
+            change["filepath"] = filepath
+            previous_path = (change["state"] or {}).get("filepath")
+            if (
+                compare is not None
+                and previous_path is not None
+                and previous_path != filepath
+                and os.path.exists(previous_path)
+                and (resource.get("format") or "").upper() == "CSV"
+            ):
+                change["result"] = compare(previous_path, filepath)
+            record_resource(state, resource, filepath=filepath)
+        if on_change is not None:
+            on_change(change)
+
+    for dataset in datasets:
+        record_dataset(state, dataset)
+    return changes
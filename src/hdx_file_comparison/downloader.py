@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Concurrent paginated downloads from HDX HAPI.
+
+fetch_data_from_hapi requests one page at a time and opens a new connection for each, so large
+themes spend most of their time waiting on round trips and TLS handshakes. Here pages are
+requested by a bounded thread pool, each thread keeps a keep-alive connection per host, failed
+requests are retried with exponential backoff and the page size is adapted to how quickly pages
+come back. Pages are handed back in offset order however they complete.
+"""
+
+import http.client
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+from urllib import parse
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.instrumentation import stage
+from hdx_file_comparison.page_cache import PageCache
+
+DEFAULT_WORKERS = 4
+MIN_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+# Pages returned faster than half this are doubled in size, slower than twice this are halved
+TARGET_PAGE_SECONDS = 2.0
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 60
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PageFetchError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections, one per host for each thread using the pool"""
+
+    def __init__(self, timeout: float = TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self._connections()
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def discard(self, scheme: str, netloc: str):
+        connection = self._connections().pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def _connections(self) -> dict:
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections
+
+
+def http_get(url: str, pool: ConnectionPool, headers: Optional[dict] = None) -> tuple:
+    """GET url over a pooled connection, retrying connection errors and transient HTTP statuses
+    with exponential backoff
+
+    Returns:
+        tuple -- the HTTP status, response headers and body bytes
+    """
+    parsed = parse.urlsplit(url)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            connection = pool.get(parsed.scheme, parsed.netloc)
+            connection.request("GET", path, headers=headers or {})
+            response = connection.getresponse()
+            body = response.read()
+            if response.status not in RETRY_STATUSES:
+                return response.status, response.headers, body
+            reason = f"HTTP status {response.status}"
+        except (OSError, http.client.HTTPException) as error:
+            pool.discard(parsed.scheme, parsed.netloc)
+            reason = repr(error)
+        if attempt < MAX_RETRIES:
+            delay = BACKOFF_SECONDS * 2**attempt
+            print(f"Retrying {url} in {delay:0.1f} seconds after {reason}", flush=True)
+            time.sleep(delay)
+    raise PageFetchError(f"Failed to fetch {url} after {MAX_RETRIES + 1} attempts: {reason}")
+
+
+def cached_http_get(
+    url: str, pool: ConnectionPool, cache: PageCache, headers: Optional[dict] = None
+) -> tuple:
+    """GET url through a page cache. Fresh entries are returned without a request, stale ones
+    are revalidated with their ETag and Last-Modified headers and successful responses are stored.
+
+    Returns:
+        tuple -- the HTTP status, response headers and body bytes
+    """
+    entry = cache.lookup(url)
+    cached = cache.read(url, entry) if entry is not None else None
+    if cached is not None and cache.is_fresh(entry):
+        cache.count("n_hits")
+        return 200, cached[0], cached[1]
+
+    request_headers = dict(headers or {})
+    if cached is not None:
+        if "ETag" in entry["headers"]:
+            request_headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            request_headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+    status, response_headers, body = http_get(url, pool, headers=request_headers)
+    if status == 304 and cached is not None:
+        cache.refresh(url, entry)
+        cache.count("n_revalidated")
+        return 200, cached[0], cached[1]
+
+    cache.count("n_misses")
+    if status == 200:
+        cache.store(url, response_headers, body)
+    return status, response_headers, body
+
+
+def fetch_page(
+    query_url: str,
+    offset: int,
+    limit: int,
+    pool: ConnectionPool,
+    cache: Optional[PageCache] = None,
+) -> tuple:
+    """Fetch a single page of a HAPI query, through cache if given
+
+    Returns:
+        tuple -- the CSV header line (None for JSON output), a list of rows and the elapsed time
+    """
+    url = f"{query_url}&offset={offset}&limit={limit}"
+    t0 = time.time()
+    with stage("download_page", offset=offset, limit=limit) as span:
+        if cache is not None:
+            status, headers, body = cached_http_get(url, pool, cache)
+        else:
+            status, headers, body = http_get(url, pool)
+        if status != 200:
+            raise PageFetchError(f"Failed to fetch {url}: HTTP status {status}")
+        encoding = headers.get_content_charset() or "utf-8"
+        span.add(bytes_read=len(body))
+
+        if "output_format=json" in query_url:
+            data = json.loads(body)["data"]
+            span.add(rows=len(data))
+            return None, data, time.time() - t0
+
+        csv_rows = body.decode(encoding).splitlines()
+        if len(csv_rows) == 0:
+            return None, [], time.time() - t0
+        span.add(rows=len(csv_rows) - 1)
+        return csv_rows[0], csv_rows[1:], time.time() - t0
+
+
+def fetch_data_from_hapi_concurrent(
+    query_url: str,
+    limit: int = 1000,
+    max_workers: int = DEFAULT_WORKERS,
+    on_page: Optional[Callable[[int, Optional[str], list], None]] = None,
+    adaptive_page_size: bool = True,
+    start_offset: int = 0,
+    include_header: bool = True,
+    pool: Optional[ConnectionPool] = None,
+    cache: Optional[PageCache] = None,
+) -> list:
+    """Fetch all pages of a HAPI query concurrently.
+
+    Arguments:
+        query_url {str} -- the query URL, offset and limit parameters are appended
+
+    Keyword Arguments:
+        limit {int} -- the initial number of records per page (default: {1000})
+        max_workers {int} -- maximum number of pages in flight (default: {DEFAULT_WORKERS})
+        on_page {Optional[Callable]} -- called as on_page(offset, header, rows) for each page in
+        offset order, if given rows are not accumulated and an empty list is returned
+        (default: {None})
+        adaptive_page_size {bool} -- adapt the page size to the response time (default: {True})
+        start_offset {int} -- offset of the first record to fetch (default: {0})
+        include_header {bool} -- include the CSV header line in the returned list
+        (default: {True})
+        pool {Optional[ConnectionPool]} -- connection pool to use (default: {None})
+        cache {Optional[PageCache]} -- page cache to fetch through, the page size is not adapted
+        when a cache is used so that pages line up with those cached (default: {None})
+
+    Returns:
+        list -- the CSV lines, header first, or the JSON records
+    """
+    pool = pool if pool is not None else ConnectionPool()
+    adaptive_page_size = adaptive_page_size and cache is None
+    results = []
+    page_size = limit
+    next_offset = start_offset
+    write_offset = start_offset
+    end_reached = False
+    pending = {}
+    completed = {}
+    # Pages past the end are requested before the end is known, so errors are kept by offset and
+    # only raised if they stop the download completing
+    errors = {}
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                # Completed pages wait in memory until the pages before them arrive, so cap them
+                while (
+                    not errors
+                    and not end_reached
+                    and len(pending) < max_workers
+                    and len(pending) + len(completed) < 2 * max_workers
+                ):
+                    future = executor.submit(
+                        fetch_page, query_url, next_offset, page_size, pool, cache
+                    )
+                    pending[future] = (next_offset, page_size)
+                    next_offset += page_size
+                if len(pending) == 0:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset, size = pending.pop(future)
+                    try:
+                        header, rows, elapsed = future.result()
+                    except PageFetchError as page_error:
+                        # Stop requesting pages but let those in flight finish, so that pages
+                        # before the failed one are handed back and a download can resume
+                        errors[offset] = page_error
+                        continue
+                    print(
+                        f"Got results {offset} to {offset + len(rows) - 1} "
+                        f"in {elapsed:0.2f} seconds",
+                        flush=True,
+                    )
+                    completed[offset] = (size, header, rows)
+                    if len(rows) < size:
+                        end_reached = True
+                    if adaptive_page_size:
+                        page_size = _adapt_page_size(page_size, elapsed)
+
+                # Hand back pages in offset order, ignoring any fetched beyond the last page
+                while write_offset in completed:
+                    size, header, rows = completed.pop(write_offset)
+                    if on_page is not None:
+                        on_page(write_offset, header, rows)
+                    else:
+                        if include_header and write_offset == start_offset and header is not None:
+                            results.append(header)
+                        results.extend(rows)
+                    write_offset += size
+                    if len(rows) < size:
+                        completed.clear()
+                        write_offset = None
+                        break
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    if errors and write_offset is not None:
+        raise errors[min(errors)]
+
+    print(f"Download took {time.time()-t0:0.2f} seconds", flush=True)
+    return results
+
+
+def _adapt_page_size(page_size: int, elapsed: float) -> int:
+    if elapsed < TARGET_PAGE_SECONDS / 2:
+        return min(MAX_PAGE_SIZE, page_size * 2)
+    if elapsed > TARGET_PAGE_SECONDS * 2:
+        return max(MIN_PAGE_SIZE, page_size // 2)
+    return page_size
+
+
+def checkpoint_path(output_file_path: str) -> str:
+    return f"{output_file_path}.checkpoint.json"
+
+
+def partial_path(output_file_path: str) -> str:
+    return f"{output_file_path}.part"
+
+
+def read_checkpoint(output_file_path: str) -> Optional[dict]:
+    try:
+        with open(checkpoint_path(output_file_path), encoding="utf-8") as checkpoint_handle:
+            return json.load(checkpoint_handle)
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(output_file_path: str, checkpoint: dict):
+    """Write the checkpoint to a temporary file and rename it, so a checkpoint on disk is never
+    half written"""
+    with atomic_output(
+        checkpoint_path(output_file_path), "w", encoding="utf-8"
+    ) as checkpoint_handle:
+        json.dump(checkpoint, checkpoint_handle)
+
+
+def download_url_to_file(
+    url: str,
+    output_file_path: str,
+    pool: Optional[ConnectionPool] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_BYTES,
+) -> int:
+    """Download a single file, such as an HDX resource, to output_file_path without holding it in
+    memory. The body is written to <output_file_path>.part a chunk at a time and renamed to
+    output_file_path once complete. Connection errors and transient HTTP statuses are retried
+    with exponential backoff, resuming the partial file with a Range request where the server
+    supports it.
+
+    Returns:
+        int -- the number of bytes downloaded
+    """
+    pool = pool or ConnectionPool()
+    parsed = parse.urlsplit(url)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+    part_path = partial_path(output_file_path)
+    for attempt in range(MAX_RETRIES + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        try:
+            connection = pool.get(parsed.scheme, parsed.netloc)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            if response.status in [200, 206]:
+                # A server which ignores the Range header sends the whole file again
+                with open(part_path, "ab" if response.status == 206 else "wb") as output_file:
+                    while True:
+                        chunk = response.read(chunk_size)
+                        if not chunk:
+                            break
+                        output_file.write(chunk)
+                    n_bytes = output_file.tell()
+                os.replace(part_path, output_file_path)
+                return n_bytes
+            response.read()
+            if response.status == 416:
+                os.remove(part_path)
+            elif response.status not in RETRY_STATUSES:
+                raise PageFetchError(f"Failed to fetch {url}: HTTP status {response.status}")
+            reason = f"HTTP status {response.status}"
+        except (OSError, http.client.HTTPException) as error:
+            pool.discard(parsed.scheme, parsed.netloc)
+            reason = repr(error)
+        if attempt < MAX_RETRIES:
+            delay = BACKOFF_SECONDS * 2**attempt
+            print(f"Retrying {url} in {delay:0.1f} seconds after {reason}", flush=True)
+            time.sleep(delay)
+    raise PageFetchError(f"Failed to fetch {url} after {MAX_RETRIES + 1} attempts: {reason}")
+
+
+def download_to_file(
+    query_url: str,
+    output_file_path: str,
+    limit: int = 1000,
+    max_workers: int = DEFAULT_WORKERS,
+    adaptive_page_size: bool = True,
+    pool: Optional[ConnectionPool] = None,
+    on_page: Optional[Callable[[int, Optional[str], list], None]] = None,
+    cache: Optional[PageCache] = None,
+) -> int:
+    """Download a HAPI CSV query to output_file_path, writing each page as it arrives.
+
+    Pages are appended to <output_file_path>.part and after each page a checkpoint recording the
+    next offset, the header and the number of bytes written is saved. If a checkpoint for the same
+    query is found the download resumes from it, provided the header has not changed. When the
+    last page has been written the partial file is renamed to output_file_path. If on_page is
+    given it is called as on_page(offset, header, rows) after each page has been written. If a
+    page cache is given pages are fetched through it.
+
+    Returns:
+        int -- the number of data rows in the downloaded file
+    """
+    checkpoint = read_checkpoint(output_file_path)
+    if (
+        checkpoint is None
+        or checkpoint.get("query_url") != query_url
+        or not os.path.exists(partial_path(output_file_path))
+    ):
+        checkpoint = {
+            "query_url": query_url,
+            "next_offset": 0,
+            "header": None,
+            "bytes_written": 0,
+            "n_rows": 0,
+        }
+    else:
+        print(
+            f"Resuming download of {output_file_path} from offset {checkpoint['next_offset']}",
+            flush=True,
+        )
+
+    with open(partial_path(output_file_path), "ab") as output_file:
+        # Discard anything written after the last checkpoint
+        output_file.truncate(checkpoint["bytes_written"])
+        output_file.seek(checkpoint["bytes_written"])
+
+        def write_page(offset: int, header: Optional[str], rows: list):
+            if checkpoint["header"] is None:
+                checkpoint["header"] = header
+                if header is not None:
+                    output_file.write(f"{header}\n".encode("utf-8"))
+            elif header is not None and header != checkpoint["header"]:
+                raise PageFetchError(
+                    f"Header changed while resuming download of {output_file_path}, "
+                    "delete the checkpoint to restart"
+                )
+            output_file.write("".join(f"{x}\n" for x in rows).encode("utf-8"))
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            checkpoint["next_offset"] = offset + len(rows)
+            checkpoint["bytes_written"] = output_file.tell()
+            checkpoint["n_rows"] += len(rows)
+            write_checkpoint(output_file_path, checkpoint)
+            if on_page is not None:
+                on_page(offset, header, rows)
+
+        with stage("download", output_file_path=output_file_path) as span:
+            n_rows_before = checkpoint["n_rows"]
+            fetch_data_from_hapi_concurrent(
+                query_url,
+                limit=limit,
+                max_workers=max_workers,
+                on_page=write_page,
+                adaptive_page_size=adaptive_page_size,
+                start_offset=checkpoint["next_offset"],
+                pool=pool,
+                cache=cache,
+            )
+            span.add(rows=checkpoint["n_rows"] - n_rows_before)
+
+    os.replace(partial_path(output_file_path), output_file_path)
+    os.remove(checkpoint_path(output_file_path))
+    return checkpoint["n_rows"]
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Byte level checks run before the comparison engines.
+
+Two snapshots of a stable theme are often byte identical, and when they are not they often share
+most of their bytes, with rows appended to or changed near the end of the file. Both files are
+memory mapped and compared a chunk at a time, without decoding or splitting into lines, to decide
+whether they are identical and otherwise how many bytes of whole lines they share at the start and
+at the end. Only the differing middle section, with the header, then needs to be passed to an
+engine.
+
+Lines are split on newline bytes, so a quoted field which spans lines can be split across the
+trimmed and untrimmed sections. HAPI downloads do not contain such fields.
+"""
+
+import mmap
+import os
+import tempfile
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from hdx_file_comparison.instrumentation import stage
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Trimming is skipped if it would save less than this many bytes
+MIN_TRIM_BYTES = 64 * 1024
+
+
+def files_identical(filepath_1: str, filepath_2: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bool:
+    """Check whether two files have the same bytes, comparing sizes first and then memory mapped
+    chunks, stopping at the first chunk which differs"""
+    with stage("fast_path_identical") as span:
+        size = os.path.getsize(filepath_1)
+        if size != os.path.getsize(filepath_2):
+            return False
+        if size == 0:
+            return True
+        with _mapped(filepath_1) as map_1, _mapped(filepath_2) as map_2:
+            for start in range(0, size, chunk_size):
+                end = start + chunk_size
+                span.add(bytes_read=2 * (min(end, size) - start))
+                if map_1[start:end] != map_2[start:end]:
+                    return False
+        return True
+
+
+def common_affixes(
+    filepath_1: str, filepath_2: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> tuple[int, int]:
+    """Find the number of bytes of whole lines which two files share at the start and at the end.
+    The prefix and suffix do not overlap in either file.
+
+    Arguments:
+        filepath_1 {str} -- path to the original file
+        filepath_2 {str} -- path to the new file
+
+    Keyword Arguments:
+        chunk_size {int} -- bytes compared at a time (default: {DEFAULT_CHUNK_SIZE})
+
+    Returns:
+        tuple[int, int] -- lengths in bytes of the common prefix and common suffix
+    """
+    size_1 = os.path.getsize(filepath_1)
+    size_2 = os.path.getsize(filepath_2)
+    if size_1 == 0 or size_2 == 0:
+        return 0, 0
+    with stage("fast_path_affixes"), _mapped(filepath_1) as map_1, _mapped(filepath_2) as map_2:
+        shortest = min(size_1, size_2)
+        prefix = _common_prefix_length(map_1, map_2, shortest, chunk_size)
+        if prefix < shortest or size_1 != size_2:
+            # Back up to the end of the last complete line
+            prefix = map_1.rfind(b"\n", 0, prefix) + 1
+
+        suffix = _common_suffix_length(map_1, map_2, shortest - prefix, chunk_size)
+        # Move forward to the start of the first complete line, the suffix of the file which
+        # ends first is a complete line if it starts just after the prefix
+        start_1 = size_1 - suffix
+        start_2 = size_2 - suffix
+        if suffix > 0 and not (
+            _line_starts_at(map_1, start_1, prefix) and _line_starts_at(map_2, start_2, prefix)
+        ):
+            newline = map_1.find(b"\n", start_1, size_1)
+            suffix = size_1 - newline - 1 if newline != -1 else 0
+    return prefix, suffix
+
+
+def _line_starts_at(file_map: mmap.mmap, position: int, prefix: int) -> bool:
+    return position == prefix or file_map[position - 1] == ord("\n")
+
+
+def _common_prefix_length(map_1: mmap.mmap, map_2: mmap.mmap, limit: int, chunk_size: int) -> int:
+    start = 0
+    while start < limit:
+        end = min(start + chunk_size, limit)
+        chunk_1 = map_1[start:end]
+        chunk_2 = map_2[start:end]
+        if chunk_1 != chunk_2:
+            return start + _first_difference(chunk_1, chunk_2)
+        start = end
+    return limit
+
+
+def _common_suffix_length(map_1: mmap.mmap, map_2: mmap.mmap, limit: int, chunk_size: int) -> int:
+    size_1 = len(map_1)
+    size_2 = len(map_2)
+    length = 0
+    while length < limit:
+        step = min(chunk_size, limit - length)
+        start_1 = size_1 - length - step
+        start_2 = size_2 - length - step
+        end_1 = start_1 + step
+        end_2 = start_2 + step
+        chunk_1 = map_1[start_1:end_1]
+        chunk_2 = map_2[start_2:end_2]
+        if chunk_1 != chunk_2:
+            return length + _first_difference(chunk_1[::-1], chunk_2[::-1])
+        length += step
+    return limit
+
+
+def _first_difference(chunk_1: bytes, chunk_2: bytes) -> int:
+    """Index of the first differing byte of two chunks of the same length, by bisection so that
+    the comparisons are of slices rather than single bytes"""
+    low = 0
+    high = len(chunk_1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if chunk_1[low:middle] == chunk_2[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+@contextmanager
+def _mapped(filepath: str) -> Iterator[mmap.mmap]:
+    with open(filepath, "rb") as file_handle:
+        file_map = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield file_map
+        finally:
+            file_map.close()
+
+
+@contextmanager
+def trimmed_files(
+    filepath_1: str,
+    filepath_2: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    min_trim_bytes: int = MIN_TRIM_BYTES,
+) -> Iterator[tuple[str, str, int]]:
+    """Write the header and the differing middle section of each file to temporary files, which
+    are deleted at the end of the with block. Line numbers in the trimmed files are offset from
+    those in the original files by the number of common lines after the header. If too little is
+    shared the original files are used.
+
+    Arguments:
+        filepath_1 {str} -- path to the original file
+        filepath_2 {str} -- path to the new file
+
+    Keyword Arguments:
+        chunk_size {int} -- bytes compared at a time (default: {DEFAULT_CHUNK_SIZE})
+        min_trim_bytes {int} -- smallest saving for which files are trimmed
+        (default: {MIN_TRIM_BYTES})
+
+    Yields:
+        tuple[str, str, int] -- paths to the two files to compare and the line offset
+    """
+    prefix, suffix = common_affixes(filepath_1, filepath_2, chunk_size=chunk_size)
+    if prefix + suffix < min_trim_bytes:
+        yield filepath_1, filepath_2, 0
+        return
+
+    with tempfile.TemporaryDirectory(prefix="hdx-compare-trimmed-") as directory:
+        trimmed = []
+        with stage("fast_path_trim") as span:
+            for i, filepath in enumerate([filepath_1, filepath_2], start=1):
+                trimmed_path = os.path.join(directory, f"file_{i}{os.path.splitext(filepath)[1]}")
+                _write_middle(filepath, trimmed_path, prefix, suffix, chunk_size)
+                span.add(bytes_read=os.path.getsize(trimmed_path))
+                trimmed.append(trimmed_path)
+            line_offset = _count_lines(filepath_1, prefix, chunk_size)
+        # The header is kept, so it is not part of the offset
+        yield trimmed[0], trimmed[1], max(0, line_offset - 1)
+
+
+def _write_middle(filepath: str, output_path: str, prefix: int, suffix: int, chunk_size: int):
+    with open(filepath, "rb") as input_handle, open(output_path, "wb") as output_handle:
+        if prefix > 0:
+            output_handle.write(input_handle.readline())
+        input_handle.seek(prefix)
+        remaining = os.path.getsize(filepath) - prefix - suffix
+        while remaining > 0:
+            chunk = input_handle.read(min(chunk_size, remaining))
+            output_handle.write(chunk)
+            remaining -= len(chunk)
+
+
+def _count_lines(filepath: str, length: int, chunk_size: int) -> int:
+    n_lines = 0
+    with open(filepath, "rb") as file_handle:
+        while length > 0:
+            chunk = file_handle.read(min(chunk_size, length))
+            n_lines += chunk.count(b"\n")
+            length -= len(chunk)
+    return n_lines
+
+
+def offset_rows(cell_changes: list[dict], line_offset: int) -> list[dict]:
+    """Shift the row numbers of cell changes found in trimmed files back to the original files"""
+    if line_offset == 0:
+        return cell_changes
+    for cell_change in cell_changes:
+        cell_change["row"] += line_offset
+    return cell_changes
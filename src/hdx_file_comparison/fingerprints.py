@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compact row fingerprints for set based comparison of files.
+
+Rather than holding every line of a file as a Python string, each line is reduced to a 64 bit
+fingerprint, the top half of its BLAKE2b row hash, stored in a packed array along with the byte
+offset of the line. That is 16 bytes a row whatever the line length. Unique counts, duplicates,
+intersections and differences are computed on sorted copies of the fingerprints, and the lines
+themselves are only read back from the file, by offset, for the rows which are printed.
+
+The 128 bit row hashes are summed as the file is read, so the file hash is the same as
+multiset_digest and the digest sidecars.
+"""
+
+import codecs
+import heapq
+
+from array import array
+from collections import Counter
+from hashlib import blake2b
+from itertools import compress, count, islice
+from operator import eq, ne
+from typing import Iterable, Iterator, Optional
+
+from hdx_file_comparison.digests import DIGEST_BITS, DIGEST_MASK, format_digest
+
+FINGERPRINT_SHIFT = DIGEST_BITS - 64
+
+
+class LineFingerprints:
+    def __init__(self, filepath: str, encoding: str = "utf-8", line_limit: Optional[int] = None):
+        """Read a file, recording the fingerprint and offset of each line
+
+        Arguments:
+            filepath {str} -- path to the file
+
+        Keyword Arguments:
+            encoding {str} -- file encoding (default: {"utf-8"})
+            line_limit {Optional[int]} -- only read this many lines (default: {None})
+        """
+        self.filepath = filepath
+        self.encoding = encoding
+        self.fingerprints = array("Q")
+        self.offsets = array("Q")
+        self.bytes_read = 0
+        total = 0
+        # UTF-8 lines are hashed as read, which gives the same hash as row_hash on the decoded line
+        is_utf8 = codecs.lookup(encoding).name == "utf-8"
+        append_fingerprint = self.fingerprints.append
+        append_offset = self.offsets.append
+        with open(filepath, "rb") as file_handle:
+            for line in islice(file_handle, line_limit):
+                line_bytes = line.rstrip(b"\r\n") if is_utf8 else self._decode(line).encode("utf-8")
+                row_hash_value = int.from_bytes(
+                    blake2b(line_bytes, digest_size=DIGEST_BITS // 8).digest(), "big"
+                )
+                total = (total + row_hash_value) & DIGEST_MASK
+                append_fingerprint(row_hash_value >> FINGERPRINT_SHIFT)
+                append_offset(self.bytes_read)
+                self.bytes_read += len(line)
+        self.digest = format_digest(total)
+        self._sorted = None
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def _decode(self, line: bytes) -> str:
+        return line.decode(self.encoding).rstrip("\r\n")
+
+    def sorted_fingerprints(self) -> array:
+        if self._sorted is None:
+            self._sorted = array("Q", sorted(self.fingerprints))
+        return self._sorted
+
+    def unique_fingerprints(self) -> array:
+        """Sorted fingerprints with repeats removed"""
+        sorted_fingerprints = self.sorted_fingerprints()
+        return array("Q", compress(sorted_fingerprints, _run_starts(sorted_fingerprints)))
+
+    def n_unique(self) -> int:
+        sorted_fingerprints = self.sorted_fingerprints()
+        if len(sorted_fingerprints) == 0:
+            return 0
+        return 1 + sum(map(ne, islice(sorted_fingerprints, 1, None), sorted_fingerprints))
+
+    def repeated(self) -> Counter:
+        """The number of times each fingerprint which appears more than once is seen"""
+        sorted_fingerprints = self.sorted_fingerprints()
+        following = islice(sorted_fingerprints, 1, None)
+        # Each element equal to the one before it is a repeat
+        repeats = Counter(
+            compress(islice(sorted_fingerprints, 1, None), map(eq, following, sorted_fingerprints))
+        )
+        for fingerprint in repeats:
+            repeats[fingerprint] += 1
+        return repeats
+
+    def lines(self, fingerprints: Iterable[int]) -> Iterator[tuple[int, str]]:
+        """Read back the first line with each of the fingerprints, in file order
+
+        Yields:
+            tuple[int, str] -- the fingerprint and the line without its line ending
+        """
+        wanted = set(fingerprints)
+        if not wanted:
+            return
+        positions = compress(count(), map(wanted.__contains__, self.fingerprints))
+        with open(self.filepath, "rb") as file_handle:
+            for position in positions:
+                fingerprint = self.fingerprints[position]
+                if fingerprint not in wanted:
+                    continue
+                wanted.discard(fingerprint)
+                file_handle.seek(self.offsets[position])
+                yield fingerprint, self._decode(file_handle.readline())
+                if not wanted:
+                    return
+
+
+def _run_starts(sorted_fingerprints: array) -> Iterator[bool]:
+    """Yield True for each element of a sorted array which differs from the one before it"""
+    if len(sorted_fingerprints) == 0:
+        return
+    yield True
+    yield from map(ne, islice(sorted_fingerprints, 1, None), sorted_fingerprints)
+
+
+def merge_unique(unique_1: array, unique_2: array) -> tuple[int, array, array]:
+    """Intersection and differences of two sorted arrays of unique fingerprints, in one pass
+
+    Returns:
+        tuple[int, array, array] -- the number in both arrays, those only in the first and those
+        only in the second
+    """
+    only_1 = array("Q")
+    only_2 = array("Q")
+    n_common = 0
+    i = 0
+    j = 0
+    n_1 = len(unique_1)
+    n_2 = len(unique_2)
+    while i < n_1 and j < n_2:
+        fingerprint_1 = unique_1[i]
+        fingerprint_2 = unique_2[j]
+        if fingerprint_1 == fingerprint_2:
+            n_common += 1
+            i += 1
+            j += 1
+        elif fingerprint_1 < fingerprint_2:
+            only_1.append(fingerprint_1)
+            i += 1
+        else:
+            only_2.append(fingerprint_2)
+            j += 1
+    only_1.extend(islice(unique_1, i, None))
+    only_2.extend(islice(unique_2, j, None))
+    return n_common, only_1, only_2
+
+
+def first_lines(fingerprints: LineFingerprints, wanted: array, n: int = 10) -> list[str]:
+    """The n lines which sort first among the lines with the wanted fingerprints"""
+    return heapq.nsmallest(n, (line for _, line in fingerprints.lines(wanted)))
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""History of the snapshots of one file, stored as full bases and keyed deltas.
+
+The first snapshot added to a store is kept in full as a columnar snapshot. Each later snapshot is
+matched against the one before it on the key columns, repeated keys being paired in order as in
+keyed_compare, and stored as a delta listing the rows removed, the cells changed and the rows
+added with their positions. Any snapshot is rebuilt by reading the latest base before it and
+applying the deltas which follow. A new base is written every rebase_interval snapshots to cap the
+cost of a rebuild, and whenever a delta cannot describe a snapshot compactly: when the header
+or HXL tags change, when rows are reordered, or when more than MAX_DELTA_FRACTION of the rows
+change.
+
+Every delta also updates an index recording, for each row, the snapshot in which it was added or
+removed and the snapshot in which each of its cells last changed, so "when did this cell last
+change" is answered without rebuilding or diffing any snapshots.
+
+The layout under the store directory is history.json for the list of snapshots, bases/<version>
+.hdxcol, deltas/<version>.json.gz and cell_index.json.gz.
+"""
+
+import csv
+import gzip
+import json
+import os
+import re
+
+from typing import Optional
+
+from hdx_file_comparison.atomic import write_atomic
+from hdx_file_comparison.instrumentation import stage
+from hdx_file_comparison.snapshot import (
+    SNAPSHOT_EXTENSION,
+    _fit,
+    is_hxl_row,
+    iter_row_groups,
+    read_snapshot_index,
+    write_snapshot,
+)
+from hdx_file_comparison.utilities import _key_indices
+
+HISTORY_FILENAME = "history.json"
+INDEX_FILENAME = "cell_index.json.gz"
+DEFAULT_REBASE_INTERVAL = 8
+# A snapshot is stored as a base if more than this fraction of its rows change
+MAX_DELTA_FRACTION = 0.5
+KEY_SEPARATOR = "\x1f"
+
+
+def key_string(key: list[str], occurrence: int = 0) -> str:
+    """The index key for a row, occurrence counting earlier rows with the same key values"""
+    return KEY_SEPARATOR.join([*key, str(occurrence)])
+
+
+def version_from_filename(filepath: str) -> str:
+    """The date a snapshot's filename starts with, otherwise its name without extension"""
+    filename = os.path.basename(filepath)
+    match = re.match(r"\d{4}-\d{2}-\d{2}", filename)
+    return match.group(0) if match else os.path.splitext(filename)[0]
+
+
+class HistoryStore:
+    def __init__(
+        self,
+        directory: str,
+        key_columns: Optional[list[str]] = None,
+        rebase_interval: int = DEFAULT_REBASE_INTERVAL,
+    ):
+        """Open, or create, a history store
+
+        Arguments:
+            directory {str} -- directory holding the store
+
+        Keyword Arguments:
+            key_columns {Optional[list[str]]} -- columns which together identify a row, required
+            to create a store (default: {None})
+            rebase_interval {int} -- most snapshots stored as deltas after a base, only used when
+            creating a store (default: {DEFAULT_REBASE_INTERVAL})
+        """
+        self.directory = directory
+        manifest_path = os.path.join(directory, HISTORY_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as manifest_handle:
+                self.manifest = json.load(manifest_handle)
+            if key_columns is not None and key_columns != self.manifest["key_columns"]:
+                raise ValueError(
+                    f"History store {directory} is keyed on {self.manifest['key_columns']}, "
+                    f"not {key_columns}"
+                )
+            index_path = os.path.join(directory, INDEX_FILENAME)
+            with gzip.open(index_path, "rt", encoding="utf-8") as index_handle:
+                self.index = json.load(index_handle)
+        else:
+            if not key_columns:
+                raise ValueError("key_columns are required to create a history store")
+            self.manifest = {
+                "key_columns": key_columns,
+                "rebase_interval": rebase_interval,
+                "versions": [],
+            }
+            self.index = {"rows": {}}
+
+    @property
+    def versions(self) -> list[dict]:
+        return self.manifest["versions"]
+
+    @property
+    def key_columns(self) -> list[str]:
+        return self.manifest["key_columns"]
+
+    def version_ids(self) -> list[str]:
+        return [x["version_id"] for x in self.versions]
+
+    def _position(self, version_id: str) -> int:
+        try:
+            return self.version_ids().index(version_id)
+        except ValueError:
+            raise ValueError(f"Version {version_id} is not in the history store") from None
+
+    def add_version(self, filepath: str, version_id: Optional[str] = None) -> dict:
+        """Add a snapshot as a delta against the latest one, or as a new base
+
+        Arguments:
+            filepath {str} -- path to the CSV snapshot
+
+        Keyword Arguments:
+            version_id {Optional[str]} -- label for the snapshot
+            (default: {version_from_filename(filepath)})
+
+        Returns:
+            dict -- the stored version, with its kind, "base" or "delta", and the numbers of rows
+            added, removed and changed
+        """
+        version_id = version_id or version_from_filename(filepath)
+        if version_id in self.version_ids():
+            raise ValueError(f"Version {version_id} is already in the history store")
+        table = read_table(filepath)
+
+        if len(self.versions) == 0:
+            empty = {"header": table["header"], "hxl": table["hxl"], "rows": []}
+            delta = compute_delta(empty, table, self.key_columns)
+            keep_base = True
+        else:
+            previous = self.rebuild(self.versions[-1]["version_id"])
+            with stage("history_delta", version=version_id) as span:
+                delta = compute_delta(previous, table, self.key_columns)
+                n_delta_rows = len(delta["removed"]) + len(delta["changed"]) + len(delta["added"])
+                n_deltas = len(self.versions) - 1 - self._last_base_position(len(self.versions))
+                keep_base = (
+                    previous["header"] != table["header"]
+                    or previous["hxl"] != table["hxl"]
+                    or n_deltas >= self.manifest["rebase_interval"]
+                    or n_delta_rows > MAX_DELTA_FRACTION * max(1, len(table["rows"]))
+                    or apply_delta(previous, delta, self.key_columns)["rows"] != table["rows"]
+                )
+                span.add(rows=len(table["rows"]), bytes_read=os.path.getsize(filepath))
+
+        version = {
+            "version_id": version_id,
+            "source": os.path.abspath(filepath),
+            "kind": "base" if keep_base else "delta",
+            "n_rows": len(table["rows"]),
+            "n_added": len(delta["added"]),
+            "n_removed": len(delta["removed"]),
+            "n_changed": len(delta["changed"]),
+        }
+        if keep_base:
+            path = os.path.join(self.directory, "bases", f"{version_id}{SNAPSHOT_EXTENSION}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_snapshot(filepath, path)
+        else:
+            path = os.path.join(self.directory, "deltas", f"{version_id}.json.gz")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, gzip.compress(json.dumps(delta).encode("utf-8")))
+        version["path"] = os.path.relpath(path, self.directory)
+        version["bytes"] = os.path.getsize(path)
+
+        self._update_index(version_id, delta)
+        self.versions.append(version)
+        self._save()
+        return version
+
+    def _last_base_position(self, end: int) -> int:
+        """Position of the last base among the first end versions"""
+        return max(i for i, x in enumerate(self.versions[0:end]) if x["kind"] == "base")
+
+    def rebuild(self, version_id: str) -> dict:
+        """Rebuild a snapshot from the latest base before it and the deltas which follow
+
+        Returns:
+            dict -- the header, the HXL row, None if there was none, and the rows as tuples
+        """
+        position = self._position(version_id)
+        base_position = self._last_base_position(position + 1)
+        with stage("history_rebuild", version=version_id) as span:
+            table = read_base(os.path.join(self.directory, self.versions[base_position]["path"]))
+            start = base_position + 1
+            end = position + 1
+            for version in self.versions[start:end]:
+                delta_path = os.path.join(self.directory, version["path"])
+                with gzip.open(delta_path, "rt", encoding="utf-8") as delta_handle:
+                    table = apply_delta(table, json.load(delta_handle), self.key_columns)
+            span.add(rows=len(table["rows"]))
+        return table
+
+    def write_version(self, version_id: str, output_path: str) -> int:
+        """Write a rebuilt snapshot as a CSV file
+
+        Returns:
+            int -- the number of rows written, not counting the header and HXL rows
+        """
+        table = self.rebuild(version_id)
+        with open(output_path, "w", encoding="utf-8", newline="") as output_handle:
+            csv_writer = csv.writer(output_handle, lineterminator="\n")
+            csv_writer.writerow(table["header"])
+            if table["hxl"] is not None:
+                csv_writer.writerow(table["hxl"])
+            csv_writer.writerows(table["rows"])
+        return len(table["rows"])
+
+    def last_changed(
+        self, key: list[str], column: Optional[str] = None, occurrence: int = 0
+    ) -> Optional[str]:
+        """The version in which a cell, or if column is None any cell of a row, last changed,
+        from the index. Adding or removing a row changes all of its cells.
+
+        Arguments:
+            key {list[str]} -- values of the key columns of the row
+
+        Keyword Arguments:
+            column {Optional[str]} -- column of the cell (default: {None})
+            occurrence {int} -- which of the rows with this key, in file order (default: {0})
+
+        Returns:
+            Optional[str] -- the version, None if the row has never been seen
+        """
+        entry = self.index["rows"].get(key_string(key, occurrence))
+        if entry is None:
+            return None
+        if "removed" in entry:
+            return entry["removed"]
+        if column is not None:
+            return entry["cells"].get(column, entry["added"])
+        return max([entry["added"], *entry["cells"].values()], key=self._position)
+
+    def _update_index(self, version_id: str, delta: dict):
+        rows = self.index["rows"]
+        for key in delta["removed"]:
+            rows[key]["removed"] = version_id
+        for key, values in delta["changed"]:
+            for column in values:
+                rows[key]["cells"][column] = version_id
+        # A row added again after being removed starts a new history
+        for _, key, _ in delta["added"]:
+            rows[key] = {"added": version_id, "cells": {}}
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(
+            os.path.join(self.directory, INDEX_FILENAME),
+            gzip.compress(json.dumps(self.index).encode("utf-8")),
+        )
+        write_atomic(
+            os.path.join(self.directory, HISTORY_FILENAME),
+            json.dumps(self.manifest, indent=2).encode("utf-8"),
+        )
+
+
+def read_table(filepath: str, encoding: str = "utf-8") -> dict:
+    """Read a CSV snapshot, with the HXL row, if there is one, apart from the rows
+
+    Returns:
+        dict -- the header, the HXL row or None and the rows as tuples padded to the header length
+    """
+    with open(filepath, encoding=encoding, newline="") as file_handle:
+        csv_reader = csv.reader(file_handle)
+        header = next(csv_reader, [])
+        rows = [tuple(_fit(x, len(header))) for x in csv_reader]
+    hxl = None
+    if rows and is_hxl_row(list(rows[0])):
+        hxl = list(rows.pop(0))
+    return {"header": header, "hxl": hxl, "rows": rows}
+
+
+def read_base(filepath: str) -> dict:
+    index = read_snapshot_index(filepath)
+    rows = []
+    for row_group in iter_row_groups(filepath):
+        rows.extend(zip(*[row_group[x] for x in index["header"]]))
+    return {"header": index["header"], "hxl": index["hxl"], "rows": rows}
+
+
+def _keyed_rows_iter(rows: list[tuple], key_idxs: list[int]):
+    """Yield the position and key string of each row, repeated keys numbered in order"""
+    occurrences = {}
+    for position, row in enumerate(rows):
+        key = [row[i] for i in key_idxs]
+        joined = KEY_SEPARATOR.join(key)
+        occurrence = occurrences.get(joined, 0)
+        occurrences[joined] = occurrence + 1
+        yield position, key_string(key, occurrence)
+
+
+def compute_delta(previous: dict, current: dict, key_columns: list[str]) -> dict:
+    """Describe current as changes to previous, rows being matched on the key columns
+
+    Returns:
+        dict -- the keys of the rows removed, the key and new values of the cells changed in each
+        changed row and the position in current, key and values of each row added
+    """
+    previous_keys = dict(
+        _keyed_rows_iter(
+            previous["rows"], _key_indices(previous["header"], key_columns, "previous")
+        )
+    )
+    previous_positions = {key: position for position, key in previous_keys.items()}
+    columns = list(dict.fromkeys([*previous["header"], *current["header"]]))
+    previous_idxs = [
+        previous["header"].index(x) if x in previous["header"] else None for x in columns
+    ]
+    current_idxs = [current["header"].index(x) if x in current["header"] else None for x in columns]
+
+    changed = []
+    added = []
+    seen = set()
+    for position, key in _keyed_rows_iter(
+        current["rows"], _key_indices(current["header"], key_columns, "current")
+    ):
+        row = current["rows"][position]
+        previous_position = previous_positions.get(key)
+        if previous_position is None:
+            added.append([position, key, list(row)])
+            continue
+        seen.add(key)
+        previous_row = previous["rows"][previous_position]
+        if previous["header"] == current["header"] and previous_row == row:
+            continue
+        values = {}
+        for column, i, j in zip(columns, previous_idxs, current_idxs):
+            previous_value = previous_row[i] if i is not None else ""
+            value = row[j] if j is not None else ""
+            if previous_value != value:
+                values[column] = value
+        if values:
+            changed.append([key, values])
+
+    removed = [x for x in previous_keys.values() if x not in seen]
+    return {"removed": removed, "changed": changed, "added": added}
+
+
+def apply_delta(table: dict, delta: dict, key_columns: list[str]) -> dict:
+    """Apply a delta with the same header as table, returning the new table"""
+    header = table["header"]
+    positions = {
+        key: position
+        for position, key in _keyed_rows_iter(
+            table["rows"], _key_indices(header, key_columns, "snapshot")
+        )
+    }
+    rows = list(table["rows"])
+    for key, values in delta["changed"]:
+        row = list(rows[positions[key]])
+        for column, value in values.items():
+            row[header.index(column)] = value
+        rows[positions[key]] = tuple(row)
+
+    removed = {positions[x] for x in delta["removed"]}
+    kept = (x for i, x in enumerate(rows) if i not in removed)
+    # Added rows are merged in at their positions in the new snapshot
+    new_rows = []
+    for position, _, row in sorted(delta["added"], key=lambda x: x[0]):
+        while len(new_rows) < position:
+            new_rows.append(next(kept))
+        new_rows.append(tuple(row))
+    new_rows.extend(kept)
+    return {"header": header, "hxl": table["hxl"], "rows": new_rows}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Timing and resource use of each stage of a comparison.
+
+Code wraps a stage, such as downloading a page, parsing, hashing, diffing or detecting cell
+changes, in a span:
+
+    with stage("parse", filepath=filepath) as span:
+        rows = ...
+        span.add(rows=len(rows), bytes_read=os.path.getsize(filepath))
+
+When the span ends its wall time, CPU time, the peak resident set size of the process so far,
+bytes read and rows processed are recorded, along with the name of the enclosing span on the same
+thread. Spans are kept in memory, can be streamed as NDJSON to a file and are passed to any
+registered callbacks, which is the hook for profilers. Only the most recent max_spans records are
+kept in memory and the totals for each stage are added up as spans end, so a long running process
+such as the comparison service does not grow with every span. CPU time is for the whole process,
+so it includes other threads running at the same time. Peak RSS is not available on Windows.
+"""
+
+import cProfile
+import datetime
+import json
+import sys
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+DEFAULT_MAX_SPANS = 10_000
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional[str], attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.rows = 0
+        self.bytes_read = 0
+
+    def add(self, rows: int = 0, bytes_read: int = 0):
+        self.rows += rows
+        self.bytes_read += bytes_read
+
+
+class MetricsRecorder:
+    def __init__(self, max_spans: int = DEFAULT_MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self._totals = {}
+        self._callbacks = []
+        self._output = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str, **attributes) -> Iterator[Span]:
+        """Record a span for the code in the with block, the attributes are included in the
+        record and must be JSON serialisable"""
+        stack = self._stack()
+        span = Span(name, stack[-1].name if stack else None, attributes)
+        stack.append(span)
+        started = datetime.datetime.now().isoformat()
+        t0 = time.perf_counter()
+        cpu_0 = time.process_time()
+        try:
+            yield span
+        finally:
+            stack.pop()
+            self.record(
+                {
+                    "stage": name,
+                    "parent": span.parent,
+                    "started": started,
+                    "wall_seconds": time.perf_counter() - t0,
+                    "cpu_seconds": time.process_time() - cpu_0,
+                    "peak_rss_bytes": peak_rss_bytes(),
+                    "bytes_read": span.bytes_read,
+                    "rows": span.rows,
+                    **span.attributes,
+                }
+            )
+
+    def record(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+            self._add_to_totals(record)
+            if self._output is not None:
+                self._output.write(json.dumps(record) + "\n")
+                self._output.flush()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(record)
+
+    def add_callback(self, callback: Callable[[dict], None]):
+        """Call callback with each span record as it ends"""
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[dict], None]):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def open_output(self, filepath: str):
+        """Append each span record to filepath as a line of JSON"""
+        self.close_output()
+        with self._lock:
+            self._output = open(filepath, "a", encoding="utf-8")
+
+    def close_output(self):
+        with self._lock:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self._totals = {}
+
+    def summary(self) -> dict:
+        """Totals for each stage name
+
+        Returns:
+            dict -- the number of spans, wall and CPU time, bytes read and rows for each stage,
+            and the largest peak RSS seen
+        """
+        with self._lock:
+            return {name: dict(total) for name, total in self._totals.items()}
+
+    def _add_to_totals(self, record: dict):
+        total = self._totals.setdefault(
+            record["stage"],
+            {
+                "n_spans": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "bytes_read": 0,
+                "rows": 0,
+                "peak_rss_bytes": None,
+            },
+        )
+        total["n_spans"] += 1
+        for key in ["wall_seconds", "cpu_seconds", "bytes_read", "rows"]:
+            total[key] += record[key]
+        if record["peak_rss_bytes"] is not None:
+            total["peak_rss_bytes"] = max(total["peak_rss_bytes"] or 0, record["peak_rss_bytes"])
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+RECORDER = MetricsRecorder()
+
+
+def stage(name: str, **attributes):
+    """Record a span on the default recorder, see MetricsRecorder.stage"""
+    return RECORDER.stage(name, **attributes)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+@contextmanager
+def profile(output_path: Optional[str] = None) -> Iterator[Optional[cProfile.Profile]]:
+    """Run the with block under cProfile, writing the stats to output_path for pstats or
+    snakeviz. Does nothing if output_path is None."""
+    if output_path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
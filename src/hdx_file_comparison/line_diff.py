@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Line diff engines which can be used by difflib_compare in place of difflib.ndiff.
+
+Every engine takes two lists of lines and yields lines in the ndiff format, "  " for unchanged
+lines, "- " and "+ " for removed and added lines and "? " for intraline hints. difflib.ndiff
+compares every line in a changed block against every other to find the best matching pairs,
+which is expensive on large files. The myers and patience engines find the changed blocks with
+a cheaper line level algorithm and then pair lines within a changed block as ndiff does, but
+only comparing lines which are close to each other, so the output is the same as ndiff's for
+changed rows of a CSV file.
+"""
+
+import bisect
+import difflib
+import heapq
+
+from typing import Callable, Iterator
+
+# The similarity above which ndiff treats a removed and added line as a changed line
+PAIR_CUTOFF = 0.75
+# How far from its position to look for a partner line when pairing lines in a changed block
+PAIR_WINDOW = 8
+
+
+def ndiff_engine(a: list[str], b: list[str]) -> Iterator[str]:
+    return difflib.ndiff(a, b)
+
+
+def myers_engine(a: list[str], b: list[str]) -> Iterator[str]:
+    a_codes, b_codes = _encode(a, b)
+    matches = myers_matches(a_codes, b_codes)
+    return _render(a, b, _matches_to_opcodes(matches, len(a), len(b)))
+
+
+def patience_engine(a: list[str], b: list[str]) -> Iterator[str]:
+    a_codes, b_codes = _encode(a, b)
+    matches = patience_matches(a_codes, b_codes)
+    return _render(a, b, _matches_to_opcodes(matches, len(a), len(b)))
+
+
+def sequence_changes(a: list[str], b: list[str], algorithm: str = "myers") -> list[tuple[int, str]]:
+    """Diff two sequences of values, such as the values of a column, without intraline hints
+
+    Arguments:
+        a {list[str]} -- the original values
+        b {list[str]} -- the new values
+
+    Keyword Arguments:
+        algorithm {str} -- "myers" or "patience" (default: {"myers"})
+
+    Returns:
+        list[tuple[int, str]] -- ("position", "- value") and ("position", "+ value") pairs, the
+        position counting unchanged, removed and added values in diff order, with the removed
+        values of a changed block before the added values
+    """
+    if algorithm not in SEQUENCE_MATCHERS:
+        raise ValueError(
+            f"Unknown sequence diff algorithm '{algorithm}', "
+            f"expected one of {list(SEQUENCE_MATCHERS)}"
+        )
+    a_codes, b_codes = _encode(a, b)
+    matches = SEQUENCE_MATCHERS[algorithm](a_codes, b_codes)
+    changes = []
+    position = 0
+    for tag, i1, i2, j1, j2 in _matches_to_opcodes(matches, len(a), len(b)):
+        if tag == "equal":
+            position += i2 - i1
+            continue
+        for value in a[i1:i2]:
+            changes.append((position, f"- {value}"))
+            position += 1
+        for value in b[j1:j2]:
+            changes.append((position, f"+ {value}"))
+            position += 1
+    return changes
+
+
+LINE_DIFF_ENGINES: dict[str, Callable[[list[str], list[str]], Iterator[str]]] = {
+    "ndiff": ndiff_engine,
+    "myers": myers_engine,
+    "patience": patience_engine,
+}
+
+
+def _encode(a: list, b: list) -> tuple[list[int], list[int]]:
+    """Replace each item with an integer code so the diff algorithms compare integers"""
+    codes = {}
+    a_codes = [codes.setdefault(x, len(codes)) for x in a]
+    b_codes = [codes.setdefault(x, len(codes)) for x in b]
+    return a_codes, b_codes
+
+
+def myers_matches(a: list, b: list, a_lo: int = 0, a_hi=None, b_lo: int = 0, b_hi=None) -> list:
+    """Find a longest common subsequence of a[a_lo:a_hi] and b[b_lo:b_hi] using the linear space
+    variant of Myers' O(ND) algorithm, which bisects the problem at the middle snake of an
+    optimal edit path.
+
+    Returns:
+        list -- sorted (i, j) pairs where a[i] == b[j] is part of the common subsequence
+    """
+    a_hi = len(a) if a_hi is None else a_hi
+    b_hi = len(b) if b_hi is None else b_hi
+    matches = []
+    stack = [(a_lo, a_hi, b_lo, b_hi)]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            matches.append((a_hi, b_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        x, y, u, v = _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+        for k in range(u - x):
+            matches.append((x + k, y + k))
+        stack.append((a_lo, x, b_lo, y))
+        stack.append((u, a_hi, v, b_hi))
+    matches.sort()
+    return matches
+
+
+def _middle_snake(a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> tuple:
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    delta = n - m
+    odd = delta % 2 == 1
+    # Furthest reaching x on each diagonal k = x - y, forwards from the start and backwards from
+    # the end, with the backward search working on the reversed sequences
+    v_forward = {1: 0}
+    v_backward = {1: 0}
+    for d in range(0, (n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v_forward[k - 1] < v_forward[k + 1]):
+                x = v_forward[k + 1]
+            else:
+                x = v_forward[k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v_forward[k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1):
+                if x + v_backward[delta - k] >= n:
+                    return a_lo + x_start, b_lo + y_start, a_lo + x, b_lo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v_backward[k - 1] < v_backward[k + 1]):
+                x = v_backward[k + 1]
+            else:
+                x = v_backward[k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            v_backward[k] = x
+            if not odd and -d <= delta - k <= d:
+                if x + v_forward[delta - k] >= n:
+                    return a_hi - x, b_hi - y, a_hi - x_start, b_hi - y_start
+    raise AssertionError("Myers middle snake not found")
+
+
+def patience_matches(a: list, b: list) -> list:
+    """Find a common subsequence of a and b using patience diff: lines which occur exactly once in
+    each region are used as anchors, the longest increasing run of anchors is kept and the regions
+    between anchors are processed in the same way. Regions without unique lines fall back to
+    myers_matches.
+
+    Returns:
+        list -- sorted (i, j) pairs where a[i] == b[j] is part of the common subsequence
+    """
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            matches.append((a_hi, b_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+
+        anchors = _unique_common(a, b, a_lo, a_hi, b_lo, b_hi)
+        if len(anchors) == 0:
+            matches.extend(myers_matches(a, b, a_lo, a_hi, b_lo, b_hi))
+            continue
+
+        previous_i, previous_j = a_lo, b_lo
+        for i, j in _longest_increasing_run(anchors):
+            matches.append((i, j))
+            stack.append((previous_i, i, previous_j, j))
+            previous_i, previous_j = i + 1, j + 1
+        stack.append((previous_i, a_hi, previous_j, b_hi))
+    matches.sort()
+    return matches
+
+
+def _unique_common(a: list, b: list, a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> list:
+    """Positions of items which occur exactly once in each of a[a_lo:a_hi] and b[b_lo:b_hi]"""
+    a_positions = {}
+    for i in range(a_lo, a_hi):
+        a_positions[a[i]] = None if a[i] in a_positions else i
+    b_positions = {}
+    for j in range(b_lo, b_hi):
+        b_positions[b[j]] = None if b[j] in b_positions else j
+    anchors = []
+    for item, i in a_positions.items():
+        j = b_positions.get(item)
+        if i is not None and j is not None:
+            anchors.append((i, j))
+    anchors.sort()
+    return anchors
+
+
+def _longest_increasing_run(anchors: list[tuple]) -> list[tuple]:
+    """Patience sort the anchors, which are ordered by position in a, to find the longest run
+    which is also increasing in b"""
+    pile_tops = []
+    pile_top_j = []
+    back_pointers = []
+    for index, (_, j) in enumerate(anchors):
+        pile = bisect.bisect_left(pile_top_j, j)
+        back_pointers.append(pile_tops[pile - 1] if pile > 0 else None)
+        if pile == len(pile_tops):
+            pile_tops.append(index)
+            pile_top_j.append(j)
+        else:
+            pile_tops[pile] = index
+            pile_top_j[pile] = j
+    run = []
+    index = pile_tops[-1]
+    while index is not None:
+        run.append(anchors[index])
+        index = back_pointers[index]
+    run.reverse()
+    return run
+
+
+def _matches_to_opcodes(matches: list, n: int, m: int) -> list[tuple]:
+    """Convert sorted matching (i, j) pairs into difflib style opcodes"""
+    opcodes = []
+    i = j = 0
+    for match_i, match_j in [*matches, (n, m)]:
+        if i < match_i and j < match_j:
+            opcodes.append(("replace", i, match_i, j, match_j))
+        elif i < match_i:
+            opcodes.append(("delete", i, match_i, j, j))
+        elif j < match_j:
+            opcodes.append(("insert", i, i, j, match_j))
+        if match_i < n:
+            if opcodes and opcodes[-1][0] == "equal" and opcodes[-1][2] == match_i:
+                _, i1, _, j1, _ = opcodes[-1]
+                opcodes[-1] = ("equal", i1, match_i + 1, j1, match_j + 1)
+            else:
+                opcodes.append(("equal", match_i, match_i + 1, match_j, match_j + 1))
+        i, j = match_i + 1, match_j + 1
+    return opcodes
+
+
+def _render(a: list[str], b: list[str], opcodes: list[tuple]) -> Iterator[str]:
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for line in a[i1:i2]:
+                yield f"  {line}"
+        elif tag == "delete":
+            for line in a[i1:i2]:
+                yield f"- {line}"
+        elif tag == "insert":
+            for line in b[j1:j2]:
+                yield f"+ {line}"
+        else:
+            yield from _render_replace(a[i1:i2], b[j1:j2])
+
+
+def _render_replace(a_block: list[str], b_block: list[str]) -> Iterator[str]:
+    """Pair removed and added lines in a changed block as ndiff does, the most similar pair is
+    shown as a changed line with "? " hints and the lines before and after it are paired in the
+    same way, those without a partner similar enough being shown as plain removals and additions.
+    Rather than comparing every line with every other, as ndiff does, a line is only compared with
+    those within PAIR_WINDOW positions of it, allowing for the difference in length of the
+    blocks."""
+    cruncher = difflib.SequenceMatcher(difflib.IS_CHARACTER_JUNK)
+    pairs = _best_pairs(cruncher, a_block, b_block)
+    i = j = 0
+    for pair_i, pair_j in [*pairs, (len(a_block), len(b_block))]:
+        # The shorter side first, as ndiff does
+        if pair_j - j < pair_i - i:
+            yield from (f"+ {x}" for x in b_block[j:pair_j])
+            yield from (f"- {x}" for x in a_block[i:pair_i])
+        else:
+            yield from (f"- {x}" for x in a_block[i:pair_i])
+            yield from (f"+ {x}" for x in b_block[j:pair_j])
+        if pair_i < len(a_block):
+            cruncher.set_seqs(a_block[pair_i], b_block[pair_j])
+            yield from _changed_line(cruncher, a_block[pair_i], b_block[pair_j])
+        i, j = pair_i + 1, pair_j + 1
+
+
+def _best_pairs(
+    cruncher: difflib.SequenceMatcher, a_block: list[str], b_block: list[str]
+) -> list[tuple[int, int]]:
+    """The pairs ndiff would choose, of lines close enough to be compared. ndiff takes the pair
+    with the highest ratio of at least PAIR_CUTOFF, the first it finds searching the added lines
+    in order if ratios are equal, and repeats this for the lines before and after the pair.
+    Taking pairs in that order and keeping each which does not cross a pair already kept gives
+    the same pairs without searching again. The ratio is expensive, so pairs are ordered by the
+    cheaper upper bounds real_quick_ratio and quick_ratio until they reach the top, and those
+    crossing a kept pair are dropped before it is computed.
+
+    Returns:
+        list[tuple[int, int]] -- the (i, j) positions of the pairs in order
+    """
+    skew = len(b_block) - len(a_block)
+    low = min(0, skew) - PAIR_WINDOW
+    high = max(0, skew) + PAIR_WINDOW
+    # (-bound, j, i, level) with levels 0, 1 and 2 for real_quick_ratio, quick_ratio and ratio
+    heap = []
+    for j in range(len(b_block)):
+        for i in range(max(0, j - high), min(len(a_block), j - low + 1)):
+            cruncher.set_seqs(a_block[i], b_block[j])
+            bound = cruncher.real_quick_ratio()
+            if bound >= PAIR_CUTOFF:
+                heap.append((-bound, j, i, 0))
+    heapq.heapify(heap)
+
+    kept_i = []
+    kept_j = []
+    while heap:
+        _, j, i, level = heapq.heappop(heap)
+        position = bisect.bisect_left(kept_i, i)
+        if position > 0 and kept_j[position - 1] >= j:
+            continue
+        if position < len(kept_i) and (kept_i[position] == i or kept_j[position] <= j):
+            continue
+        if level < 2:
+            cruncher.set_seqs(a_block[i], b_block[j])
+            bound = cruncher.quick_ratio() if level == 0 else cruncher.ratio()
+            if bound >= PAIR_CUTOFF:
+                heapq.heappush(heap, (-bound, j, i, level + 1))
+            continue
+        kept_i.insert(position, i)
+        kept_j.insert(position, j)
+    return list(zip(kept_i, kept_j))
+
+
+def _changed_line(cruncher: difflib.SequenceMatcher, a_line: str, b_line: str) -> Iterator[str]:
+    a_tags = ""
+    b_tags = ""
+    for tag, i1, i2, j1, j2 in cruncher.get_opcodes():
+        if tag == "replace":
+            a_tags += "^" * (i2 - i1)
+            b_tags += "^" * (j2 - j1)
+        elif tag == "delete":
+            a_tags += "-" * (i2 - i1)
+        elif tag == "insert":
+            b_tags += "+" * (j2 - j1)
+        else:
+            a_tags += " " * (i2 - i1)
+            b_tags += " " * (j2 - j1)
+
+    a_tags = _keep_original_whitespace(a_line, a_tags).rstrip()
+    b_tags = _keep_original_whitespace(b_line, b_tags).rstrip()
+    yield f"- {a_line}"
+    if a_tags:
+        yield f"? {a_tags}\n"
+    yield f"+ {b_line}"
+    if b_tags:
+        yield f"? {b_tags}\n"
+
+
+def _keep_original_whitespace(line: str, tags: str) -> str:
+    return "".join(c if tag == " " and c.isspace() else tag for c, tag in zip(line, tags))
+
+
+SEQUENCE_MATCHERS: dict[str, Callable[[list, list], list]] = {
+    "myers": myers_matches,
+    "patience": patience_matches,
+}
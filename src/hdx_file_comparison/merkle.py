@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Merkle style comparison which localises the differences between two files before diffing.
+
+Rows are assigned to one of n_buckets buckets by a hash of their key columns, or of the whole row
+if no key columns are given. Each bucket has an order independent digest and the bucket digests
+are the leaves of a binary hash tree. Comparing two trees from the root down finds the buckets
+which differ while only comparing a handful of digests, and only the rows in those buckets are
+then diffed. The bucket digests depend only on the rows in a bucket so they could equally be
+computed for slices of a download.
+"""
+
+import csv
+import hashlib
+
+from typing import Iterator, Optional
+
+from hdx_file_comparison.digests import DIGEST_MASK, format_digest, row_hash
+from hdx_file_comparison.instrumentation import stage
+from hdx_file_comparison.row_index import KEY_SEPARATOR, key_hash
+from hdx_file_comparison.utilities import _key_indices, iter_keyed_diff
+
+DEFAULT_N_BUCKETS = 1024
+
+
+def bucket_digests(
+    filepath: str,
+    key_columns: Optional[list[str]] = None,
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    encoding: str = "utf-8",
+) -> dict:
+    """Stream filepath computing an order independent digest of the rows in each bucket
+
+    Arguments:
+        filepath {str} -- path to a CSV file
+
+    Keyword Arguments:
+        key_columns {Optional[list[str]]} -- columns used to assign rows to buckets, if None the
+        whole row is used (default: {None})
+        n_buckets {int} -- number of buckets, a power of 2 (default: {DEFAULT_N_BUCKETS})
+        encoding {str} -- file encoding (default: {"utf-8"})
+
+    Returns:
+        dict -- the header, the bucket digests, the row count of each bucket and the hash tree
+        built from the bucket digests
+    """
+    if n_buckets < 1 or n_buckets & (n_buckets - 1) != 0:
+        raise ValueError(f"n_buckets must be a power of 2, got {n_buckets}")
+
+    digests = [0] * n_buckets
+    counts = [0] * n_buckets
+    with open(filepath, encoding=encoding, newline="") as file_handle:
+        csv_reader = csv.reader(file_handle)
+        header = next(csv_reader)
+        for _, bucket, row in _iter_bucketed_rows(
+            csv_reader, header, key_columns, n_buckets, filepath
+        ):
+            digests[bucket] = (digests[bucket] + row_hash(KEY_SEPARATOR.join(row))) & DIGEST_MASK
+            counts[bucket] += 1
+
+    leaves = [format_digest(x) for x in digests]
+    return {
+        "header": header,
+        "key_columns": key_columns or [],
+        "n_buckets": n_buckets,
+        "counts": counts,
+        "tree": merkle_tree(leaves),
+    }
+
+
+def _iter_bucketed_rows(
+    csv_reader, header: list[str], key_columns: Optional[list[str]], n_buckets: int, filepath: str
+) -> Iterator[tuple[int, int, list[str]]]:
+    key_idxs = _key_indices(header, key_columns, filepath) if key_columns else None
+    for line_number, row in enumerate(csv_reader, start=1):
+        if key_idxs is None:
+            bucket_key = row
+        else:
+            bucket_key = [row[i] if i < len(row) else "" for i in key_idxs]
+        yield line_number, key_hash(bucket_key) % n_buckets, row
+
+
+def merkle_tree(leaves: list[str]) -> list[list[str]]:
+    """Build a binary hash tree over the leaf digests
+
+    Returns:
+        list[list[str]] -- the levels of the tree, from the leaves to the root
+    """
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        levels.append(
+            [
+                hashlib.blake2b(
+                    (children[i] + children[i + 1]).encode("utf-8"), digest_size=16
+                ).hexdigest()
+                for i in range(0, len(children), 2)
+            ]
+        )
+    return levels
+
+
+def mismatched_buckets(tree_1: list[list[str]], tree_2: list[list[str]]) -> list[int]:
+    """Walk two hash trees of the same shape from the root, only descending into nodes which
+    differ, and return the indices of the leaves which differ"""
+    if len(tree_1) != len(tree_2):
+        raise ValueError("Hash trees must be built with the same number of buckets")
+
+    nodes = [0] if tree_1[-1][0] != tree_2[-1][0] else []
+    for level in range(len(tree_1) - 2, -1, -1):
+        nodes = [
+            child
+            for node in nodes
+            for child in (2 * node, 2 * node + 1)
+            if tree_1[level][child] != tree_2[level][child]
+        ]
+    return nodes
+
+
+def merkle_compare(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: Optional[list[str]] = None,
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    encoding: str = "utf-8",
+) -> dict:
+    """Compare two files by bucket digests, diffing only the rows in buckets which differ. With
+    key_columns the rows in differing buckets are compared as in keyed_compare, otherwise rows
+    are matched as a multiset and only additions and removals are reported. The number of buckets
+    which differ is recorded on the bucket_digests stage.
+
+    Returns:
+        dict -- diff metrics in the same form as process()
+    """
+    diff_metrics = {}
+    cell_changes = list(
+        iter_merkle_compare(
+            filepath_1, filepath_2, diff_metrics, key_columns, n_buckets, encoding=encoding
+        )
+    )
+    diff_metrics["cell_changes"] = sorted(cell_changes, key=lambda x: x["row"])
+    return diff_metrics
+
+
+def iter_merkle_compare(
+    filepath_1: str,
+    filepath_2: str,
+    diff_metrics: dict,
+    key_columns: Optional[list[str]] = None,
+    n_buckets: int = DEFAULT_N_BUCKETS,
+    encoding: str = "utf-8",
+) -> Iterator[dict]:
+    """merkle_compare yielding cell changes as they are found, in the order of the rows of
+    filepath_2, rather than returning them sorted. The rows of filepath_1 in differing buckets are
+    held in memory and those of filepath_2 are streamed. The line counts are put in diff_metrics
+    once the iterator is exhausted.
+    """
+    with stage("bucket_digests", n_buckets=n_buckets) as span:
+        buckets_1 = bucket_digests(filepath_1, key_columns, n_buckets, encoding=encoding)
+        buckets_2 = bucket_digests(filepath_2, key_columns, n_buckets, encoding=encoding)
+        differing = set(mismatched_buckets(buckets_1["tree"], buckets_2["tree"]))
+        span.attributes["n_differing_buckets"] = len(differing)
+
+    file_1_rows = list(_read_buckets(filepath_1, key_columns, n_buckets, differing, encoding))
+    file_2_rows = _read_buckets(filepath_2, key_columns, n_buckets, differing, encoding)
+
+    if key_columns:
+        yield from iter_keyed_diff(
+            buckets_1["header"],
+            file_1_rows,
+            buckets_2["header"],
+            file_2_rows,
+            key_columns,
+            diff_metrics,
+            sources=(filepath_1, filepath_2),
+        )
+        return
+
+    file_1_counts = {}
+    for _, row in file_1_rows:
+        file_1_counts[tuple(row)] = file_1_counts.get(tuple(row), 0) + 1
+    n_lines_added = 0
+    for _, row in file_2_rows:
+        if file_1_counts.get(tuple(row), 0) > 0:
+            file_1_counts[tuple(row)] -= 1
+        else:
+            n_lines_added += 1
+
+    diff_metrics["n_lines_changed"] = 0
+    diff_metrics["n_lines_added"] = n_lines_added
+    diff_metrics["n_lines_removed"] = sum(file_1_counts.values())
+
+
+def _read_buckets(
+    filepath: str,
+    key_columns: Optional[list[str]],
+    n_buckets: int,
+    buckets: set[int],
+    encoding: str,
+) -> Iterator[tuple[int, list[str]]]:
+    if len(buckets) == 0:
+        return
+    with open(filepath, encoding=encoding, newline="") as file_handle:
+        csv_reader = csv.reader(file_handle)
+        header = next(csv_reader)
+        for line_number, bucket, row in _iter_bucketed_rows(
+            csv_reader, header, key_columns, n_buckets, filepath
+        ):
+            if bucket in buckets:
+                yield line_number, row
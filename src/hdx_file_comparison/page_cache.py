@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""On disk cache of HTTP responses for downloaded pages.
+
+Entries are keyed by the normalised URL, including the offset and limit of the page, so the same
+page requested with its query parameters in a different order is the same entry. Response bodies
+are stored by the SHA-256 of their content, so pages with the same content are stored once. An
+entry younger than the TTL is used without touching the network, an older one is revalidated with
+If-None-Match and If-Modified-Since using the ETag and Last-Modified headers stored with it. When
+the bodies stored exceed the byte budget the least recently used entries are evicted.
+
+The layout under the cache directory is entries/<key>.json for the response metadata and
+bodies/<sha256> for the content. Files are written to a temporary name and renamed into place, and
+the modification time of an entry records when it was last used.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Optional
+from urllib import parse
+
+from hdx_file_comparison.atomic import write_atomic
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+SHA256_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+def normalize_url(url: str) -> str:
+    """Lower case the scheme and host, drop default ports and fragments, and sort the query
+    parameters"""
+    parts = parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS.get(scheme, "\0")):
+        netloc = netloc[: -len(DEFAULT_PORTS[scheme])]
+    query = parse.urlencode(sorted(parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return parse.urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    def __init__(
+        self,
+        directory: str,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        """Open, or create, a page cache
+
+        Arguments:
+            directory {str} -- directory holding the cache
+
+        Keyword Arguments:
+            ttl_seconds {float} -- age after which an entry is revalidated
+            (default: {DEFAULT_TTL_SECONDS})
+            max_bytes {int} -- budget for the bodies stored (default: {DEFAULT_MAX_BYTES})
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.n_hits = 0
+        self.n_revalidated = 0
+        self.n_misses = 0
+        self.n_evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "entries"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "bodies"), exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Read the entries in least recently used order and count references to each body"""
+        entries = []
+        entries_directory = os.path.join(self.directory, "entries")
+        for filename in os.listdir(entries_directory):
+            if not filename.endswith(".json"):
+                continue
+            entry_path = os.path.join(entries_directory, filename)
+            try:
+                with open(entry_path, encoding="utf-8") as entry_handle:
+                    entry = json.load(entry_handle)
+                last_used = os.path.getmtime(entry_path)
+            except (OSError, ValueError):
+                continue
+            entries.append((last_used, filename[: -len(".json")], entry))
+
+        self._entries = OrderedDict()
+        self._body_references = {}
+        self.total_bytes = 0
+        for _, key, entry in sorted(entries, key=lambda x: x[0]):
+            self._entries[key] = entry
+            self._add_reference(entry)
+
+        # Bodies left behind by a run which stopped between writing an entry and removing the
+        # body it replaced are not counted in total_bytes, so they are removed
+        bodies_directory = os.path.join(self.directory, "bodies")
+        for filename in os.listdir(bodies_directory):
+            if SHA256_PATTERN.fullmatch(filename) and filename not in self._body_references:
+                _remove_file(os.path.join(bodies_directory, filename))
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """The stored response metadata for url, None if it is not cached"""
+        with self._lock:
+            return self._entries.get(cache_key(url))
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["stored_at"] < self.ttl_seconds
+
+    def read(self, url: str, entry: dict) -> Optional[tuple[http.client.HTTPMessage, bytes]]:
+        """Read the body of an entry, marking it as used, None if the body has gone
+
+        Returns:
+            Optional[tuple] -- response headers rebuilt from the entry and the body
+        """
+        try:
+            with open(self._body_path(entry["sha256"]), "rb") as body_handle:
+                body = body_handle.read()
+        except OSError:
+            return None
+        key = cache_key(url)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(self._entry_path(key))
+        except OSError:
+            pass
+        headers = http.client.HTTPMessage()
+        for header, value in entry["headers"].items():
+            headers[header] = value
+        return headers, body
+
+    def store(self, url: str, headers, body: bytes) -> dict:
+        """Store a response, evicting least recently used entries if the cache is over budget
+
+        Returns:
+            dict -- the stored entry
+        """
+        entry = {
+            "url": normalize_url(url),
+            "stored_at": time.time(),
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "size": len(body),
+            "headers": {
+                x: headers[x]
+                for x in ["Content-Type", "ETag", "Last-Modified"]
+                if headers.get(x) is not None
+            },
+        }
+        key = cache_key(url)
+        with self._lock:
+            body_path = self._body_path(entry["sha256"])
+            if not os.path.exists(body_path):
+                write_atomic(body_path, body)
+            write_atomic(self._entry_path(key), json.dumps(entry).encode("utf-8"))
+
+            # The new body is referenced before the previous one is released, in case they match
+            previous = self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._add_reference(entry)
+            if previous is not None:
+                self._remove_reference(previous)
+            self._evict()
+        return entry
+
+    def refresh(self, url: str, entry: dict) -> dict:
+        """Restart the TTL of an entry which the server has said is not modified"""
+        entry = {**entry, "stored_at": time.time()}
+        key = cache_key(url)
+        write_atomic(self._entry_path(key), json.dumps(entry).encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+        return entry
+
+    def count(self, counter: str):
+        """Add one to n_hits, n_revalidated or n_misses, from any thread"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def summary(self) -> str:
+        return (
+            f"Page cache: {self.n_hits} hits, {self.n_revalidated} revalidated, "
+            f"{self.n_misses} misses, {self.n_evicted} evicted, "
+            f"{self.total_bytes / (1024 * 1024):0.1f}MB in {len(self._entries)} entries"
+        )
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._remove_reference(entry)
+            self.n_evicted += 1
+            _remove_file(self._entry_path(key))
+
+    def _add_reference(self, entry: dict):
+        n_references = self._body_references.get(entry["sha256"], 0)
+        if n_references == 0:
+            self.total_bytes += entry["size"]
+        self._body_references[entry["sha256"]] = n_references + 1
+
+    def _remove_reference(self, entry: dict):
+        n_references = self._body_references.pop(entry["sha256"]) - 1
+        if n_references > 0:
+            self._body_references[entry["sha256"]] = n_references
+        else:
+            self.total_bytes -= entry["size"]
+            _remove_file(self._body_path(entry["sha256"]))
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, "entries", f"{key}.json")
+
+    def _body_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, "bodies", sha256)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compare two downloads page by page while they are still in progress.
+
+A PageComparator is fed the pages of both downloads through the on_page callback of the
+downloader. For each file it keeps the running order independent digest, the line count and the
+row hashes needed for a unique row count, so the hash verdict is available as soon as the last
+page of both downloads has been written. Pages at the same offset are compared as soon as both
+have arrived and mismatches are reported straight away, which requires both downloads to use the
+same fixed page size.
+"""
+
+import os
+import threading
+
+from typing import Callable, Optional
+
+from hdx_file_comparison.digests import DIGEST_ALGORITHM, DIGEST_MASK, format_digest, row_hash
+
+
+class PageComparator:
+    def __init__(
+        self,
+        labels: tuple[str, str] = ("file_1", "file_2"),
+        on_mismatch: Optional[Callable[[int, int, int], None]] = None,
+    ):
+        """
+        Keyword Arguments:
+            labels {tuple[str, str]} -- names of the two sources, used in messages
+            (default: {("file_1", "file_2")})
+            on_mismatch {Optional[Callable]} -- called as on_mismatch(offset, n_rows_1, n_rows_2)
+            when the pages at offset differ, by default a message is printed (default: {None})
+        """
+        self.labels = labels
+        self.on_mismatch = on_mismatch if on_mismatch is not None else self._print_mismatch
+        self.mismatched_pages = []
+        self.n_pages_compared = 0
+        self._lock = threading.Lock()
+        self._pages = ({}, {})
+        self._totals = [0, 0]
+        self._n_lines = [0, 0]
+        self._row_hashes = (set(), set())
+        self._first_offset = [None, None]
+
+    def page_callback(self, source: int) -> Callable[[int, Optional[str], list], None]:
+        """Return an on_page callback feeding pages to source 0 or 1"""
+
+        def on_page(offset: int, header: Optional[str], rows: list):
+            self.add_page(source, offset, header, rows)
+
+        return on_page
+
+    def add_page(self, source: int, offset: int, header: Optional[str], rows: list):
+        hashes = [row_hash(x) for x in rows]
+        page_total = sum(hashes) & DIGEST_MASK
+
+        with self._lock:
+            if self._first_offset[source] is None:
+                self._first_offset[source] = offset
+                # The header is the first line of the downloaded file so it counts towards the
+                # file digest, but is not part of any page
+                if header is not None:
+                    header_hash = row_hash(header)
+                    self._totals[source] = (self._totals[source] + header_hash) & DIGEST_MASK
+                    self._n_lines[source] += 1
+                    self._row_hashes[source].add(header_hash >> 64)
+            self._totals[source] = (self._totals[source] + page_total) & DIGEST_MASK
+            self._n_lines[source] += len(rows)
+            self._row_hashes[source].update(x >> 64 for x in hashes)
+            self._pages[source][offset] = (len(rows), page_total)
+
+            other = self._pages[1 - source].pop(offset, None)
+            if other is None:
+                return
+            del self._pages[source][offset]
+            self.n_pages_compared += 1
+            page = (len(rows), page_total)
+            pages = (page, other) if source == 0 else (other, page)
+            if pages[0] == pages[1]:
+                return
+            self.mismatched_pages.append(offset)
+        self.on_mismatch(offset, pages[0][0], pages[1][0])
+
+    @property
+    def complete(self) -> bool:
+        """True if both sources were seen from their first page, so the digests cover the whole
+        of both files"""
+        return self._first_offset == [0, 0]
+
+    def hash_metrics(self) -> dict:
+        """Hash metrics for the pages seen so far, with the same keys as
+        hash_based_file_comparison for lengths, hashes and unique row counts
+
+        Returns:
+            dict -- lengths, digests and unique row counts of both files, the number of pages
+            compared and the offsets of those which differed
+        """
+        with self._lock:
+            unmatched = len(self._pages[0]) + len(self._pages[1])
+            return {
+                "file_1_length": self._n_lines[0],
+                "file_2_length": self._n_lines[1],
+                "file_1_hash": format_digest(self._totals[0]),
+                "file_2_hash": format_digest(self._totals[1]),
+                "file_1_unique": len(self._row_hashes[0]),
+                "file_2_unique": len(self._row_hashes[1]),
+                "n_pages_compared": self.n_pages_compared,
+                "n_pages_unmatched": unmatched,
+                "mismatched_pages": sorted(self.mismatched_pages),
+            }
+
+    def file_digest(self, source: int, filepath: str, encoding: str = "utf-8") -> dict:
+        """The digest of source in the form written to digest sidecars, taking the size and
+        modification time from the completed download at filepath"""
+        stat = os.stat(filepath)
+        with self._lock:
+            return {
+                "algorithm": DIGEST_ALGORITHM,
+                "digest": format_digest(self._totals[source]),
+                "n_rows": self._n_lines[source],
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "encoding": encoding,
+            }
+
+    def _print_mismatch(self, offset: int, n_rows_1: int, n_rows_2: int):
+        print(
+            f"Pages at offset {offset} differ: {self.labels[0]} has {n_rows_1} rows, "
+            f"{self.labels[1]} has {n_rows_2} rows",
+            flush=True,
+        )
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Streaming reports of the cell changes found by a comparison.
+
+The engines yield cell changes as they find them and a ReportWriter writes each one as it
+arrives, so the memory used does not grow with the number of changes, and a consumer of the
+report, such as a notification tool reading a pipe or following the file, sees changes while the
+diff is still running. The columnar engine compares a column at a time for all rows, so finds
+every change before it could write the first, and can not be used for reports. There are three
+formats:
+
+    ndjson -- a line of JSON for each change, {"type": "cell_change", "row": ..., "column": ...,
+              "original_value": ..., "new_value": ...}, then a {"type": "summary", ...} line with
+              the line counts when the comparison ends
+    csv -- a row,column,original_value,new_value header and a line for each change
+    summary -- a single JSON object written when the comparison ends, with the line counts, the
+               number of cell changes and the number in each column
+
+Reports are written to a file, or to stdout if the path is "-", in which case report_to_stdout
+sends everything else the command prints to stderr so that the report can be parsed. Files are
+written in place rather than to a temporary file so that they can be read as they grow. Reports
+are flushed at most every FLUSH_SECONDS so that a reader is never far behind without a write for
+every change.
+"""
+
+import csv
+import json
+import sys
+import time
+
+from contextlib import contextmanager, redirect_stdout
+from typing import Iterable, Iterator, TextIO, Union
+
+REPORT_FORMATS = ["ndjson", "csv", "summary"]
+CSV_FIELDS = ["row", "column", "original_value", "new_value"]
+FLUSH_SECONDS = 0.5
+
+
+class ReportWriter:
+    def __init__(self, output: TextIO, report_format: str = "ndjson"):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(
+                f"Unknown report format '{report_format}', expected one of {REPORT_FORMATS}"
+            )
+        self.output = output
+        self.report_format = report_format
+        self.n_changes = 0
+        # Bounded by the number of columns, not the number of changes
+        self.column_counts = {}
+        self._csv_writer = None
+        self._last_flush = time.monotonic()
+        if report_format == "csv":
+            self._csv_writer = csv.writer(output, lineterminator="\n")
+            self._csv_writer.writerow(CSV_FIELDS)
+
+    def write_change(self, change: dict):
+        self.n_changes += 1
+        self.column_counts[change["column"]] = self.column_counts.get(change["column"], 0) + 1
+        if self.report_format == "ndjson":
+            self.output.write(json.dumps({"type": "cell_change", **change}) + "\n")
+        elif self.report_format == "csv":
+            self._csv_writer.writerow([change.get(x, "") for x in CSV_FIELDS])
+        else:
+            return
+        if time.monotonic() - self._last_flush >= FLUSH_SECONDS:
+            self.flush()
+
+    def write_changes(self, changes: Iterable[dict]) -> int:
+        """Write each change as it is yielded
+
+        Arguments:
+            changes {Iterable[dict]} -- cell changes, such as an engine iterator
+
+        Returns:
+            int -- the number of changes written
+        """
+        n_changes = self.n_changes
+        for change in changes:
+            self.write_change(change)
+        return self.n_changes - n_changes
+
+    def write_summary(self, diff_metrics: dict) -> dict:
+        """End the report with the line counts of the comparison
+
+        Arguments:
+            diff_metrics {dict} -- line counts from the engine
+
+        Returns:
+            dict -- the line counts with n_cell_changes and, for the summary format,
+            cell_changes_by_column
+        """
+        summary = {**diff_metrics, "n_cell_changes": self.n_changes}
+        if self.report_format == "summary":
+            summary["cell_changes_by_column"] = dict(
+                sorted(self.column_counts.items(), key=lambda x: (-x[1], x[0]))
+            )
+            self.output.write(json.dumps(summary) + "\n")
+        elif self.report_format == "ndjson":
+            self.output.write(json.dumps({"type": "summary", **summary}) + "\n")
+        self.flush()
+        return summary
+
+    def flush(self):
+        self.output.flush()
+        self._last_flush = time.monotonic()
+
+
+@contextmanager
+def open_report(
+    output: Union[str, TextIO], report_format: str = "ndjson"
+) -> Iterator[ReportWriter]:
+    """A ReportWriter on a file path, or on an open stream, or on stdout if output is "-", which
+    are left open"""
+    if output == "-" or not isinstance(output, str):
+        report = ReportWriter(sys.stdout if output == "-" else output, report_format)
+        try:
+            yield report
+        finally:
+            report.flush()
+        return
+    with open(output, "w", encoding="utf-8", newline="") as file_handle:
+        yield ReportWriter(file_handle, report_format)
+
+
+@contextmanager
+def report_to_stdout() -> Iterator[TextIO]:
+    """Keep stdout for a report, yielding it, and send everything else printed in the with block
+    to stderr"""
+    stdout = sys.stdout
+    with redirect_stdout(sys.stderr):
+        yield stdout
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""A persistent row index stored next to a CSV file, so that repeated comparisons against the
+same snapshot do not need to re-read and re-hash it.
+
+The index is a single binary sidecar, <file>.rowidx, with a JSON metadata line followed by packed
+arrays of 64 bit integers:
+
+- the byte offset at which each line starts, plus the file size;
+- a hash of each line;
+- a hash of the key columns of each line, when key columns are given.
+
+The metadata holds the header, the file size and modification time used to invalidate the index,
+the order independent file digest and an order independent digest of each column.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sys
+
+from array import array
+from typing import Iterator, Optional
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.digests import DIGEST_MASK, format_digest, row_hash
+from hdx_file_comparison.utilities import _column_pairs, _compare_fields, _key_indices
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".rowidx"
+KEY_SEPARATOR = "\x1f"
+
+
+class RowIndex:
+    def __init__(
+        self,
+        filepath: str,
+        metadata: dict,
+        offsets: array,
+        row_hashes: array,
+        key_hashes: Optional[array],
+    ):
+        self.filepath = filepath
+        self.metadata = metadata
+        self.offsets = offsets
+        self.row_hashes = row_hashes
+        self.key_hashes = key_hashes
+
+    @property
+    def header(self) -> list[str]:
+        return self.metadata["header"]
+
+    @property
+    def n_lines(self) -> int:
+        return len(self.row_hashes)
+
+    def read_line(self, file_handle, line_number: int) -> str:
+        """Read a single line from an open binary file handle using the stored byte offsets"""
+        file_handle.seek(self.offsets[line_number])
+        raw = file_handle.read(self.offsets[line_number + 1] - self.offsets[line_number])
+        return raw.decode(self.metadata["encoding"]).rstrip("\r\n")
+
+
+def index_path(filepath: str) -> str:
+    return f"{filepath}{INDEX_SUFFIX}"
+
+
+def build_row_index(
+    filepath: str, key_columns: Optional[list[str]] = None, encoding: str = "utf-8"
+) -> RowIndex:
+    """Read filepath once, building its row index
+
+    Arguments:
+        filepath {str} -- path to a CSV file
+
+    Keyword Arguments:
+        key_columns {Optional[list[str]]} -- columns to index rows by (default: {None})
+        encoding {str} -- file encoding (default: {"utf-8"})
+
+    Returns:
+        RowIndex -- the index
+    """
+    stat = os.stat(filepath)
+    offsets = array("Q")
+    row_hashes = array("Q")
+    key_hashes = array("Q") if key_columns else None
+    file_digest = 0
+    column_digests = []
+    header = []
+    key_idxs = []
+
+    with open(filepath, "rb") as file_handle:
+        offset = 0
+        for raw in file_handle:
+            offsets.append(offset)
+            offset += len(raw)
+            line = raw.decode(encoding).rstrip("\r\n")
+            line_hash = row_hash(line)
+            file_digest = (file_digest + line_hash) & DIGEST_MASK
+            row_hashes.append(line_hash >> 64)
+
+            row = next(csv.reader([line]), [])
+            if len(offsets) == 1:
+                header = row
+                column_digests = [0] * len(header)
+                if key_columns:
+                    key_idxs = _key_indices(header, key_columns, filepath)
+            else:
+                for i, value in zip(range(len(column_digests)), row):
+                    column_digests[i] = (column_digests[i] + row_hash(value)) & DIGEST_MASK
+            if key_hashes is not None:
+                key_hashes.append(key_hash([row[i] if i < len(row) else "" for i in key_idxs]))
+        offsets.append(offset)
+
+    metadata = {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "encoding": encoding,
+        "byteorder": sys.byteorder,
+        "header": header,
+        "key_columns": key_columns or [],
+        "n_lines": len(row_hashes),
+        "digest": format_digest(file_digest),
+        "column_digests": dict(zip(header, [format_digest(x) for x in column_digests])),
+    }
+    return RowIndex(filepath, metadata, offsets, row_hashes, key_hashes)
+
+
+def key_hash(key: list[str]) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(KEY_SEPARATOR.join(key).encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def write_row_index(row_index: RowIndex) -> str:
+    output_path = index_path(row_index.filepath)
+    with atomic_output(output_path) as index_handle:
+        index_handle.write(json.dumps(row_index.metadata).encode("utf-8") + b"\n")
+        row_index.offsets.tofile(index_handle)
+        row_index.row_hashes.tofile(index_handle)
+        if row_index.key_hashes is not None:
+            row_index.key_hashes.tofile(index_handle)
+    return output_path
+
+
+def read_row_index(
+    filepath: str, key_columns: Optional[list[str]] = None, encoding: str = "utf-8"
+) -> Optional[RowIndex]:
+    """Read the row index for filepath, returning None if there is no index or it is stale, that
+    is the file size or modification time has changed or it was built with other key columns"""
+    try:
+        with open(index_path(filepath), "rb") as index_handle:
+            metadata = json.loads(index_handle.readline())
+            stat = os.stat(filepath)
+            if (
+                metadata.get("version") != INDEX_VERSION
+                or metadata.get("size") != stat.st_size
+                or metadata.get("mtime_ns") != stat.st_mtime_ns
+                or metadata.get("encoding") != encoding
+                or metadata.get("key_columns") != (key_columns or [])
+            ):
+                return None
+            n_lines = metadata["n_lines"]
+            offsets = array("Q")
+            offsets.fromfile(index_handle, n_lines + 1)
+            row_hashes = array("Q")
+            row_hashes.fromfile(index_handle, n_lines)
+            key_hashes = None
+            if key_columns:
+                key_hashes = array("Q")
+                key_hashes.fromfile(index_handle, n_lines)
+    except (OSError, ValueError, EOFError):
+        return None
+
+    if metadata["byteorder"] != sys.byteorder:
+        for packed in (offsets, row_hashes, key_hashes):
+            if packed is not None:
+                packed.byteswap()
+
+    return RowIndex(filepath, metadata, offsets, row_hashes, key_hashes)
+
+
+def load_or_build_row_index(
+    filepath: str, key_columns: Optional[list[str]] = None, encoding: str = "utf-8"
+) -> RowIndex:
+    row_index = read_row_index(filepath, key_columns=key_columns, encoding=encoding)
+    if row_index is None:
+        row_index = build_row_index(filepath, key_columns=key_columns, encoding=encoding)
+        write_row_index(row_index)
+    return row_index
+
+
+def changed_columns(row_index_1: RowIndex, row_index_2: RowIndex) -> list[str]:
+    """Columns whose values differ as a multiset between the two files, from the indexes alone"""
+    column_digests_1 = row_index_1.metadata["column_digests"]
+    column_digests_2 = row_index_2.metadata["column_digests"]
+    columns = list(column_digests_1) + [x for x in column_digests_2 if x not in column_digests_1]
+    return [x for x in columns if column_digests_1.get(x) != column_digests_2.get(x)]
+
+
+def indexed_compare(
+    filepath_1: str, filepath_2: str, key_columns: list[str], encoding: str = "utf-8"
+) -> dict:
+    """Keyed comparison of two CSV files using their row indexes, building the indexes if they
+    are missing or stale. Only rows whose key matches but whose row hash differs are read back
+    from the files.
+
+    Returns:
+        dict -- diff metrics in the same form as keyed_compare
+    """
+    diff_metrics = {}
+    cell_changes = list(
+        iter_indexed_compare(filepath_1, filepath_2, key_columns, diff_metrics, encoding=encoding)
+    )
+    diff_metrics["cell_changes"] = sorted(cell_changes, key=lambda x: x["row"])
+    return diff_metrics
+
+
+def iter_indexed_compare(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: list[str],
+    diff_metrics: dict,
+    encoding: str = "utf-8",
+) -> Iterator[dict]:
+    """indexed_compare yielding cell changes as they are found, in the order of the rows of
+    filepath_2, rather than returning them sorted. The line counts are put in diff_metrics once
+    the iterator is exhausted.
+    """
+    if not key_columns:
+        raise ValueError("indexed_compare requires at least one key column")
+
+    row_index_1 = load_or_build_row_index(filepath_1, key_columns=key_columns, encoding=encoding)
+    row_index_2 = load_or_build_row_index(filepath_2, key_columns=key_columns, encoding=encoding)
+
+    if (
+        row_index_1.metadata["digest"] == row_index_2.metadata["digest"]
+        and row_index_1.header == row_index_2.header
+    ):
+        diff_metrics.update({"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0})
+        return
+
+    file_1_keys = {}
+    for line_number in range(1, row_index_1.n_lines):
+        file_1_keys.setdefault(row_index_1.key_hashes[line_number], []).append(line_number)
+
+    n_lines_changed = 0
+    n_lines_added = 0
+    column_pairs = _column_pairs(row_index_1.header, row_index_2.header)
+    with open(filepath_1, "rb") as file_1_handle, open(filepath_2, "rb") as file_2_handle:
+        for line_number in range(1, row_index_2.n_lines):
+            matches = file_1_keys.get(row_index_2.key_hashes[line_number])
+            if not matches:
+                n_lines_added += 1
+                continue
+            original_line_number = matches.pop(0)
+            if not matches:
+                del file_1_keys[row_index_2.key_hashes[line_number]]
+            if row_index_1.row_hashes[original_line_number] == row_index_2.row_hashes[line_number]:
+                continue
+            original_row = next(
+                csv.reader([row_index_1.read_line(file_1_handle, original_line_number)])
+            )
+            new_row = next(csv.reader([row_index_2.read_line(file_2_handle, line_number)]))
+            row_changes = _compare_fields(original_line_number, original_row, new_row, column_pairs)
+            if row_changes:
+                n_lines_changed += 1
+                yield from row_changes
+
+    diff_metrics["n_lines_changed"] = n_lines_changed
+    diff_metrics["n_lines_added"] = n_lines_added
+    diff_metrics["n_lines_removed"] = sum(len(x) for x in file_1_keys.values())
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""A long running local comparison service and the client used by the CLI to reach it.
+
+Each hdx-compare command starts an interpreter, imports its dependencies and reads and parses both
+files before comparing them. Notification checks run many small comparisons against the same
+large files, so the service keeps files parsed for the keyed and columnar engines in a least
+recently used memory cache, checked against the size and modification time of each file, and runs
+other engines through the same code as the CLI.
+
+Jobs are submitted as JSON to a queue served by a pool of worker threads:
+
+- POST /jobs with {"filepath_1", "filepath_2", "options", "include_cell_changes"} returns the
+  queued job and its job_id;
+- GET /jobs/<job_id> returns the job, with its result once complete, and with ?wait=<seconds>
+  waits up to that long for it to finish;
+- POST /changes with the same job runs it straight away and streams its cell changes back as
+  NDJSON while the engine finds them, one {"type": "cell_change", ...} line for each, then a
+  {"type": "summary", "diff_metrics": ...} line, or an {"type": "error", ...} line if it fails;
+- GET /status returns job counts and cache statistics.
+
+The service listens on the loopback interface by default and reads files by the paths it is
+given, so it is for a single user's machine rather than a shared server.
+"""
+
+import csv
+import http.client
+import itertools
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+from urllib import parse
+
+from hdx_file_comparison.columnar import compare_columns, load_columns
+from hdx_file_comparison.fast_path import files_identical
+from hdx_file_comparison.instrumentation import stage
+from hdx_file_comparison.snapshot import is_snapshot
+from hdx_file_comparison.utilities import keyed_diff
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_SERVICE_WORKERS = 2
+DEFAULT_CACHE_ENTRIES = 8
+# Finished jobs beyond this many are forgotten, oldest first
+MAX_FINISHED_JOBS = 1000
+MAX_WAIT_SECONDS = 60
+# Streamed changes are sent in chunks of about this size, or sooner if changes arrive slowly
+CHUNK_BYTES = 64 * 1024
+CHUNK_SECONDS = 0.5
+CACHED_ENGINES = ["keyed", "columnar"]
+FINISHED_STATUSES = ["complete", "failed"]
+
+
+class SnapshotCache:
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES):
+        """A least recently used cache of parsed files, an entry is loaded again if its file has
+        changed size or modification time"""
+        self.max_entries = max_entries
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evicted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filepath: str, kind: str, loader: Callable[[str], object]):
+        """The parsed form of a file, loading it with loader(filepath) if it is not cached"""
+        key = (os.path.abspath(filepath), kind)
+        stat = os.stat(filepath)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.n_hits += 1
+                return entry[1]
+            self.n_misses += 1
+
+        # Loading is done outside the lock so that other files can be read at the same time
+        value = loader(filepath)
+        with self._lock:
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.n_evicted += 1
+        return value
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "n_entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "n_hits": self.n_hits,
+                "n_misses": self.n_misses,
+                "n_evicted": self.n_evicted,
+                "files": sorted({x[0] for x in self._entries}),
+            }
+
+
+def load_rows(filepath: str, encoding: str = "utf-8") -> dict:
+    """Read a CSV file into its header and a list of rows, as used by keyed_diff"""
+    with stage("parse", filepath=filepath) as span:
+        with open(filepath, encoding=encoding, newline="") as file_handle:
+            csv_reader = csv.reader(file_handle)
+            header = next(csv_reader)
+            rows = list(csv_reader)
+        span.add(rows=len(rows), bytes_read=os.path.getsize(filepath))
+    return {"header": header, "rows": rows}
+
+
+class ComparisonService:
+    def __init__(
+        self,
+        run_diff_engine: Callable[..., tuple[dict, Optional[list]]],
+        max_workers: int = DEFAULT_SERVICE_WORKERS,
+        cache_entries: int = DEFAULT_CACHE_ENTRIES,
+        iter_diff_engine: Optional[Callable[..., Iterator[dict]]] = None,
+    ):
+        """Queue and run comparison jobs
+
+        Arguments:
+            run_diff_engine {Callable} -- run_diff_engine(filepath_1, filepath_2, **options)
+            returning diff metrics and cell changes, used for engines whose parsed files are not
+            cached
+
+        Keyword Arguments:
+            max_workers {int} -- number of jobs run at once (default: {DEFAULT_SERVICE_WORKERS})
+            cache_entries {int} -- parsed files kept in memory (default: {DEFAULT_CACHE_ENTRIES})
+            iter_diff_engine {Optional[Callable]} -- iter_diff_engine(filepath_1, filepath_2,
+            diff_metrics, **options) yielding cell changes, used to stream changes, which are
+            not streamed if it is None (default: {None})
+        """
+        self.run_diff_engine = run_diff_engine
+        self.iter_diff_engine = iter_diff_engine
+        self.n_streams = 0
+        # Streams run on the request thread, so they share the worker limit through a semaphore
+        self._stream_slots = threading.BoundedSemaphore(max_workers)
+        self.cache = SnapshotCache(cache_entries)
+        self.started_at = time.time()
+        self._jobs = OrderedDict()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, job: dict) -> dict:
+        """Queue a job, returning its record"""
+        _check_job(job)
+        record = {
+            "job_id": str(next(self._job_ids)),
+            "status": "queued",
+            "submitted_at": time.time(),
+            "job": job,
+            "result": None,
+            "error": None,
+        }
+        done = threading.Event()
+        with self._lock:
+            self._jobs[record["job_id"]] = (record, done)
+            self._forget_finished()
+        self._executor.submit(self._run, record, done)
+        return dict(record)
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        """The record of a job, waiting up to wait seconds for it to finish, None if it is not
+        known"""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is None:
+            return None
+        record, done = entry
+        if wait > 0:
+            done.wait(min(wait, MAX_WAIT_SECONDS))
+        with self._lock:
+            return dict(record)
+
+    def stream_changes(self, job: dict, diff_metrics: dict) -> Iterator[dict]:
+        """Run a job straight away, yielding its cell changes as the engine finds them and
+        putting its line counts in diff_metrics once the iterator is exhausted"""
+        _check_job(job)
+        if self.iter_diff_engine is None:
+            raise ValueError("This comparison service does not stream changes")
+        with self._stream_slots:
+            yield from self.iter_diff_engine(
+                job["filepath_1"], job["filepath_2"], diff_metrics, **job.get("options", {})
+            )
+        with self._lock:
+            self.n_streams += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            statuses = [x[0]["status"] for x in self._jobs.values()]
+            n_streams = self.n_streams
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "jobs": {x: statuses.count(x) for x in ["queued", "running", *FINISHED_STATUSES]},
+            "n_streams": n_streams,
+            "cache": self.cache.summary(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget_finished(self):
+        finished = [x for x, y in self._jobs.items() if y[0]["status"] in FINISHED_STATUSES]
+        n_forgotten = max(0, len(finished) - MAX_FINISHED_JOBS)
+        for job_id in finished[0:n_forgotten]:
+            del self._jobs[job_id]
+
+    def _run(self, record: dict, done: threading.Event):
+        with self._lock:
+            record["status"] = "running"
+        t0 = time.time()
+        try:
+            job = record["job"]
+            diff_metrics, cell_changes = self.compare(
+                job["filepath_1"], job["filepath_2"], **job.get("options", {})
+            )
+            result = {
+                "diff_metrics": diff_metrics,
+                "n_cell_changes": len(cell_changes) if cell_changes is not None else None,
+                "elapsed_seconds": time.time() - t0,
+            }
+            if job.get("include_cell_changes"):
+                result["cell_changes"] = cell_changes
+            with self._lock:
+                record["result"] = result
+                record["status"] = "complete"
+        except Exception as error:
+            with self._lock:
+                record["error"] = f"{type(error).__name__}: {error}"
+                record["status"] = "failed"
+        finally:
+            done.set()
+
+    def compare(self, filepath_1: str, filepath_2: str, **options) -> tuple[dict, Optional[list]]:
+        """Compare two files, from cached parsed files for the keyed and columnar engines when
+        the whole of two CSV files is compared, otherwise with run_diff_engine"""
+        engine = options.get("engine", "difflib")
+        key_columns = options.get("key_columns")
+        if (
+            engine not in CACHED_ENGINES
+            or key_columns is None
+            or options.get("columns") is not None
+            or is_snapshot(filepath_1)
+            or is_snapshot(filepath_2)
+        ):
+            return self.run_diff_engine(filepath_1, filepath_2, **options)
+
+        with stage("diff", engine=engine):
+            if options.get("fast_path", True) and files_identical(filepath_1, filepath_2):
+                return {"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0}, []
+            key_column_list = [x.strip() for x in key_columns.split(",") if x.strip() != ""]
+            if engine == "columnar":
+                diff_metrics = compare_columns(
+                    self.cache.get(filepath_1, "columns", load_columns),
+                    self.cache.get(filepath_2, "columns", load_columns),
+                    key_column_list,
+                    rel_tol=options.get("rel_tol"),
+                    abs_tol=options.get("abs_tol"),
+                    sources=(filepath_1, filepath_2),
+                )
+            else:
+                table_1 = self.cache.get(filepath_1, "rows", load_rows)
+                table_2 = self.cache.get(filepath_2, "rows", load_rows)
+                diff_metrics = keyed_diff(
+                    table_1["header"],
+                    enumerate(table_1["rows"], start=1),
+                    table_2["header"],
+                    enumerate(table_2["rows"], start=1),
+                    key_column_list,
+                    sources=(filepath_1, filepath_2),
+                )
+        cell_changes = diff_metrics.pop("cell_changes")
+        return diff_metrics, cell_changes
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Routes requests to the ComparisonService at self.server.service"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = parse.urlsplit(self.path)
+        if parts.path == "/status":
+            self._send_json(200, self.server.service.status())
+            return
+        if parts.path.startswith("/jobs/"):
+            query = parse.parse_qs(parts.query)
+            try:
+                wait = float(query.get("wait", ["0"])[0])
+            except ValueError:
+                self._send_json(400, {"error": "wait must be a number of seconds"})
+                return
+            job_id = parts.path.rsplit("/", 1)[1]
+            record = self.server.service.get(job_id, wait=wait)
+            if record is None:
+                self._send_json(404, {"error": "Unknown job"})
+            else:
+                self._send_json(200, record)
+            return
+        self._send_json(404, {"error": f"Unknown path {parts.path}"})
+
+    def do_POST(self):
+        path = parse.urlsplit(self.path).path
+        if path not in ["/jobs", "/changes"]:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            job = json.loads(self.rfile.read(length))
+            if path == "/changes":
+                diff_metrics = {}
+                changes = self.server.service.stream_changes(job, diff_metrics)
+                # Start the engine so that a job which cannot run is rejected before streaming
+                first_change = next(changes, None)
+            else:
+                record = self.server.service.submit(job)
+        except (ValueError, AttributeError) as error:
+            self._send_json(400, {"error": str(error)})
+            return
+        except Exception as error:
+            self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        if path == "/jobs":
+            self._send_json(202, record)
+        else:
+            try:
+                self._send_changes(first_change, changes, diff_metrics)
+            finally:
+                changes.close()
+
+    def _send_changes(self, first_change: Optional[dict], changes: Iterator[dict], diff_metrics):
+        """Send changes as chunked NDJSON, so that neither end holds more than a chunk"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = []
+        chunk_bytes = 0
+        last_sent = time.monotonic()
+        try:
+            if first_change is not None:
+                changes = itertools.chain([first_change], changes)
+            for change in changes:
+                line = json.dumps({"type": "cell_change", **change}) + "\n"
+                chunk.append(line)
+                chunk_bytes += len(line)
+                if chunk_bytes >= CHUNK_BYTES or time.monotonic() - last_sent >= CHUNK_SECONDS:
+                    self._send_chunk("".join(chunk))
+                    chunk = []
+                    chunk_bytes = 0
+                    last_sent = time.monotonic()
+            chunk.append(json.dumps({"type": "summary", "diff_metrics": diff_metrics}) + "\n")
+        except Exception as error:
+            record = {"type": "error", "error": f"{type(error).__name__}: {error}"}
+            chunk.append(json.dumps(record) + "\n")
+        self._send_chunk("".join(chunk))
+        self._send_chunk("")
+
+    def _send_chunk(self, text: str):
+        encoded = text.encode("utf-8")
+        self.wfile.write(f"{len(encoded):X}\r\n".encode("ascii") + encoded + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, content: dict):
+        encoded = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(
+    service: ComparisonService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+) -> ThreadingHTTPServer:
+    """An HTTP server for service, call serve_forever to start it"""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def _check_job(job: dict):
+    missing = [x for x in ["filepath_1", "filepath_2"] if not job.get(x)]
+    if missing:
+        raise ValueError(f"Job is missing {', '.join(missing)}")
+
+
+def server_url(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> str:
+    return f"http://{host}:{port}"
+
+
+def _request(
+    url: str, method: str = "GET", content: Optional[dict] = None, timeout: float = 10
+) -> tuple[int, dict]:
+    parts = parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+    try:
+        body = json.dumps(content).encode("utf-8") if content is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+def service_status(url: str, timeout: float = 10) -> dict:
+    """Job counts and cache statistics from the service at url"""
+    status, content = _request(f"{url}/status", timeout=timeout)
+    if status != 200:
+        raise ValueError(f"No comparison service status at {url}: HTTP status {status}")
+    return content
+
+
+def server_available(url: str, timeout: float = 0.5) -> bool:
+    """Whether a comparison service is answering at url"""
+    try:
+        service_status(url, timeout=timeout)
+    except (OSError, http.client.HTTPException, ValueError):
+        return False
+    return True
+
+
+def run_remote_job(url: str, job: dict, timeout: Optional[float] = None) -> dict:
+    """Submit a job to the service at url and wait for it to finish
+
+    Arguments:
+        url {str} -- the service, for example http://127.0.0.1:8765
+        job {dict} -- filepath_1, filepath_2, options for run_diff_engine and optionally
+        include_cell_changes
+
+    Keyword Arguments:
+        timeout {Optional[float]} -- seconds to wait for the job, without limit if None
+        (default: {None})
+
+    Returns:
+        dict -- the finished job record, with its status and result or error
+    """
+    status, record = _request(f"{url}/jobs", method="POST", content=job)
+    if status != 202:
+        raise ValueError(f"Job rejected by {url}: {record.get('error')}")
+    t0 = time.time()
+    while record["status"] not in FINISHED_STATUSES:
+        if timeout is not None and time.time() - t0 > timeout:
+            raise TimeoutError(f"Job {record['job_id']} did not finish in {timeout} seconds")
+        record = get_remote_job(url, record["job_id"], wait=MAX_WAIT_SECONDS)
+    return record
+
+
+def get_remote_job(url: str, job_id: str, wait: float = 0) -> dict:
+    """The record of a job on the service at url, waiting up to wait seconds for it to finish.
+    Raises ValueError if the service does not know the job, for example once it has been
+    forgotten after MAX_FINISHED_JOBS later jobs have finished."""
+    status, record = _request(f"{url}/jobs/{job_id}?wait={wait}", timeout=wait + 10)
+    if status == 404:
+        raise ValueError(f"Job {job_id} is not known to the comparison service at {url}")
+    if status != 200:
+        raise ValueError(
+            f"Failed to get job {job_id} from {url}: HTTP status {status}, {record.get('error')}"
+        )
+    return record
+
+
+def iter_remote_changes(
+    url: str, job: dict, diff_metrics: dict, timeout: Optional[float] = None
+) -> Iterator[dict]:
+    """Run a job on the service at url, yielding its cell changes as they are streamed back and
+    putting its line counts in diff_metrics once the iterator is exhausted
+
+    Arguments:
+        url {str} -- the service, for example http://127.0.0.1:8765
+        job {dict} -- filepath_1, filepath_2 and options for iter_diff_engine
+        diff_metrics {dict} -- filled with the line counts
+
+    Keyword Arguments:
+        timeout {Optional[float]} -- seconds to wait for each part of the response, without
+        limit if None (default: {None})
+
+    Yields:
+        dict -- cell changes
+    """
+    parts = parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.netloc, timeout=timeout)
+    try:
+        connection.request(
+            "POST",
+            f"{parts.path.rstrip('/')}/changes",
+            body=json.dumps(job).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        response = connection.getresponse()
+        if response.status != 200:
+            error = json.loads(response.read() or b"{}").get("error")
+            raise ValueError(f"Comparison failed on {url}: {error}")
+        for line in response:
+            record = json.loads(line)
+            record_type = record.pop("type")
+            if record_type == "cell_change":
+                yield record
+            elif record_type == "summary":
+                diff_metrics.update(record["diff_metrics"])
+                return
+            else:
+                raise ValueError(f"Comparison failed on {url}: {record['error']}")
+        raise ValueError(f"Changes from {url} ended before the comparison finished")
+    finally:
+        connection.close()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Approximate comparison of files from small fixed size sketches.
+
+Each file is read once and every line is hashed with BLAKE2b, as for the file digests. The top 64
+bits of the hash feed two sketches:
+
+- a HyperLogLog of 2**precision one byte registers, which estimates the number of unique lines
+  with a relative standard error of 1.04 / sqrt(2**precision);
+- a bottom-k MinHash, the k smallest distinct line hashes, which estimates the Jaccard similarity
+  of the sets of lines in two files with a standard error of sqrt(J * (1 - J) / k).
+
+Memory use does not depend on the size of the file. The multiset digest and line count are
+computed in the same pass, so a sketch also says whether two files are exactly the same. Sketches
+are stored as JSON sidecar files next to the data file, so a snapshot sketched once can be
+compared against later snapshots without being read again.
+"""
+
+import base64
+import codecs
+import heapq
+import json
+import math
+import os
+
+from hashlib import blake2b
+from typing import Optional
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.digests import DIGEST_BITS, DIGEST_MASK, format_digest
+from hdx_file_comparison.instrumentation import stage
+
+SKETCH_ALGORITHM = "blake2b-64-hll-bottomk"
+SKETCH_SUFFIX = ".sketch.json"
+DEFAULT_PRECISION = 14
+DEFAULT_K = 1024
+HASH_BITS = 64
+
+
+class FileSketch:
+    def __init__(self, precision: int = DEFAULT_PRECISION, k: int = DEFAULT_K):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, not {precision}")
+        self.precision = precision
+        self.k = k
+        self.registers = bytearray(1 << precision)
+        self.n_rows = 0
+        self.digest_total = 0
+        # Max heap of the k smallest hashes, stored negated, and the same hashes as a set
+        self._heap = []
+        self._bottom_k = set()
+
+    def add(self, line_bytes: bytes):
+        """Add a line, without its line ending, encoded as UTF-8"""
+        row_hash_value = int.from_bytes(
+            blake2b(line_bytes, digest_size=DIGEST_BITS // 8).digest(), "big"
+        )
+        self.digest_total = (self.digest_total + row_hash_value) & DIGEST_MASK
+        self.n_rows += 1
+        self.add_hash(row_hash_value >> (DIGEST_BITS - HASH_BITS))
+
+    def add_hash(self, hash_value: int):
+        register_bits = HASH_BITS - self.precision
+        index = hash_value >> register_bits
+        rank = register_bits - (hash_value & ((1 << register_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+        if len(self._heap) < self.k:
+            if hash_value not in self._bottom_k:
+                heapq.heappush(self._heap, -hash_value)
+                self._bottom_k.add(hash_value)
+        elif hash_value < -self._heap[0] and hash_value not in self._bottom_k:
+            self._bottom_k.discard(-heapq.heapreplace(self._heap, -hash_value))
+            self._bottom_k.add(hash_value)
+
+    @property
+    def digest(self) -> str:
+        return format_digest(self.digest_total)
+
+    @property
+    def bottom_k(self) -> list[int]:
+        return sorted(self._bottom_k)
+
+    def unique_estimate(self) -> float:
+        return _hyperloglog_estimate(self.registers)
+
+    def unique_relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_dict(self) -> dict:
+        return {
+            "algorithm": SKETCH_ALGORITHM,
+            "precision": self.precision,
+            "k": self.k,
+            "n_rows": self.n_rows,
+            "digest": self.digest,
+            "registers": base64.b64encode(bytes(self.registers)).decode("ascii"),
+            "bottom_k": self.bottom_k,
+        }
+
+    @classmethod
+    def from_dict(cls, sketch_dict: dict) -> "FileSketch":
+        sketch = cls(precision=sketch_dict["precision"], k=sketch_dict["k"])
+        sketch.n_rows = sketch_dict["n_rows"]
+        sketch.digest_total = int(sketch_dict["digest"], 16)
+        sketch.registers = bytearray(base64.b64decode(sketch_dict["registers"]))
+        sketch._bottom_k = set(sketch_dict["bottom_k"])
+        sketch._heap = [-x for x in sketch._bottom_k]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+def _hyperloglog_estimate(registers: bytearray) -> float:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0**-x for x in registers)
+    n_zero = registers.count(0)
+    if estimate <= 2.5 * m and n_zero > 0:
+        # Linear counting is more accurate for small cardinalities
+        estimate = m * math.log(m / n_zero)
+    return estimate
+
+
+def sketch_file(
+    filepath: str,
+    encoding: str = "utf-8",
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+) -> dict:
+    """Sketch a file in one streaming pass
+
+    Arguments:
+        filepath {str} -- path to the file
+
+    Keyword Arguments:
+        encoding {str} -- file encoding (default: {"utf-8"})
+        precision {int} -- log2 of the number of HyperLogLog registers
+        (default: {DEFAULT_PRECISION})
+        k {int} -- number of hashes kept by the MinHash sketch (default: {DEFAULT_K})
+
+    Returns:
+        dict -- the sketch, with the file size and modification time used to check a sidecar is
+        still valid
+    """
+    stat = os.stat(filepath)
+    sketch = FileSketch(precision=precision, k=k)
+    is_utf8 = codecs.lookup(encoding).name == "utf-8"
+    with stage("sketch", filepath=filepath) as span, open(filepath, "rb") as file_handle:
+        for line in file_handle:
+            if is_utf8:
+                sketch.add(line.rstrip(b"\r\n"))
+            else:
+                sketch.add(line.decode(encoding).rstrip("\r\n").encode("utf-8"))
+        span.add(rows=sketch.n_rows, bytes_read=stat.st_size)
+
+    return {
+        **sketch.to_dict(),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "encoding": encoding,
+    }
+
+
+def sketch_path(filepath: str) -> str:
+    return f"{filepath}{SKETCH_SUFFIX}"
+
+
+def write_sketch_sidecar(filepath: str, sketch: dict) -> str:
+    output_path = sketch_path(filepath)
+    with atomic_output(output_path, "w", encoding="utf-8") as sidecar_handle:
+        json.dump(sketch, sidecar_handle)
+    return output_path
+
+
+def read_sketch_sidecar(
+    filepath: str,
+    encoding: str = "utf-8",
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+) -> Optional[dict]:
+    """Read the sketch sidecar for filepath, returning None if it is missing, was made with other
+    settings or if the file has changed size or modification time since it was made"""
+    try:
+        with open(sketch_path(filepath), encoding="utf-8") as sidecar_handle:
+            sketch = json.load(sidecar_handle)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(filepath)
+    if (
+        sketch.get("algorithm") != SKETCH_ALGORITHM
+        or sketch.get("precision") != precision
+        or sketch.get("k") != k
+        or sketch.get("encoding") != encoding
+        or sketch.get("size") != stat.st_size
+        or sketch.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return sketch
+
+
+def load_or_compute_sketch(
+    filepath: str,
+    encoding: str = "utf-8",
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+) -> dict:
+    """Return the sketch for filepath from its sidecar if it is still valid, otherwise compute it
+    and write a new sidecar"""
+    sketch = read_sketch_sidecar(filepath, encoding=encoding, precision=precision, k=k)
+    if sketch is None:
+        sketch = sketch_file(filepath, encoding=encoding, precision=precision, k=k)
+        write_sketch_sidecar(filepath, sketch)
+    return sketch
+
+
+def compare_sketches(sketch_1: dict, sketch_2: dict) -> dict:
+    """Estimate how different two files are from their sketches
+
+    Arguments:
+        sketch_1 {dict} -- sketch of the original file
+        sketch_2 {dict} -- sketch of the new file
+
+    Returns:
+        dict -- exact line counts and whether the file hashes match, estimated unique line
+        counts, Jaccard similarity and numbers of unique lines common to both files and only in
+        the first, each estimate with its standard error
+    """
+    if (sketch_1["precision"], sketch_1["k"]) != (sketch_2["precision"], sketch_2["k"]):
+        raise ValueError("Sketches made with different precision or k cannot be compared")
+    file_sketch_1 = FileSketch.from_dict(sketch_1)
+    file_sketch_2 = FileSketch.from_dict(sketch_2)
+
+    unique_1 = file_sketch_1.unique_estimate()
+    unique_2 = file_sketch_2.unique_estimate()
+    union = _hyperloglog_estimate(
+        bytearray(map(max, file_sketch_1.registers, file_sketch_2.registers))
+    )
+    relative_error = file_sketch_1.unique_relative_error()
+
+    jaccard, jaccard_error = _jaccard(
+        set(sketch_1["bottom_k"]), set(sketch_2["bottom_k"]), sketch_1["k"]
+    )
+    n_common = jaccard * union
+    n_differing = max(0.0, unique_1 - n_common)
+    n_differing_error = math.hypot(
+        relative_error * unique_1, jaccard_error * union, jaccard * relative_error * union
+    )
+    if sketch_1["digest"] == sketch_2["digest"]:
+        # The files have the same lines, so only the unique count is an estimate
+        jaccard, jaccard_error = 1.0, 0.0
+        n_common, n_differing, n_differing_error = unique_1, 0.0, 0.0
+
+    return {
+        "file_1_length": sketch_1["n_rows"],
+        "file_2_length": sketch_2["n_rows"],
+        "hashes_match": sketch_1["digest"] == sketch_2["digest"],
+        "file_1_unique": round(unique_1),
+        "file_2_unique": round(unique_2),
+        "unique_relative_error": relative_error,
+        "jaccard": jaccard,
+        "jaccard_error": jaccard_error,
+        "n_common": round(n_common),
+        "n_differing": round(n_differing),
+        "n_differing_error": round(n_differing_error),
+    }
+
+
+def _jaccard(bottom_k_1: set, bottom_k_2: set, k: int) -> tuple[float, float]:
+    """Estimate Jaccard similarity from the k smallest hashes of the union of two sets, which are
+    among the k smallest hashes of one set or the other. If both sketches hold fewer than k
+    hashes they are the whole sets and the similarity is exact."""
+    union = heapq.nsmallest(k, bottom_k_1 | bottom_k_2)
+    if len(union) == 0:
+        return 1.0, 0.0
+    jaccard = sum(1 for x in union if x in bottom_k_1 and x in bottom_k_2) / len(union)
+    if len(bottom_k_1) < k and len(bottom_k_2) < k:
+        return jaccard, 0.0
+    return jaccard, math.sqrt(jaccard * (1 - jaccard) / len(union))
+
+
+def sketch_file_comparison(
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    precision: int = DEFAULT_PRECISION,
+    k: int = DEFAULT_K,
+) -> dict:
+    """Approximate equivalent of hash_based_file_comparison using sketches, which are read from
+    or written to sidecar files
+
+    Returns:
+        dict -- see compare_sketches
+    """
+    return compare_sketches(
+        load_or_compute_sketch(filepath_1, encoding=encoding, precision=precision, k=k),
+        load_or_compute_sketch(filepath_2, encoding=encoding, precision=precision, k=k),
+    )
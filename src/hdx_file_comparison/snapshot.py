@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compressed columnar snapshots of downloaded CSV files.
+
+A snapshot holds the same table as the CSV file it was made from, split into row groups and, within
+each row group, into one gzip compressed block per column. The header, the HXL hashtag row which
+HAPI puts on line 2 and the byte offset and length of every block are kept in a JSON index at the
+end of the file, so reading a few columns only reads and decompresses the blocks for those columns.
+
+The file is laid out as MAGIC, the column blocks, the UTF-8 JSON index, the length of the index as
+an 8 byte little endian integer and MAGIC again. Each block is the values of one column in one row
+group written as single column CSV, so values can hold commas, quotes and newlines.
+
+Comparisons run on CSV, so a snapshot, or a CSV file restricted to some of its columns, is written
+out as a projected CSV file with the header and HXL row in place. Row numbers in the projected
+file are the same as in the original.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterator, Optional
+
+from hdx_file_comparison.atomic import atomic_output
+from hdx_file_comparison.instrumentation import stage
+
+MAGIC = b"HDXCOL1\n"
+SNAPSHOT_EXTENSION = ".hdxcol"
+SNAPSHOT_FORMATS = ["csv", "columnar"]
+DEFAULT_ROW_GROUP_SIZE = 100_000
+INDEX_LENGTH_BYTES = 8
+
+
+def snapshot_path(filepath: str) -> str:
+    """The snapshot path for a CSV file, with its extension replaced"""
+    return f"{os.path.splitext(filepath)[0]}{SNAPSHOT_EXTENSION}"
+
+
+def is_snapshot(filepath: str) -> bool:
+    try:
+        with open(filepath, "rb") as file_handle:
+            return file_handle.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def is_hxl_row(row: list[str]) -> bool:
+    """Whether a row is HXL hashtags, every non empty value starting with #"""
+    values = [x for x in row if x != ""]
+    return len(values) > 0 and all(x.startswith("#") for x in values)
+
+
+def write_snapshot(
+    filepath: str,
+    output_path: Optional[str] = None,
+    encoding: str = "utf-8",
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    compresslevel: int = 6,
+) -> str:
+    """Write a CSV file as a columnar snapshot
+
+    Arguments:
+        filepath {str} -- path to the CSV file
+
+    Keyword Arguments:
+        output_path {Optional[str]} -- path of the snapshot (default: {snapshot_path(filepath)})
+        encoding {str} -- encoding of the CSV file (default: {"utf-8"})
+        row_group_size {int} -- rows in each row group (default: {DEFAULT_ROW_GROUP_SIZE})
+        compresslevel {int} -- gzip compression level (default: {6})
+
+    Returns:
+        str -- path to the snapshot
+    """
+    output_path = output_path or snapshot_path(filepath)
+    index = {"header": [], "hxl": None, "n_rows": 0, "row_groups": []}
+    with stage("snapshot_write", filepath=filepath) as span, open(
+        filepath, encoding=encoding, newline=""
+    ) as input_handle, atomic_output(output_path) as output_handle:
+        csv_reader = csv.reader(input_handle)
+        index["header"] = next(csv_reader, [])
+        first_row = next(csv_reader, None)
+        pending = []
+        if first_row is not None and is_hxl_row(first_row):
+            index["hxl"] = _fit(first_row, len(index["header"]))
+        elif first_row is not None:
+            pending.append(first_row)
+
+        output_handle.write(MAGIC)
+        position = len(MAGIC)
+        while True:
+            rows = pending + list(islice(csv_reader, row_group_size - len(pending)))
+            pending = []
+            if len(rows) == 0:
+                break
+            row_group = {"n_rows": len(rows), "columns": {}}
+            for i, column in enumerate(index["header"]):
+                block = gzip.compress(
+                    _encode_column([x[i] if i < len(x) else "" for x in rows]),
+                    compresslevel=compresslevel,
+                )
+                output_handle.write(block)
+                row_group["columns"][column] = [position, len(block)]
+                position += len(block)
+            index["row_groups"].append(row_group)
+            index["n_rows"] += len(rows)
+
+        encoded_index = json.dumps(index).encode("utf-8")
+        output_handle.write(encoded_index)
+        output_handle.write(len(encoded_index).to_bytes(INDEX_LENGTH_BYTES, "little"))
+        output_handle.write(MAGIC)
+        span.add(rows=index["n_rows"], bytes_read=os.path.getsize(filepath))
+    return output_path
+
+
+def _fit(row: list[str], length: int) -> list[str]:
+    """Pad a short row with empty values or drop values beyond the header"""
+    return (row + length * [""])[0:length]
+
+
+def _encode_column(values: list[str]) -> bytes:
+    buffer = io.StringIO()
+    csv_writer = csv.writer(buffer, lineterminator="\n")
+    csv_writer.writerows([x] for x in values)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _decode_column(block: bytes) -> list[str]:
+    text = gzip.decompress(block).decode("utf-8")
+    return [x[0] if x else "" for x in csv.reader(io.StringIO(text, newline=""))]
+
+
+def read_snapshot_index(filepath: str) -> dict:
+    """Read the index at the end of a snapshot
+
+    Returns:
+        dict -- the header, HXL row (None if there was none), number of rows and, for each row
+        group, its number of rows and the offset and length of each column block
+    """
+    trailer_length = INDEX_LENGTH_BYTES + len(MAGIC)
+    with open(filepath, "rb") as file_handle:
+        if file_handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filepath} is not a columnar snapshot")
+        file_handle.seek(-trailer_length, os.SEEK_END)
+        trailer = file_handle.read(trailer_length)
+        if trailer[INDEX_LENGTH_BYTES:] != MAGIC:
+            raise ValueError(f"{filepath} is a truncated columnar snapshot")
+        index_length = int.from_bytes(trailer[0:INDEX_LENGTH_BYTES], "little")
+        file_handle.seek(-(trailer_length + index_length), os.SEEK_END)
+        return json.loads(file_handle.read(index_length))
+
+
+def _selected_columns(header: list[str], columns: Optional[list[str]]) -> list[str]:
+    """The requested columns found in the header, in the order requested, all of them if columns
+    is None"""
+    if columns is None:
+        return list(header)
+    return [x for x in dict.fromkeys(columns) if x in header]
+
+
+def iter_row_groups(
+    filepath: str, columns: Optional[list[str]] = None
+) -> Iterator[dict[str, list[str]]]:
+    """Read a snapshot a row group at a time, only decompressing the blocks of the requested
+    columns
+
+    Yields:
+        dict[str, list[str]] -- the values of each column in the row group
+    """
+    index = read_snapshot_index(filepath)
+    selected = _selected_columns(index["header"], columns)
+    with stage("snapshot_read", filepath=filepath) as span, open(filepath, "rb") as file_handle:
+        for row_group in index["row_groups"]:
+            values = {}
+            for column in selected:
+                offset, length = row_group["columns"][column]
+                file_handle.seek(offset)
+                values[column] = _decode_column(file_handle.read(length))
+                span.add(bytes_read=length)
+            span.add(rows=row_group["n_rows"])
+            yield values
+
+
+def read_columns(filepath: str, columns: Optional[list[str]] = None) -> dict:
+    """Read some or all of the columns of a snapshot, see load_columns
+
+    Returns:
+        dict -- the header of the selected columns, the HXL row for them, the number of rows and
+        a tuple of values for each column
+    """
+    index = read_snapshot_index(filepath)
+    selected = _selected_columns(index["header"], columns)
+    values = {x: [] for x in selected}
+    for row_group in iter_row_groups(filepath, selected):
+        for column in selected:
+            values[column].extend(row_group[column])
+    hxl = None
+    if index["hxl"] is not None:
+        hxl = [index["hxl"][index["header"].index(x)] for x in selected]
+    return {
+        "header": selected,
+        "hxl": hxl,
+        "n_rows": index["n_rows"],
+        "columns": {x: tuple(values[x]) for x in selected},
+    }
+
+
+def write_projected_csv(
+    filepath: str, output_path: str, columns: Optional[list[str]] = None, encoding: str = "utf-8"
+) -> int:
+    """Write the requested columns of a CSV file or snapshot to a CSV file, keeping the header and
+    HXL row, so that an engine only sees those columns
+
+    Returns:
+        int -- the number of rows written, not counting the header and HXL rows
+    """
+    n_rows = 0
+    with open(output_path, "w", encoding="utf-8", newline="") as output_handle:
+        csv_writer = csv.writer(output_handle, lineterminator="\n")
+        if is_snapshot(filepath):
+            index = read_snapshot_index(filepath)
+            selected = _selected_columns(index["header"], columns)
+            positions = [index["header"].index(x) for x in selected]
+            csv_writer.writerow(selected)
+            if index["hxl"] is not None:
+                csv_writer.writerow([index["hxl"][x] for x in positions])
+            for row_group in iter_row_groups(filepath, selected):
+                rows = list(zip(*[row_group[x] for x in selected]))
+                csv_writer.writerows(rows)
+                n_rows += len(rows)
+            return n_rows
+
+        with stage("project", filepath=filepath) as span, open(
+            filepath, encoding=encoding, newline=""
+        ) as input_handle:
+            csv_reader = csv.reader(input_handle)
+            header = next(csv_reader, [])
+            positions = [header.index(x) for x in _selected_columns(header, columns)]
+            csv_writer.writerow([header[x] for x in positions])
+            for row in csv_reader:
+                csv_writer.writerow([row[x] if x < len(row) else "" for x in positions])
+                n_rows += 1
+            span.add(rows=n_rows, bytes_read=os.path.getsize(filepath))
+    return n_rows
+
+
+@contextmanager
+def projected_files(
+    filepath_1: str, filepath_2: str, columns: Optional[list[str]] = None
+) -> Iterator[tuple[str, str]]:
+    """Write two CSV files or snapshots as CSV files holding only the requested columns, which
+    are deleted at the end of the with block. If no columns are requested and neither file is a
+    snapshot the original files are used.
+
+    Arguments:
+        filepath_1 {str} -- path to the original file
+        filepath_2 {str} -- path to the new file
+
+    Keyword Arguments:
+        columns {Optional[list[str]]} -- columns to keep, those not in a file are ignored, all
+        columns if None (default: {None})
+
+    Yields:
+        tuple[str, str] -- paths to the two files to compare
+    """
+    if columns is None and not is_snapshot(filepath_1) and not is_snapshot(filepath_2):
+        yield filepath_1, filepath_2
+        return
+
+    with tempfile.TemporaryDirectory(prefix="hdx-compare-projected-") as directory:
+        projected = []
+        for i, filepath in enumerate([filepath_1, filepath_2], start=1):
+            projected_path = os.path.join(directory, f"file_{i}.csv")
+            write_projected_csv(filepath, projected_path, columns)
+            projected.append(projected_path)
+        yield projected[0], projected[1]
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Bounded memory comparison of CSV files which may be larger than the available RAM.
+
+Both files are read incrementally, records are accumulated until they exceed a memory limit at
+which point they are sorted and spilled to a temporary file as a "run". The runs are then merged
+back into a single sorted stream per file and the two streams are merge-joined to produce the
+same metrics as hash_based_file_comparison, compute_diff_metrics and keyed_compare.
+"""
+
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+
+from typing import Callable, Iterable, Iterator, Optional
+
+from hdx_file_comparison.digests import DIGEST_MASK, format_digest, row_hash
+from hdx_file_comparison.utilities import _column_pairs, _compare_fields, _key_indices
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+# Rough per record overhead of a Python list of str, used to estimate memory use of a run
+RECORD_OVERHEAD = 120
+
+
+def external_sort(
+    records: Iterable[list[str]],
+    sort_key: Callable,
+    temp_directory: str,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+) -> Iterator[list[str]]:
+    """Sort records, which are lists of strings, spilling sorted runs to temp_directory whenever
+    the estimated size of the records held in memory exceeds memory_limit bytes.
+
+    Arguments:
+        records {Iterable[list[str]]} -- records to sort
+        sort_key {Callable} -- function mapping a record to its sort key
+        temp_directory {str} -- directory for sorted runs, the caller is responsible for removal
+
+    Keyword Arguments:
+        memory_limit {int} -- memory ceiling in bytes (default: {DEFAULT_MEMORY_LIMIT})
+
+    Returns:
+        Iterator[list[str]] -- records in sorted order
+    """
+    run_paths = []
+    buffer = []
+    buffer_size = 0
+    for record in records:
+        buffer.append(record)
+        buffer_size += RECORD_OVERHEAD + sum(len(x) for x in record)
+        if buffer_size > memory_limit:
+            run_paths.append(_spill_run(buffer, sort_key, temp_directory, len(run_paths)))
+            buffer = []
+            buffer_size = 0
+
+    buffer.sort(key=sort_key)
+    if len(run_paths) == 0:
+        return iter(buffer)
+
+    return heapq.merge(
+        *[_read_run(x) for x in run_paths],
+        iter(buffer),
+        key=sort_key,
+    )
+
+
+def _spill_run(buffer: list, sort_key: Callable, temp_directory: str, run_number: int) -> str:
+    buffer.sort(key=sort_key)
+    run_path = os.path.join(temp_directory, f"run-{run_number:05d}.csv")
+    with open(run_path, "w", encoding="utf-8", newline="") as run_handle:
+        csv.writer(run_handle).writerows(buffer)
+    return run_path
+
+
+def _read_run(run_path: str) -> Iterator[list[str]]:
+    with open(run_path, encoding="utf-8", newline="") as run_handle:
+        yield from csv.reader(run_handle)
+
+
+def _iter_lines(filepath: str, encoding: str) -> Iterator[list[str]]:
+    with open(filepath, encoding=encoding) as file_handle:
+        for line in file_handle:
+            yield [line.rstrip("\r\n")]
+
+
+def _grouped_counts(sorted_records: Iterator[list[str]]) -> Iterator[tuple[str, int]]:
+    for line, group in itertools.groupby(sorted_records, key=lambda x: x[0]):
+        yield line, sum(1 for _ in group)
+
+
+def _merge_join_counts(
+    file_1_counts: Iterator[tuple], file_2_counts: Iterator[tuple]
+) -> Iterator[tuple[str, int, int]]:
+    """Merge two sorted streams of (line, count) yielding (line, count_1, count_2)"""
+    sentinel = (None, 0)
+    item_1 = next(file_1_counts, sentinel)
+    item_2 = next(file_2_counts, sentinel)
+    while item_1 is not sentinel or item_2 is not sentinel:
+        if item_2 is sentinel or (item_1 is not sentinel and item_1[0] < item_2[0]):
+            yield item_1[0], item_1[1], 0
+            item_1 = next(file_1_counts, sentinel)
+        elif item_1 is sentinel or item_2[0] < item_1[0]:
+            yield item_2[0], 0, item_2[1]
+            item_2 = next(file_2_counts, sentinel)
+        else:
+            yield item_1[0], item_1[1], item_2[1]
+            item_1 = next(file_1_counts, sentinel)
+            item_2 = next(file_2_counts, sentinel)
+
+
+def streaming_file_comparison(
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    temp_directory: Optional[str] = None,
+) -> dict:
+    """Bounded memory equivalent of hash_based_file_comparison, the order independent file hashes
+    are the same multiset digests as it produces.
+
+    Returns:
+        dict -- hash metrics with the same keys as hash_based_file_comparison
+    """
+    hash_metrics = {
+        "file_1_length": 0,
+        "file_2_length": 0,
+        "file_1_unique": 0,
+        "file_2_unique": 0,
+        "n_common": 0,
+        "n_differing": 0,
+    }
+    file_1_hash = 0
+    file_2_hash = 0
+    in_1_but_not_2 = []
+    in_2_but_not_1 = []
+
+    with tempfile.TemporaryDirectory(dir=temp_directory) as run_directory:
+        file_1_sorted = external_sort(
+            _iter_lines(filepath_1, encoding),
+            _first_field,
+            _make_subdirectory(run_directory, "file_1"),
+            memory_limit=memory_limit // 2,
+        )
+        file_2_sorted = external_sort(
+            _iter_lines(filepath_2, encoding),
+            _first_field,
+            _make_subdirectory(run_directory, "file_2"),
+            memory_limit=memory_limit // 2,
+        )
+        for line, count_1, count_2 in _merge_join_counts(
+            _grouped_counts(file_1_sorted), _grouped_counts(file_2_sorted)
+        ):
+            hash_metrics["file_1_length"] += count_1
+            hash_metrics["file_2_length"] += count_2
+            if count_1 != 0:
+                hash_metrics["file_1_unique"] += 1
+                file_1_hash = (file_1_hash + count_1 * row_hash(line)) & DIGEST_MASK
+            if count_2 != 0:
+                hash_metrics["file_2_unique"] += 1
+                file_2_hash = (file_2_hash + count_2 * row_hash(line)) & DIGEST_MASK
+            if count_1 != 0 and count_2 != 0:
+                hash_metrics["n_common"] += 1
+            elif count_1 != 0:
+                hash_metrics["n_differing"] += 1
+                if len(in_1_but_not_2) < 10:
+                    in_1_but_not_2.append(line)
+            elif len(in_2_but_not_1) < 10:
+                in_2_but_not_1.append(line)
+
+    hash_metrics["file_1_hash"] = format_digest(file_1_hash)
+    hash_metrics["file_2_hash"] = format_digest(file_2_hash)
+
+    if hash_metrics["file_1_hash"] != hash_metrics["file_2_hash"]:
+        print("in 1 but not in 2")
+        for element in in_1_but_not_2:
+            print(element, flush=True)
+
+        print("in 2 but not in 1")
+        for element in in_2_but_not_1:
+            print(element, flush=True)
+
+    return hash_metrics
+
+
+def streaming_compare(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: Optional[list[str]] = None,
+    encoding: str = "utf-8",
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    temp_directory: Optional[str] = None,
+) -> dict:
+    """Bounded memory diff of two CSV files. With key_columns rows are sorted by key and
+    merge-joined giving the same output as keyed_compare. Without key_columns lines are matched
+    as a multiset so only additions and removals are reported.
+
+    Returns:
+        dict -- diff metrics in the same form as process()
+    """
+    diff_metrics = {}
+    cell_changes = list(
+        iter_streaming_compare(
+            filepath_1,
+            filepath_2,
+            diff_metrics,
+            key_columns,
+            encoding=encoding,
+            memory_limit=memory_limit,
+            temp_directory=temp_directory,
+        )
+    )
+    diff_metrics["cell_changes"] = sorted(cell_changes, key=lambda x: x["row"])
+    return diff_metrics
+
+
+def iter_streaming_compare(
+    filepath_1: str,
+    filepath_2: str,
+    diff_metrics: dict,
+    key_columns: Optional[list[str]] = None,
+    encoding: str = "utf-8",
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    temp_directory: Optional[str] = None,
+) -> Iterator[dict]:
+    """streaming_compare yielding cell changes as the merge join finds them, in key order rather
+    than row order, with the line counts kept up to date in diff_metrics. Without key_columns
+    nothing is yielded.
+    """
+    diff_metrics.update({"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0})
+    if key_columns:
+        yield from _iter_streaming_keyed_changes(
+            filepath_1,
+            filepath_2,
+            key_columns,
+            diff_metrics,
+            encoding,
+            memory_limit,
+            temp_directory,
+        )
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_directory) as run_directory:
+        file_1_sorted = external_sort(
+            _iter_lines(filepath_1, encoding),
+            _first_field,
+            _make_subdirectory(run_directory, "file_1"),
+            memory_limit=memory_limit // 2,
+        )
+        file_2_sorted = external_sort(
+            _iter_lines(filepath_2, encoding),
+            _first_field,
+            _make_subdirectory(run_directory, "file_2"),
+            memory_limit=memory_limit // 2,
+        )
+        for _, count_1, count_2 in _merge_join_counts(
+            _grouped_counts(file_1_sorted), _grouped_counts(file_2_sorted)
+        ):
+            if count_1 > count_2:
+                diff_metrics["n_lines_removed"] += count_1 - count_2
+            else:
+                diff_metrics["n_lines_added"] += count_2 - count_1
+
+
+def _iter_streaming_keyed_changes(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: list[str],
+    diff_metrics: dict,
+    encoding: str,
+    memory_limit: int,
+    temp_directory: Optional[str],
+) -> Iterator[dict]:
+    with open(filepath_1, encoding=encoding, newline="") as file_1_handle, open(
+        filepath_2, encoding=encoding, newline=""
+    ) as file_2_handle, tempfile.TemporaryDirectory(dir=temp_directory) as run_directory:
+        file_1_reader = csv.reader(file_1_handle)
+        file_2_reader = csv.reader(file_2_handle)
+        header_1 = next(file_1_reader)
+        header_2 = next(file_2_reader)
+        key_idxs_1 = _key_indices(header_1, key_columns, filepath_1)
+        key_idxs_2 = _key_indices(header_2, key_columns, filepath_2)
+        column_pairs = _column_pairs(header_1, header_2)
+
+        # Records are [line_number, *key, *row] so that the key can be recovered after a spill
+        key_end = len(key_columns) + 1
+
+        def record_sort_key(record: list[str]) -> tuple:
+            # Zero padded line numbers sort numerically so repeated keys keep their file order
+            return (record[1:key_end], record[0])
+
+        file_1_sorted = external_sort(
+            _iter_keyed_records(file_1_reader, key_idxs_1),
+            record_sort_key,
+            _make_subdirectory(run_directory, "file_1"),
+            memory_limit=memory_limit // 2,
+        )
+        file_2_sorted = external_sort(
+            _iter_keyed_records(file_2_reader, key_idxs_2),
+            record_sort_key,
+            _make_subdirectory(run_directory, "file_2"),
+            memory_limit=memory_limit // 2,
+        )
+
+        file_1_groups = itertools.groupby(file_1_sorted, key=lambda x: x[1:key_end])
+        file_2_groups = itertools.groupby(file_2_sorted, key=lambda x: x[1:key_end])
+        sentinel = (None, None)
+        group_1 = next(file_1_groups, sentinel)
+        group_2 = next(file_2_groups, sentinel)
+        while group_1 is not sentinel or group_2 is not sentinel:
+            if group_2 is sentinel or (group_1 is not sentinel and group_1[0] < group_2[0]):
+                diff_metrics["n_lines_removed"] += sum(1 for _ in group_1[1])
+                group_1 = next(file_1_groups, sentinel)
+            elif group_1 is sentinel or group_2[0] < group_1[0]:
+                diff_metrics["n_lines_added"] += sum(1 for _ in group_2[1])
+                group_2 = next(file_2_groups, sentinel)
+            else:
+                records_1 = list(group_1[1])
+                records_2 = list(group_2[1])
+                for record_1, record_2 in zip(records_1, records_2):
+                    original_row = record_1[key_end:]
+                    new_row = record_2[key_end:]
+                    if header_1 == header_2 and original_row == new_row:
+                        continue
+                    row_changes = _compare_fields(
+                        int(record_1[0]), original_row, new_row, column_pairs
+                    )
+                    if row_changes:
+                        diff_metrics["n_lines_changed"] += 1
+                        yield from row_changes
+                diff_metrics["n_lines_removed"] += max(0, len(records_1) - len(records_2))
+                diff_metrics["n_lines_added"] += max(0, len(records_2) - len(records_1))
+                group_1 = next(file_1_groups, sentinel)
+                group_2 = next(file_2_groups, sentinel)
+
+
+def _iter_keyed_records(csv_reader, key_idxs: list[int]) -> Iterator[list[str]]:
+    for line_number, row in enumerate(csv_reader, start=1):
+        key = [row[i] if i < len(row) else "" for i in key_idxs]
+        yield [f"{line_number:012d}", *key, *row]
+
+
+def _first_field(record: list[str]) -> str:
+    return record[0]
+
+
+def _make_subdirectory(directory: str, name: str) -> str:
+    subdirectory = os.path.join(directory, name)
+    os.makedirs(subdirectory, exist_ok=True)
+    return subdirectory
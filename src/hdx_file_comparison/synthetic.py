@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Synthetic HAPI food price CSVs for benchmarking.
+
+Rows have the columns of the WFP food price files served by HAPI, with the HXL hashtag row,
+sorted by date, market and commodity so that date, admin1, admin2, market, commodity and
+pricetype identify a row. A pair of files is written in one pass, the second being the first with
+an edit profile applied, and the number of changes made is returned so that the output of a
+comparison can be checked.
+"""
+
+import csv
+import datetime
+import math
+import random
+
+from typing import Iterator
+
+HEADER = [
+    "date",
+    "admin1",
+    "admin2",
+    "market",
+    "latitude",
+    "longitude",
+    "category",
+    "commodity",
+    "unit",
+    "priceflag",
+    "pricetype",
+    "currency",
+    "price",
+    "usdprice",
+]
+HXL_ROW = [
+    "#date",
+    "#adm1+name",
+    "#adm2+name",
+    "#loc+market+name",
+    "#geo+lat",
+    "#geo+lon",
+    "#item+type",
+    "#item+name",
+    "#item+unit",
+    "#item+price+flag",
+    "#item+price+type",
+    "#currency",
+    "#value",
+    "#value+usd",
+]
+KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+COMMODITIES = [
+    ("cereals and tubers", "Bread", "KG"),
+    ("cereals and tubers", "Rice (high quality)", "KG"),
+    ("cereals and tubers", "Rice (low quality)", "KG"),
+    ("cereals and tubers", "Wheat", "KG"),
+    ("cereals and tubers", "Wheat flour (high quality)", "KG"),
+    ("cereals and tubers", "Wheat flour (low quality)", "KG"),
+    ("miscellaneous food", "Salt", "KG"),
+    ("miscellaneous food", "Sugar", "KG"),
+    ("oil and fats", "Oil (cooking)", "L"),
+    ("pulses and nuts", "Beans", "KG"),
+    ("pulses and nuts", "Lentils", "KG"),
+    ("non-food", "Fuel (diesel)", "L"),
+    ("non-food", "Exchange rate", "USD/LCU"),
+    ("non-food", "Wage (non-qualified labour, non-agricultural)", "Day"),
+]
+PRICE_TYPES = ["Retail", "Wholesale"]
+EXCHANGE_RATE = 70.0
+EDIT_PROFILES = ["identical", "cell_edits", "appended", "deletions", "reordered", "duplicated"]
+# Rows are shuffled within windows of this many rows by the reordered profile
+REORDER_WINDOW = 1000
+
+
+def iter_synthetic_rows(n_rows: int, seed: int = 0) -> Iterator[list[str]]:
+    """Yield n_rows data rows, the number of markets grows with n_rows so that there are a few
+    dozen dates whatever the size"""
+    rng = random.Random(seed)
+    n_markets = max(20, n_rows // 2000)
+    markets = [
+        (
+            f"Province {i % 34:02d}",
+            f"District {i % 400:03d}",
+            f"Market {i:05d}",
+            f"{rng.uniform(29.0, 38.5):0.6f}",
+            f"{rng.uniform(60.5, 74.9):0.6f}",
+        )
+        for i in range(n_markets)
+    ]
+    date = datetime.date(2000, 1, 15)
+    n_yielded = 0
+    while True:
+        for market in markets:
+            for category, commodity, unit in COMMODITIES:
+                for pricetype in PRICE_TYPES:
+                    if n_yielded == n_rows:
+                        return
+                    price = rng.uniform(1.0, 500.0)
+                    yield [
+                        date.isoformat(),
+                        *market,
+                        category,
+                        commodity,
+                        unit,
+                        "actual",
+                        pricetype,
+                        "AFN",
+                        f"{price:0.1f}",
+                        f"{price / EXCHANGE_RATE:0.4f}",
+                    ]
+                    n_yielded += 1
+        date = _next_month(date)
+
+
+def _next_month(date: datetime.date) -> datetime.date:
+    if date.month == 12:
+        return date.replace(year=date.year + 1, month=1)
+    return date.replace(month=date.month + 1)
+
+
+def generate_pair(
+    filepath_1: str,
+    filepath_2: str,
+    n_rows: int,
+    edit_profile: str = "cell_edits",
+    rate: float = 0.01,
+    seed: int = 0,
+) -> dict:
+    """Write a synthetic file and an edited copy of it
+
+    Arguments:
+        filepath_1 {str} -- path for the original file
+        filepath_2 {str} -- path for the edited file
+        n_rows {int} -- number of data rows in the original file
+
+    Keyword Arguments:
+        edit_profile {str} -- one of EDIT_PROFILES (default: {"cell_edits"})
+        rate {float} -- fraction of rows edited, appended, deleted or duplicated (default: {0.01})
+        seed {int} -- random seed, the same seed gives the same files (default: {0})
+
+    Returns:
+        dict -- the number of rows in each file and of rows changed, added, removed and
+        duplicated
+    """
+    if edit_profile not in EDIT_PROFILES:
+        raise ValueError(f"Unknown edit profile '{edit_profile}', expected one of {EDIT_PROFILES}")
+
+    rng = random.Random(seed + 1)
+    expected = {
+        "n_rows_1": n_rows,
+        "n_rows_2": 0,
+        "n_lines_changed": 0,
+        "n_lines_added": 0,
+        "n_lines_removed": 0,
+        "n_lines_duplicated": 0,
+    }
+    window = []
+    last_row = None
+    with open(filepath_1, "w", encoding="utf-8", newline="") as file_1_handle, open(
+        filepath_2, "w", encoding="utf-8", newline=""
+    ) as file_2_handle:
+        writer_1 = csv.writer(file_1_handle, lineterminator="\n")
+        writer_2 = csv.writer(file_2_handle, lineterminator="\n")
+        for writer in [writer_1, writer_2]:
+            writer.writerow(HEADER)
+            writer.writerow(HXL_ROW)
+
+        for row in iter_synthetic_rows(n_rows, seed=seed):
+            writer_1.writerow(row)
+            last_row = row
+            if edit_profile == "cell_edits" and rng.random() < rate:
+                row = row.copy()
+                price = float(row[12]) * rng.uniform(1.05, 1.5)
+                row[12] = f"{price:0.1f}"
+                row[13] = f"{price / EXCHANGE_RATE:0.4f}"
+                expected["n_lines_changed"] += 1
+            elif edit_profile == "deletions" and rng.random() < rate:
+                expected["n_lines_removed"] += 1
+                continue
+            elif edit_profile == "duplicated" and rng.random() < rate:
+                writer_2.writerow(row)
+                expected["n_lines_duplicated"] += 1
+                expected["n_rows_2"] += 1
+
+            if edit_profile == "reordered":
+                window.append(row)
+                if len(window) == REORDER_WINDOW:
+                    rng.shuffle(window)
+                    writer_2.writerows(window)
+                    window = []
+            else:
+                writer_2.writerow(row)
+            expected["n_rows_2"] += 1
+
+        rng.shuffle(window)
+        writer_2.writerows(window)
+
+        if edit_profile == "appended" and last_row is not None:
+            n_appended = max(1, math.ceil(n_rows * rate))
+            # Appended rows are dated after the last row of the original file
+            year_shift = datetime.date.fromisoformat(last_row[0]).year - 1999
+            for row in iter_synthetic_rows(n_appended, seed=seed + 2):
+                date = datetime.date.fromisoformat(row[0])
+                writer_2.writerow([date.replace(year=date.year + year_shift).isoformat(), *row[1:]])
+            expected["n_lines_added"] = n_appended
+            expected["n_rows_2"] += n_appended
+
+    return expected
@@ -2,7 +2,8 @@
 # encoding: utf-8
 
 """A decorator, @run_with_timer, which limits the time a function can run for, raising an
-exception if it exceeds that time.
+exception if it exceeds that time, and map_with_deadline which does the same for many calls on a
+DeadlinePool of worker processes, kept from one call to the next.
 
 Copied from:
 https://towardsdatascience.com/limiting-a-python-functions-execution-time-using-a-decorator-and-multiprocessing-6fcfe01da6f8
@@ -18,8 +19,18 @@ Returns:
     _type_ -- _description_
 """
 
+import atexit
+import os
+import threading
+import time
+
 import multiprocess
+import multiprocess.connection
+
+from collections import deque
+from contextlib import suppress
 from functools import wraps
+from typing import Optional
 
 
 class TimeExceededException(Exception):
@@ -73,3 +84,180 @@ def run_with_timer(func, max_execution_time):
         return result
 
     return wrapper
+
+
+def _worker_loop(connection, shared_state):
+    """Run calls sent by a DeadlinePool until the connection is closed, sending back the result
+    of each or the exception it raised"""
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        if message[0] == "state":
+            shared_state = message[1]
+            continue
+        _, function, argument = message
+        try:
+            result = function(shared_state, argument)
+        except Exception as error:
+            result = error
+        try:
+            connection.send(result)
+        except Exception as error:
+            connection.send(error)
+
+
+class _Worker:
+    def __init__(self, shared_state):
+        self.connection, child_connection = multiprocess.Pipe()
+        # Forked workers inherit shared_state rather than having it pickled
+        self.process = multiprocess.Process(
+            target=_worker_loop, args=(child_connection, shared_state), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def stop(self, terminate: bool = False):
+        if terminate:
+            self.process.terminate()
+        else:
+            with suppress(OSError):
+                self.connection.send(None)
+        self.process.join()
+        self.connection.close()
+
+
+class DeadlinePool:
+    """Worker processes which run calls with a deadline and are kept for later calls.
+
+    Workers are started as they are needed, up to processes, and each runs one call at a time, so
+    a call's deadline runs from when it is sent to a worker and calls waiting for a worker are not
+    timed out. Only the worker running a call which passes its deadline is terminated, and it is
+    replaced when there is another call to run, the other workers carry on with theirs.
+
+    shared_state is held by each worker rather than sent with every call. When it changes forked
+    workers are replaced, inheriting the new state without copying it, and otherwise the state is
+    sent once to each worker.
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        self.processes = processes or os.cpu_count() or 1
+        self.pid = os.getpid()
+        self._workers = []
+        self._shared_state = None
+        self._lock = threading.Lock()
+
+    def map(self, function, arguments: list, max_execution_time: float, shared_state=None) -> list:
+        """Call function(shared_state, argument) for each argument, each call finishing within
+        max_execution_time of starting
+
+        Returns:
+            list -- the results in the order of arguments, TimeExceededException for calls which
+            ran over their deadline and the exception raised by any which failed
+        """
+        with self._lock:
+            self._set_shared_state(shared_state)
+            results = [None] * len(arguments)
+            waiting = deque(range(len(arguments)))
+            idle = list(self._workers)
+            running = {}
+            while waiting or running:
+                while waiting and (idle or len(self._workers) < self.processes):
+                    worker = idle.pop() if idle else self._start_worker()
+                    i = waiting.popleft()
+                    try:
+                        worker.connection.send(("call", function, arguments[i]))
+                    except OSError:
+                        # The worker has exited, the call is run on its replacement
+                        self._remove_worker(worker)
+                        waiting.appendleft(i)
+                        continue
+                    running[worker.connection] = (worker, i, time.monotonic())
+
+                deadline = min(x[2] for x in running.values()) + max_execution_time
+                ready = multiprocess.connection.wait(
+                    list(running), timeout=max(0.0, deadline - time.monotonic())
+                )
+                for connection in ready:
+                    worker, i, _ = running.pop(connection)
+                    try:
+                        results[i] = connection.recv()
+                        idle.append(worker)
+                    except EOFError:
+                        results[i] = RuntimeError("Worker process exited during the call")
+                        self._remove_worker(worker)
+
+                now = time.monotonic()
+                for connection, (worker, i, start) in list(running.items()):
+                    if now - start > max_execution_time:
+                        results[i] = TimeExceededException("Exceeded Execution Time")
+                        del running[connection]
+                        self._remove_worker(worker, terminate=True)
+            return results
+
+    def close(self):
+        """Stop the workers, which are started again if the pool is used"""
+        with self._lock:
+            for worker in list(self._workers):
+                self._remove_worker(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self._shared_state)
+        self._workers.append(worker)
+        return worker
+
+    def _remove_worker(self, worker: _Worker, terminate: bool = False):
+        self._workers.remove(worker)
+        worker.stop(terminate=terminate)
+
+    def _set_shared_state(self, shared_state):
+        if shared_state is self._shared_state:
+            return
+        self._shared_state = shared_state
+        for worker in list(self._workers):
+            if multiprocess.get_start_method() == "fork":
+                self._remove_worker(worker)
+            else:
+                worker.connection.send(("state", shared_state))
+
+
+_shared_pools = {}
+
+
+def shared_pool(processes: Optional[int] = None) -> DeadlinePool:
+    """A DeadlinePool with this number of processes, the same one each time in a process"""
+    pool = _shared_pools.get(processes)
+    if pool is None or pool.pid != os.getpid():
+        pool = DeadlinePool(processes)
+        _shared_pools[processes] = pool
+        atexit.register(pool.close)
+    return pool
+
+
+def map_with_deadline(
+    function,
+    arguments: list,
+    max_execution_time: float,
+    shared_state=None,
+    processes: Optional[int] = None,
+    pool: Optional[DeadlinePool] = None,
+) -> list:
+    """Call function(shared_state, argument) for each argument on a pool of worker processes with
+    DeadlinePool.map, by default on the shared_pool for the number of processes, which is kept
+    for later calls
+
+    Returns:
+        list -- the results in the order of arguments, TimeExceededException for calls which ran
+        over their deadline and the exception raised by any which failed
+    """
+    pool = pool or shared_pool(processes)
+    return pool.map(function, arguments, max_execution_time, shared_state=shared_state)
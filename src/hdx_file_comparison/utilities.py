@@ -4,35 +4,103 @@
 import csv
 import difflib
 import json
-import re
+import os
 import time
 
-from typing import Optional
+from functools import partial
+from typing import Iterable, Iterator, Optional
 
 from urllib import request
-from collections import Counter
 
 
-from hdx_file_comparison.time_limiter import run_with_timer, TimeExceededException
+from hdx_file_comparison.fingerprints import LineFingerprints, first_lines, merge_unique
+from hdx_file_comparison.instrumentation import stage
+from hdx_file_comparison.line_diff import LINE_DIFF_ENGINES, SEQUENCE_MATCHERS, sequence_changes
+from hdx_file_comparison.time_limiter import (
+    map_with_deadline,
+    TimeExceededException,
+)
 
 MAX_EXECUTION_TIME = 20
 
 
 def difflib_compare(
-    filepath_1: str, filepath_2: str, encoding: str = "utf-8", line_limit: Optional[int] = None
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    line_limit: Optional[int] = None,
+    line_diff: str = "ndiff",
 ) -> list[tuple]:
     print(f"Using line_limit of {line_limit} in difflib_compare", flush=True)
+    if line_diff not in LINE_DIFF_ENGINES:
+        raise ValueError(
+            f"Unknown line diff engine '{line_diff}', expected one of {list(LINE_DIFF_ENGINES)}"
+        )
+
+    with stage("parse") as span:
+        file_1 = open(filepath_1, encoding=encoding).read().splitlines()[0:line_limit]
+        file_2 = open(filepath_2, encoding=encoding).read().splitlines()[0:line_limit]
+        span.add(rows=len(file_1) + len(file_2), bytes_read=_file_sizes(filepath_1, filepath_2))
+    with stage("line_diff", line_diff=line_diff) as span:
+        diff = LINE_DIFF_ENGINES[line_diff](
+            file_1,
+            file_2,
+        )
+        span.add(rows=len(file_1) + len(file_2))
+        return list(_changed_lines(diff))
+
+
+def iter_difflib_compare(
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    line_diff: str = "ndiff",
+) -> Iterator[tuple]:
+    """The (position, line) pairs of difflib_compare yielded as the line diff engine produces
+    them rather than collected in a list, so that changes can be consumed while the diff runs.
+    The files themselves are still read into memory.
+    """
+    if line_diff not in LINE_DIFF_ENGINES:
+        raise ValueError(
+            f"Unknown line diff engine '{line_diff}', expected one of {list(LINE_DIFF_ENGINES)}"
+        )
+    with open(filepath_1, encoding=encoding) as file_handle:
+        file_1 = file_handle.read().splitlines()
+    with open(filepath_2, encoding=encoding) as file_handle:
+        file_2 = file_handle.read().splitlines()
+    return _changed_lines(LINE_DIFF_ENGINES[line_diff](file_1, file_2))
+
+
+def _changed_lines(diff: Iterable[str]) -> Iterator[tuple]:
+    return ((i, x) for i, x in enumerate(diff) if x[0] in ["-", "+", "?"])
+
+
+def _file_sizes(*filepaths: str) -> int:
+    return sum(os.path.getsize(x) for x in filepaths)
 
-    file_1 = open(filepath_1, encoding=encoding).read().splitlines()[0:line_limit]
-    file_2 = open(filepath_2, encoding=encoding).read().splitlines()[0:line_limit]
-    diff = difflib.ndiff(
-        file_1,
-        file_2,
-    )
-    return [(i, x) for i, x in enumerate(diff) if x[0] in ["-", "+", "?"]]
 
+def difflib_column_changes(
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    processes: Optional[int] = None,
+    column_diff: str = "ndiff",
+):
+    """Diff each column of two files, in parallel on a pool of worker processes which is kept for
+    later calls. Columns which take longer than MAX_EXECUTION_TIME are None.
 
-def difflib_column_changes(filepath_1: str, filepath_2: str, encoding: str = "utf-8"):
+    Keyword Arguments:
+        processes {Optional[int]} -- number of worker processes, by default one per column up
+        to the number of CPUs (default: {None})
+        column_diff {str} -- "ndiff" diffs the first 650 values of each column with
+        difflib.ndiff, "myers" or "patience" diff whole columns of dictionary encoded values,
+        returning only "- " and "+ " changes (default: {"ndiff"})
+    """
+    if column_diff != "ndiff" and column_diff not in SEQUENCE_MATCHERS:
+        raise ValueError(
+            f"Unknown column diff '{column_diff}', "
+            f"expected one of {['ndiff', *SEQUENCE_MATCHERS]}"
+        )
     column_diffs = {}
     with open(filepath_1, encoding=encoding) as filepath_1_handle:
         file_1_rows = list(csv.DictReader(filepath_1_handle))
@@ -44,26 +112,40 @@ def difflib_column_changes(filepath_1: str, filepath_2: str, encoding: str = "ut
 
     print(columns, flush=True)
 
-    for column in columns:
-        try:
-            column_changes = process_column(file_1_rows, file_2_rows, column)
-            column_diffs[column] = column_changes
-        except TimeExceededException:
+    # Only the column values are shared with the workers, not the rows
+    column_values = {
+        column: ([x[column] for x in file_1_rows], [x.get(column) for x in file_2_rows])
+        for column in columns
+    }
+    results = map_with_deadline(
+        partial(_diff_column, column_diff=column_diff),
+        columns,
+        MAX_EXECUTION_TIME,
+        shared_state=column_values,
+        processes=processes,
+    )
+
+    for column, column_changes in zip(columns, results):
+        if isinstance(column_changes, TimeExceededException):
             print(
                 f"Processing column '{column}' exceeded the maximum processing time of "
                 f"{MAX_EXECUTION_TIME} seconds",
                 flush=True,
             )
             column_diffs[column] = None
+        elif isinstance(column_changes, Exception):
+            raise column_changes
+        else:
+            column_diffs[column] = column_changes
 
     return column_diffs
 
 
-@run_with_timer(max_execution_time=MAX_EXECUTION_TIME)
-def process_column(file_1_rows, file_2_rows, column):
+def _diff_column(column_values: dict, column: str, column_diff: str = "ndiff") -> list[tuple]:
     n_items = 650
-    file_1_column = [x[column] for x in file_1_rows]
-    file_2_column = [x[column] for x in file_2_rows]
+    file_1_column, file_2_column = column_values[column]
+    if column_diff != "ndiff":
+        return sequence_changes(file_1_column, file_2_column, algorithm=column_diff)
     column_diff = difflib.ndiff(
         file_1_column[0:n_items],
         file_2_column[0:n_items],
@@ -73,47 +155,70 @@ def process_column(file_1_rows, file_2_rows, column):
 
 
 def detect_cell_change_from_diff(header: list[str], diff: list[tuple]):
-    cell_changes = []
-    for i in range(0, len(diff) - 1):
-        if diff[i][1].startswith("- ") and diff[i + 1][1].startswith("? "):
-            print(diff[i], flush=True)
-            print(diff[i + 1], flush=True)
-            print(diff[i + 2], flush=True)
-            print(diff[i + 3], flush=True)
-
-            # Make a probe row which has the diff ^ characters added
-            idxs = [m.start() for m in re.finditer("\^", diff[i + 1][1])]
-            print(idxs, flush=True)
-            probe_row = list(diff[i][1])
-            # If the row contains ^ characters then this won't work, so we replace them
-            # We're going to throw this probe_row away
-            probe_row = list(map(lambda x: x.replace("^", "*"), probe_row))
-
-            for idx in idxs:
-                probe_row[idx] = "^"
-            probe_row = "".join(probe_row)
-            row = list(csv.reader([probe_row[2:]]))
-
-            # Check each column in the probe row for the ^ character
-            for j, column in enumerate(row[0]):
-                if "^" in column:
-                    original_row = list(csv.reader([diff[i][1][2:]]))[0]
-                    new_row = list(csv.reader([diff[i + 2][1][2:]]))[0]
-                    status = (
-                        f"Column '{header[j]}' has been changed from "
-                        f"'{original_row[j]}' to '{new_row[j]}' on row '{diff[i][0]}'"
-                    )
-                    print(status, flush=True)
-                    cell_changes.append(
-                        {
-                            "row": diff[i][0],
-                            "column": header[j],
-                            "original_value": original_row[j],
-                            "new_value": new_row[j],
-                        }
-                    )
-
-    return cell_changes
+    return list(iter_cell_changes(header, header, diff))
+
+
+def iter_cell_changes(
+    header_1: list[str], header_2: list[str], diff: Iterable[tuple]
+) -> Iterator[dict]:
+    """Yield the cell changes between removed and added rows of a line diff, in diff order.
+
+    A removed row is paired with an added row if ndiff marked them as a changed line, with "? "
+    hint lines, or failing that if they are in the same block of changed lines which has as many
+    unpaired removed rows as added rows. Each row of a pair is parsed once and the fields are
+    compared by column name, so quoted fields, edits to several cells and rows with a different
+    number of columns are all handled.
+
+    Arguments:
+        header_1 {list[str]} -- header of the original file
+        header_2 {list[str]} -- header of the new file
+        diff {Iterable[tuple]} -- (position, line) pairs from difflib_compare, or streamed
+        from iter_difflib_compare
+
+    Yields:
+        dict -- cell changes, the "row" being the position of the removed line in the diff
+    """
+    column_pairs = _column_pairs(header_1, header_2)
+    for block in _diff_blocks(diff):
+        for removed, added in _pair_changed_lines(block):
+            original_row = next(csv.reader([removed[1][2:]]), [])
+            new_row = next(csv.reader([added[1][2:]]), [])
+            if original_row == header_1 and new_row == header_2:
+                continue
+            yield from _compare_fields(removed[0], original_row, new_row, column_pairs)
+
+
+def _diff_blocks(diff: Iterable[tuple]) -> Iterator[list[tuple]]:
+    """Split a diff into blocks of lines with consecutive positions"""
+    block = []
+    for position, line in diff:
+        if block and position != block[-1][0] + 1:
+            yield block
+            block = []
+        block.append((position, line))
+    if block:
+        yield block
+
+
+def _pair_changed_lines(block: list[tuple]) -> list[tuple[tuple, tuple]]:
+    pairs = []
+    paired = set()
+    for k, (_, line) in enumerate(block):
+        if not line.startswith("- "):
+            continue
+        following = [block[x][1][:2] for x in range(k + 1, min(k + 3, len(block)))]
+        if following == ["? ", "+ "]:
+            pairs.append((block[k], block[k + 2]))
+            paired.update([k, k + 2])
+        elif following == ["+ ", "? "]:
+            pairs.append((block[k], block[k + 1]))
+            paired.update([k, k + 1])
+
+    removed = [x for k, x in enumerate(block) if k not in paired and x[1].startswith("- ")]
+    added = [x for k, x in enumerate(block) if k not in paired and x[1].startswith("+ ")]
+    if len(removed) == len(added):
+        pairs.extend(zip(removed, added))
+    return sorted(pairs)
 
 
 def compute_diff_metrics(diff: list[tuple]):
@@ -129,22 +234,240 @@ def compute_diff_metrics(diff: list[tuple]):
     return diff_metrics
 
 
-def process(filepath_1: str, filepath_2: str, encoding: str = "utf-8"):
+def count_diff_lines(diff: Iterable[tuple], diff_metrics: dict) -> Iterator[tuple]:
+    """Pass a diff through unchanged, filling diff_metrics with the counts of compute_diff_metrics
+    once the diff is exhausted, so that a streamed diff is counted without being held in memory
+    """
+    counts = {"?": 0, "+": 0, "-": 0}
+    for position, line in diff:
+        if line[:2] in ["? ", "+ ", "- "]:
+            counts[line[0]] += 1
+        yield position, line
+    diff_metrics["n_lines_changed"] = counts["?"] // 2
+    diff_metrics["n_lines_added"] = counts["+"] - diff_metrics["n_lines_changed"]
+    diff_metrics["n_lines_removed"] = counts["-"] - diff_metrics["n_lines_changed"]
+
+
+def iter_difflib_cell_changes(
+    filepath_1: str,
+    filepath_2: str,
+    diff_metrics: dict,
+    encoding: str = "utf-8",
+    line_diff: str = "ndiff",
+) -> Iterator[dict]:
+    """The cell changes of process() with the difflib engine, yielded as each block of changed
+    lines comes out of the line diff, with the line counts put in diff_metrics once the iterator
+    is exhausted. Only one block of the diff is held in memory at a time.
+    """
+    headers = []
+    for filepath in [filepath_1, filepath_2]:
+        with open(filepath, encoding=encoding) as file_handle:
+            headers.append(next(csv.reader(file_handle), []))
+    diff = iter_difflib_compare(filepath_1, filepath_2, encoding=encoding, line_diff=line_diff)
+    yield from iter_cell_changes(headers[0], headers[1], count_diff_lines(diff, diff_metrics))
+
+
+def process(
+    filepath_1: str,
+    filepath_2: str,
+    encoding: str = "utf-8",
+    engine: str = "difflib",
+    key_columns: Optional[list[str]] = None,
+    line_diff: str = "ndiff",
+):
+    if engine == "keyed":
+        return keyed_compare(filepath_1, filepath_2, key_columns, encoding=encoding)
     # Get headers
     headers = []
-    with open(filepath_2, encoding=encoding) as file_handle:
-        csv_reader = csv.reader(file_handle)
-        headers = next(csv_reader)
+    for filepath in [filepath_1, filepath_2]:
+        with open(filepath, encoding=encoding) as file_handle:
+            csv_reader = csv.reader(file_handle)
+            headers.append(next(csv_reader))
     # Get diff
-    diff = difflib_compare(filepath_1, filepath_2, encoding="utf-8")
+    diff = difflib_compare(filepath_1, filepath_2, encoding="utf-8", line_diff=line_diff)
 
     # Process diff
     diff_metrics = compute_diff_metrics(diff)
-    diff_metrics["cell_changes"] = detect_cell_change_from_diff(headers, diff)
+    with stage("cell_detection") as span:
+        diff_metrics["cell_changes"] = list(iter_cell_changes(headers[0], headers[1], diff))
+        span.add(rows=len(diff))
 
     return diff_metrics
 
 
+def keyed_compare(
+    filepath_1: str, filepath_2: str, key_columns: list[str], encoding: str = "utf-8"
+) -> dict:
+    """Compare two CSV files by matching rows on a set of key columns, rather than by line
+    position. Rows are joined with a dictionary so the comparison runs in linear time. Repeated
+    keys are paired in the order they appear in each file.
+
+    Arguments:
+        filepath_1 {str} -- path to the original file
+        filepath_2 {str} -- path to the new file
+        key_columns {list[str]} -- column names which together identify a row
+
+    Keyword Arguments:
+        encoding {str} -- file encoding (default: {"utf-8"})
+
+    Returns:
+        dict -- diff metrics in the same form as process(), the "row" of a cell change is the
+        line number of the row in filepath_1 with the header as line 0
+    """
+    diff_metrics = {}
+    cell_changes = list(
+        iter_keyed_compare(filepath_1, filepath_2, key_columns, diff_metrics, encoding=encoding)
+    )
+    diff_metrics["cell_changes"] = sorted(cell_changes, key=lambda x: x["row"])
+    return diff_metrics
+
+
+def iter_keyed_compare(
+    filepath_1: str,
+    filepath_2: str,
+    key_columns: list[str],
+    diff_metrics: dict,
+    encoding: str = "utf-8",
+) -> Iterator[dict]:
+    """keyed_compare yielding cell changes as they are found, in the order of the rows of
+    filepath_2, rather than returning them sorted. The line counts are put in diff_metrics once
+    the iterator is exhausted.
+    """
+    if not key_columns:
+        raise ValueError("keyed_compare requires at least one key column")
+
+    with open(filepath_1, encoding=encoding, newline="") as file_1_handle, open(
+        filepath_2, encoding=encoding, newline=""
+    ) as file_2_handle:
+        file_1_reader = csv.reader(file_1_handle)
+        file_2_reader = csv.reader(file_2_handle)
+        header_1 = next(file_1_reader)
+        header_2 = next(file_2_reader)
+        yield from iter_keyed_diff(
+            header_1,
+            enumerate(file_1_reader, start=1),
+            header_2,
+            enumerate(file_2_reader, start=1),
+            key_columns,
+            diff_metrics,
+            sources=(filepath_1, filepath_2),
+        )
+
+
+def keyed_diff(
+    header_1: list[str],
+    file_1_rows: Iterable[tuple[int, list[str]]],
+    header_2: list[str],
+    file_2_rows: Iterable[tuple[int, list[str]]],
+    key_columns: list[str],
+    sources: tuple[str, str] = ("file_1", "file_2"),
+) -> dict:
+    """The row matching behind keyed_compare, working on (line_number, row) pairs so that it can
+    be used on a subset of the rows of a file. The first set of rows is held in memory, the second
+    is streamed.
+
+    Returns:
+        dict -- diff metrics in the same form as process()
+    """
+    diff_metrics = {}
+    cell_changes = list(
+        iter_keyed_diff(
+            header_1, file_1_rows, header_2, file_2_rows, key_columns, diff_metrics, sources
+        )
+    )
+    diff_metrics["cell_changes"] = sorted(cell_changes, key=lambda x: x["row"])
+    return diff_metrics
+
+
+def iter_keyed_diff(
+    header_1: list[str],
+    file_1_rows: Iterable[tuple[int, list[str]]],
+    header_2: list[str],
+    file_2_rows: Iterable[tuple[int, list[str]]],
+    key_columns: list[str],
+    diff_metrics: dict,
+    sources: tuple[str, str] = ("file_1", "file_2"),
+) -> Iterator[dict]:
+    """The generator behind keyed_diff, yielding the cell changes of each row of file_2_rows as
+    it is streamed and filling diff_metrics with the line counts once it is exhausted"""
+    key_idxs_1 = _key_indices(header_1, key_columns, sources[0])
+    key_idxs_2 = _key_indices(header_2, key_columns, sources[1])
+    column_pairs = _column_pairs(header_1, header_2)
+
+    file_1_keys = {}
+    for line_number, row in file_1_rows:
+        key = tuple(row[i] if i < len(row) else "" for i in key_idxs_1)
+        file_1_keys.setdefault(key, []).append((line_number, row))
+
+    n_lines_changed = 0
+    n_lines_added = 0
+    for _, row in file_2_rows:
+        key = tuple(row[i] if i < len(row) else "" for i in key_idxs_2)
+        matches = file_1_keys.get(key)
+        if not matches:
+            n_lines_added += 1
+            continue
+        line_number, original_row = matches.pop(0)
+        if not matches:
+            del file_1_keys[key]
+        if header_1 == header_2 and original_row == row:
+            continue
+        row_changes = _compare_fields(line_number, original_row, row, column_pairs)
+        if row_changes:
+            n_lines_changed += 1
+            yield from row_changes
+
+    diff_metrics["n_lines_changed"] = n_lines_changed
+    diff_metrics["n_lines_added"] = n_lines_added
+    diff_metrics["n_lines_removed"] = sum(len(x) for x in file_1_keys.values())
+
+
+class KeyColumnError(ValueError):
+    """Key columns which are not in the header of a file"""
+
+    def __init__(self, missing: list[str], filepath: str):
+        super().__init__(f"Key column(s) {missing} not found in header of {filepath}")
+        self.missing = missing
+        self.filepath = filepath
+
+
+def _key_indices(header: list[str], key_columns: list[str], filepath: str) -> list[int]:
+    missing = [x for x in key_columns if x not in header]
+    if missing:
+        raise KeyColumnError(missing, filepath)
+    return [header.index(x) for x in key_columns]
+
+
+def _column_pairs(header_1: list[str], header_2: list[str]) -> list[tuple]:
+    """Match columns by name, columns present in only one file are paired with None"""
+    column_pairs = []
+    for i, column in enumerate(header_1):
+        column_pairs.append((column, i, header_2.index(column) if column in header_2 else None))
+    for j, column in enumerate(header_2):
+        if column not in header_1:
+            column_pairs.append((column, None, j))
+    return column_pairs
+
+
+def _compare_fields(
+    line_number: int, original_row: list[str], new_row: list[str], column_pairs: list[tuple]
+) -> list[dict]:
+    changes = []
+    for column, i, j in column_pairs:
+        original_value = original_row[i] if i is not None and i < len(original_row) else ""
+        new_value = new_row[j] if j is not None and j < len(new_row) else ""
+        if original_value != new_value:
+            changes.append(
+                {
+                    "row": line_number,
+                    "column": column,
+                    "original_value": original_value,
+                    "new_value": new_value,
+                }
+            )
+    return changes
+
+
 def fetch_data_from_hapi(query_url, limit=1000):
     """
     Fetch data from the provided query_url with pagination support.
@@ -205,60 +528,47 @@ def fetch_data_from_hapi(query_url, limit=1000):
 def hash_based_file_comparison(
     filepath_1: str, filepath_2: str, encoding: str = "utf-8", line_limit: Optional[int] = None
 ) -> dict:
+    """Compare two files as multisets of lines using 64 bit line fingerprints held in packed
+    arrays, reading lines back from the files only to print repeated and differing lines
+
+    Returns:
+        dict -- line counts, order independent file hashes, unique line counts and the number of
+        unique lines common to both files and only in the first
+    """
     hash_metrics = {}
 
-    file_1 = open(filepath_1, encoding=encoding).read().splitlines()[0:line_limit]
-    file_2 = open(filepath_2, encoding=encoding).read().splitlines()[0:line_limit]
+    with stage("hash") as span:
+        file_1 = LineFingerprints(filepath_1, encoding=encoding, line_limit=line_limit)
+        file_2 = LineFingerprints(filepath_2, encoding=encoding, line_limit=line_limit)
+        span.add(rows=len(file_1) + len(file_2), bytes_read=file_1.bytes_read + file_2.bytes_read)
 
     hash_metrics["file_1_length"] = len(file_1)
     hash_metrics["file_2_length"] = len(file_2)
-
-    # if len(file_1) == len(file_2):
-    #     print(f"File lengths match at {len(file_1)} lines", flush=True)
-    # else:
-    #     print(f"File length mismatch file_1 = {len(file_1)}, file_2 = {len(file_2)}", flush=True)
-
-    hash_metrics["file_1_hash"] = hash(frozenset(file_1))
-    hash_metrics["file_2_hash"] = hash(frozenset(file_2))
-
-    hash_metrics["file_1_unique"] = len(frozenset(file_1))
-    hash_metrics["file_2_unique"] = len(frozenset(file_2))
+    hash_metrics["file_1_hash"] = file_1.digest
+    hash_metrics["file_2_hash"] = file_2.digest
+    hash_metrics["file_1_unique"] = file_1.n_unique()
+    hash_metrics["file_2_unique"] = file_2.n_unique()
 
     if hash_metrics["file_1_unique"] != hash_metrics["file_2_unique"]:
-        file_1_counter = Counter(file_1)
-        file_2_counter = Counter(file_2)
-
-        print("\nfile 1 counter")
-        for k, v in file_1_counter.items():
-            if v != 1:
-                print(k, v, flush=True)
-
-        print("\nfile 2 counter")
-        for k, v in file_2_counter.items():
-            if v != 1:
-                print(k, v, flush=True)
+        for label, fingerprints in [("file 1", file_1), ("file 2", file_2)]:
+            print(f"\n{label} counter")
+            repeats = fingerprints.repeated()
+            for fingerprint, line in fingerprints.lines(repeats):
+                print(line, repeats[fingerprint], flush=True)
 
     if hash_metrics["file_1_hash"] != hash_metrics["file_2_hash"]:
-        file_1_set = frozenset(file_1)
-        file_2_set = frozenset(file_2)
-
-        differing_elements = list(file_1_set.difference(file_2_set))
-        hash_metrics["n_common"] = len(list(file_1_set.intersection(file_2_set)))
-        hash_metrics["n_differing"] = len(differing_elements)
-        # print(
-        #     f"{n_common} lines common to both sets, {len(differing_elements)} lines difference",
-        #     flush=True,
-        # )
-
-        in_1_but_not_2 = file_1_set - file_2_set
-        in_2_but_not_1 = file_2_set - file_1_set
+        n_common, in_1_but_not_2, in_2_but_not_1 = merge_unique(
+            file_1.unique_fingerprints(), file_2.unique_fingerprints()
+        )
+        hash_metrics["n_common"] = n_common
+        hash_metrics["n_differing"] = len(in_1_but_not_2)
 
         print("in 1 but not in 2")
-        for element in sorted(list(in_1_but_not_2))[0:10]:
+        for element in first_lines(file_1, in_1_but_not_2):
             print(element, flush=True)
 
         print("in 2 but not in 1")
-        for element in sorted(list(in_2_but_not_1))[0:10]:
+        for element in first_lines(file_2, in_2_but_not_1):
             print(element, flush=True)
 
     else:
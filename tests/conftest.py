@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import hashlib
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+SMALL_FILE = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+class FixtureCSVHandler(BaseHTTPRequestHandler):
+    """Serves a fixture CSV with HAPI offset/limit semantics, the header is on every page"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.n_connections += 1
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        lines = self.server.files.get(urlsplit(self.path).path, self.server.lines)
+        if "offset" not in query:
+            # A plain file download, as for HDX resources, which can be resumed from a byte offset
+            range_header = self.headers.get("Range")
+            if range_header is not None and range_header.startswith("bytes="):
+                start = int(range_header[len("bytes=") :].rstrip("-"))
+                with self.server.lock:
+                    self.server.ranges.append(start)
+                encoded = ("\n".join(lines) + "\n").encode("utf-8")[start:]
+                self.send_response(206)
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+                return
+            self._send_body("\n".join(lines) + "\n")
+            return
+        offset = int(query["offset"][0])
+        limit = int(query["limit"][0])
+        with self.server.lock:
+            self.server.requests.append((offset, limit))
+            fail = offset in self.server.fail_offsets
+            self.server.fail_offsets.discard(offset)
+        if fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self._send_body("\n".join([lines[0], *lines[1:][offset : offset + limit]]) + "\n")
+
+    def _send_body(self, body: str):
+        encoded = body.encode("utf-8")
+        etag = f'"{hashlib.sha256(encoded).hexdigest()[0:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            with self.server.lock:
+                self.server.n_not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fixture_server():
+    """A local stand in for HDX HAPI and HDX resource downloads"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureCSVHandler)
+    server.lock = threading.Lock()
+    server.n_connections = 0
+    server.requests = []
+    server.fail_offsets = set()
+    server.n_not_modified = 0
+    server.ranges = []
+    # Paths can be mapped to other fixture files, anything else is served SMALL_FILE
+    server.files = {}
+    with open(SMALL_FILE, encoding="utf-8") as file_handle:
+        server.lines = file_handle.read().splitlines()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
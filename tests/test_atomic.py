@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from hdx_file_comparison.atomic import atomic_output, write_atomic
+
+
+def test_write_atomic(tmp_path):
+    path = os.path.join(tmp_path, "state.json")
+    write_atomic(path, b"first")
+    with atomic_output(path, "w", encoding="utf-8") as output_handle:
+        output_handle.write("second")
+        # The target is untouched until the write completes
+        with open(path, "rb") as file_handle:
+            assert file_handle.read() == b"first"
+
+    with open(path, "rb") as file_handle:
+        assert file_handle.read() == b"second"
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_atomic_output_failure(tmp_path):
+    path = os.path.join(tmp_path, "state.json")
+    write_atomic(path, b"first")
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(path) as output_handle:
+            output_handle.write(b"partial")
+            raise RuntimeError("interrupted")
+
+    with open(path, "rb") as file_handle:
+        assert file_handle.read() == b"first"
+    assert os.listdir(tmp_path) == ["state.json"]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+import os
+import shutil
+
+from functools import partial
+
+from hdx_file_comparison.batch import (
+    expand_jobs,
+    order_largest_first,
+    read_jobs_file,
+    read_report,
+    run_batch,
+    write_report,
+)
+from hdx_file_comparison.cli import compare_job, triage_job
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+FILES = {
+    "same": ("2024-07-21-wfp_food_prices_afg.csv", "2024-07-21-wfp_food_prices_afg.csv"),
+    "changed": ("2024-07-14-wfp_food_prices_afg.csv", "2024-07-21-wfp_food_prices_afg.csv"),
+}
+KEY_COLUMNS = "date,admin1,admin2,market,commodity,pricetype"
+
+
+def fake_download(download_directory, job: dict) -> tuple[str, str]:
+    """Copy the fixture files for job, so digest sidecars are written to download_directory"""
+    if job["theme"] == "missing":
+        raise OSError("HTTP status 404")
+    filepaths = []
+    for hapi_site, filename in zip(["hapi", "hapi-temporary"], FILES[job["theme"]]):
+        filepath = os.path.join(download_directory, f"{job['theme']}-{hapi_site}.csv")
+        shutil.copy(os.path.join(FIXTURES_DIRECTORY, filename), filepath)
+        filepaths.append(filepath)
+    return tuple(filepaths)
+
+
+def test_expand_jobs():
+    assert expand_jobs(["a", "b"], ["AFG", "NGA"]) == [
+        {"theme": "a", "country": "AFG"},
+        {"theme": "a", "country": "NGA"},
+        {"theme": "b", "country": "AFG"},
+        {"theme": "b", "country": "NGA"},
+    ]
+    assert expand_jobs(["a"]) == [{"theme": "a", "country": None}]
+
+
+def test_read_jobs_file(tmp_path):
+    jobs_file = tmp_path / "jobs.json"
+    jobs_file.write_text(json.dumps({"themes": ["a"], "countries": ["AFG"]}))
+    assert read_jobs_file(str(jobs_file)) == [{"theme": "a", "country": "AFG"}]
+
+    jobs_file.write_text(json.dumps([{"theme": "a"}, {"theme": "b", "country": "NGA"}]))
+    assert read_jobs_file(str(jobs_file)) == [
+        {"theme": "a", "country": None},
+        {"theme": "b", "country": "NGA"},
+    ]
+
+
+def test_order_largest_first():
+    jobs = expand_jobs(["small", "big", "new"])
+    previous_report = {"jobs": [{"job_id": "small|", "size": 10}, {"job_id": "big|", "size": 1000}]}
+
+    assert [x["theme"] for x in order_largest_first(jobs)] == ["small", "big", "new"]
+    assert [x["theme"] for x in order_largest_first(jobs, previous_report)] == [
+        "new",
+        "big",
+        "small",
+    ]
+
+
+def test_run_batch(tmp_path):
+    jobs = expand_jobs(["same", "changed", "missing"])
+    download = partial(fake_download, str(tmp_path))
+    compare = partial(compare_job, engine="keyed", key_columns=KEY_COLUMNS)
+
+    report = run_batch(jobs, download, compare, download_workers=2, cpu_workers=2)
+    entries = {x["job_id"]: x for x in report["jobs"]}
+
+    assert entries["same|"]["status"] == "complete"
+    assert entries["same|"]["result"]["hashes_match"]
+    assert entries["same|"]["result"]["n_changes"] == 0
+    assert entries["changed|"]["status"] == "complete"
+    assert not entries["changed|"]["result"]["hashes_match"]
+    assert entries["changed|"]["result"]["diff_metrics"] == {
+        "n_lines_changed": 473,
+        "n_lines_added": 1,
+        "n_lines_removed": 0,
+    }
+    assert entries["changed|"]["result"]["n_cell_changes"] == 603
+    assert entries["missing|"]["status"] == "download_failed"
+
+    # The report orders the next batch, with the failed job first as its size is not known
+    entries["same|"]["size"] = 1
+    report_path = str(tmp_path / "batch-report.json")
+    write_report(report_path, report)
+    ordered = order_largest_first(jobs, read_report(report_path))
+    assert [x["theme"] for x in ordered] == ["missing", "changed", "same"]
+
+
+def test_run_batch_triage(tmp_path):
+    jobs = expand_jobs(["same", "changed"])
+    download = partial(fake_download, str(tmp_path))
+
+    report = run_batch(jobs, download, triage_job, download_workers=2, cpu_workers=2)
+    entries = {x["job_id"]: x["result"] for x in report["jobs"]}
+
+    assert entries["same|"]["hashes_match"]
+    assert entries["same|"]["n_changes"] == 0
+    assert not entries["changed|"]["hashes_match"]
+    assert 0.9 < entries["changed|"]["jaccard"] < 1.0
+    assert os.path.exists(os.path.join(tmp_path, "changed-hapi.csv.sketch.json"))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+
+from hdx_file_comparison.benchmark import compare_to_baseline, run_benchmarks
+
+
+def test_run_benchmarks(tmp_path):
+    benchmark = run_benchmarks(
+        str(tmp_path),
+        [2000],
+        edit_profiles=["identical", "cell_edits"],
+        engines=["hash_based_file_comparison", "keyed_compare"],
+        timeout=60,
+    )
+
+    assert [x["case_id"] for x in benchmark["results"]] == [
+        "hash_based_file_comparison/identical/2000",
+        "keyed_compare/identical/2000",
+        "hash_based_file_comparison/cell_edits/2000",
+        "keyed_compare/cell_edits/2000",
+    ]
+    assert all(x["status"] == "ok" for x in benchmark["results"])
+    assert all(x["wall_seconds"] > 0 for x in benchmark["results"])
+    assert benchmark["results"][3]["expected"]["n_lines_changed"] > 0
+
+    assert compare_to_baseline(benchmark, benchmark) == []
+
+
+def test_compare_to_baseline():
+    baseline = {
+        "results": [
+            {"case_id": "a", "status": "ok", "wall_seconds": 1.0, "peak_rss_bytes": 1000},
+            {"case_id": "b", "status": "ok", "wall_seconds": 0.01, "peak_rss_bytes": 10**8},
+            {"case_id": "c", "status": "ok", "wall_seconds": 1.0, "peak_rss_bytes": None},
+        ]
+    }
+    benchmark = copy.deepcopy(baseline)
+    benchmark["results"][0]["wall_seconds"] = 1.2
+    # A few kilobytes more is noise
+    benchmark["results"][0]["peak_rss_bytes"] = 5000
+    # Too fast in the baseline to compare times, but memory use has doubled
+    benchmark["results"][1]["wall_seconds"] = 0.1
+    benchmark["results"][1]["peak_rss_bytes"] = 2 * 10**8
+    benchmark["results"][2] = {"case_id": "c", "status": "timeout", "wall_seconds": 300}
+
+    regressions = compare_to_baseline(benchmark, baseline, tolerance=0.25)
+
+    assert [(x["case_id"], x["measure"]) for x in regressions] == [
+        ("b", "peak_rss_bytes"),
+        ("c", "status"),
+    ]
+    assert [x["case_id"] for x in compare_to_baseline(benchmark, baseline, tolerance=0.1)] == [
+        "a",
+        "b",
+        "c",
+    ]
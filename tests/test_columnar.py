@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+
+import pytest
+
+from hdx_file_comparison.columnar import columnar_compare, load_columns, parse_floats
+from hdx_file_comparison.utilities import keyed_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+
+
+def test_columnar_compare_matches_keyed_compare():
+    filepath_1 = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+    filepath_2 = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+    t0 = time.time()
+    diff_metrics = columnar_compare(filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS)
+    print(f"Columnar comparison took {time.time() - t0:0.2f} seconds", flush=True)
+
+    assert diff_metrics == keyed_compare(filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS)
+    assert diff_metrics["n_lines_changed"] == 473
+    assert diff_metrics["n_lines_added"] == 1
+    assert len(diff_metrics["cell_changes"]) == 603
+
+
+def test_columnar_compare_faster_than_keyed_compare():
+    filepath_1 = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+    filepath_2 = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+    timings = {}
+    for compare in [columnar_compare, keyed_compare]:
+        timings[compare.__name__] = min(
+            _time(compare, filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS) for _ in range(3)
+        )
+    print(f"Timings {timings}", flush=True)
+
+    assert timings["columnar_compare"] < timings["keyed_compare"]
+
+
+def _time(function, *args) -> float:
+    t0 = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - t0
+
+
+def test_columnar_compare_common_prefix_with_repeated_keys(tmp_path):
+    # The first rows are the same in both files, their keys are repeated in the rows which differ
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("code,value\na,1\nb,2\na,3\nb,4\n")
+    filepath_2.write_text("code,value\na,1\nb,2\nb,5\na,3\na,6\n")
+
+    diff_metrics = columnar_compare(str(filepath_1), str(filepath_2), ["code"])
+
+    assert diff_metrics == keyed_compare(str(filepath_1), str(filepath_2), ["code"])
+    assert diff_metrics["cell_changes"] == [
+        {"row": 4, "column": "value", "original_value": "4", "new_value": "5"}
+    ]
+    assert diff_metrics["n_lines_added"] == 1
+
+
+def test_columnar_compare_numeric_tolerance(tmp_path):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("code,usdprice,name\na,0.3606,x\nb,1.0,y\nc,,z\nd,2,w\n")
+    filepath_2.write_text("code,usdprice,name\na,0.36060,x\nb,1.05,y\nc,3,z\nd,2,v\n")
+
+    exact = columnar_compare(str(filepath_1), str(filepath_2), ["code"])
+    assert [x["row"] for x in exact["cell_changes"]] == [1, 2, 3, 4]
+
+    tolerant = columnar_compare(str(filepath_1), str(filepath_2), ["code"], abs_tol=0.1)
+    assert tolerant["n_lines_changed"] == 2
+    assert tolerant["cell_changes"] == [
+        {"row": 3, "column": "usdprice", "original_value": "", "new_value": "3"},
+        {"row": 4, "column": "name", "original_value": "w", "new_value": "v"},
+    ]
+
+    relative = columnar_compare(str(filepath_1), str(filepath_2), ["code"], rel_tol=1e-9)
+    assert [x["row"] for x in relative["cell_changes"]] == [2, 3, 4]
+
+
+def test_columnar_compare_tolerance_per_value(tmp_path):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("code,usdprice\na,0.3606\nb,n/a\nc,NaN\nd,1\n")
+    filepath_2.write_text("code,usdprice\na,0.36060\nb,n/a \nc,nan\nd,1.5\n")
+
+    tolerant = columnar_compare(str(filepath_1), str(filepath_2), ["code"], abs_tol=0.1)
+    assert [(x["row"], x["new_value"]) for x in tolerant["cell_changes"]] == [
+        (2, "n/a "),
+        (4, "1.5"),
+    ]
+
+
+def test_columnar_compare_duplicate_keys_and_short_rows(tmp_path):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("code,value,extra\na,1,x\na,2,y\nb,3\n")
+    filepath_2.write_text("code,value\na,1\na,5\nc,4\n")
+
+    diff_metrics = columnar_compare(str(filepath_1), str(filepath_2), ["code"])
+
+    assert diff_metrics == keyed_compare(str(filepath_1), str(filepath_2), ["code"])
+    assert diff_metrics["n_lines_removed"] == 1
+    assert diff_metrics["n_lines_added"] == 1
+
+
+def test_columnar_compare_missing_key_column():
+    filepath = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+    with pytest.raises(ValueError):
+        columnar_compare(filepath, filepath, ["market"])
+
+
+def test_load_columns_and_parse_floats():
+    columns = load_columns(
+        os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+    )
+
+    assert columns["header"] == ["date", "code", "usdprice"]
+    assert columns["n_rows"] == 821
+    assert columns["n_skipped"] == 0
+    assert None not in parse_floats(columns["columns"]["usdprice"][1:])
+    assert set(parse_floats(columns["columns"]["date"])) == {None}
+    assert parse_floats(("1.5", "", "#value", "n/a", "NaN"))[:4] == [1.5, None, None, None]
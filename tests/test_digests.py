@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+
+from hdx_file_comparison.digests import (
+    file_digest,
+    load_or_compute_digest,
+    multiset_digest,
+    read_digest_sidecar,
+    sidecar_path,
+)
+from hdx_file_comparison.streaming import streaming_file_comparison
+from hdx_file_comparison.utilities import hash_based_file_comparison
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+SMALL_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-05-12-wfp_food_prices_afg_qc.csv")
+SMALL_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+def test_multiset_digest_is_stable_and_order_independent():
+    # A fixed value, the digest must not change between interpreter runs
+    assert multiset_digest(["a", "b"]) == "bdda89bae6aab45039933ec86a444c96"
+    assert multiset_digest(["b", "a"]) == multiset_digest(["a", "b"])
+    assert multiset_digest(["a", "a", "b"]) != multiset_digest(["a", "b"])
+
+
+def test_file_digest_matches_comparison_hashes():
+    hash_metrics = hash_based_file_comparison(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED)
+    streaming_metrics = streaming_file_comparison(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED)
+
+    assert hash_metrics["file_1_hash"] == file_digest(SMALL_FILE_ORIGINAL)["digest"]
+    assert hash_metrics["file_2_hash"] == file_digest(SMALL_FILE_CHANGED)["digest"]
+    assert streaming_metrics["file_1_hash"] == hash_metrics["file_1_hash"]
+    assert streaming_metrics["file_2_hash"] == hash_metrics["file_2_hash"]
+
+
+def test_digest_sidecar(tmp_path):
+    filepath = os.path.join(tmp_path, "snapshot.csv")
+    shutil.copy(SMALL_FILE_ORIGINAL, filepath)
+
+    assert read_digest_sidecar(filepath) is None
+    digest = load_or_compute_digest(filepath)
+    assert os.path.exists(sidecar_path(filepath))
+    assert read_digest_sidecar(filepath) == digest
+    assert digest["n_rows"] == 818
+
+    with open(filepath, "a", encoding="utf-8") as file_handle:
+        file_handle.write("2024-07-15,Kabul-Kabul-Kabul-Bread-KG-Retail-AFN,0.7055\n")
+
+    assert read_digest_sidecar(filepath) is None
+    assert load_or_compute_digest(filepath)["digest"] != digest["digest"]
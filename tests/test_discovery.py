@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+import json
+import os
+
+from functools import partial
+
+from hdx_file_comparison.discovery import (
+    discover_changes,
+    download_resource,
+    new_state,
+    read_metadata_snapshot,
+    read_state,
+    record_dataset,
+    record_resource,
+    run_discovery,
+    write_state,
+)
+from hdx_file_comparison.utilities import keyed_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+METADATA_SNAPSHOT = os.path.join(FIXTURES_DIRECTORY, "2024-07-23-wfp-afghanistan-dataset.json")
+QC_RESOURCE_ID = "aa468369-81fd-4b52-87f2-950704a5e47f"
+
+
+def seen_state(datasets: list[dict]) -> dict:
+    """State as left by a run which saw datasets"""
+    state = new_state()
+    for change in discover_changes(datasets, state):
+        record_resource(state, change["resource"])
+    for dataset in datasets:
+        record_dataset(state, dataset)
+    return state
+
+
+def modified_snapshot(datasets: list[dict], **fields) -> list[dict]:
+    """A later snapshot in which the QC resource, and so the dataset, has been modified"""
+    datasets = copy.deepcopy(datasets)
+    datasets[0]["metadata_modified"] = "2024-07-21T09:04:36.132356"
+    for resource in datasets[0]["resources"]:
+        if resource["id"] == QC_RESOURCE_ID:
+            resource.update(fields)
+    return datasets
+
+
+def test_read_metadata_snapshot(tmp_path):
+    datasets = read_metadata_snapshot(METADATA_SNAPSHOT)
+    assert [x["name"] for x in datasets] == ["wfp-food-prices-for-afghanistan"]
+
+    # A CKAN package_show response
+    response_path = tmp_path / "package_show.json"
+    response_path.write_text(json.dumps({"success": True, "result": datasets[0]}))
+    assert read_metadata_snapshot(str(response_path)) == datasets
+
+
+def test_discover_changes():
+    datasets = read_metadata_snapshot(METADATA_SNAPSHOT)
+
+    assert [x["status"] for x in discover_changes(datasets, new_state())] == ["new", "new"]
+
+    state = seen_state(datasets)
+    assert [x["status"] for x in discover_changes(datasets, state)] == ["unchanged", "unchanged"]
+
+    later = modified_snapshot(
+        datasets, last_modified="2024-07-21T09:04:32.451656", size=50700, hash=""
+    )
+    changes = discover_changes(later, state)
+    assert [x["status"] for x in changes] == ["unchanged", "changed"]
+    # The hash is empty in both snapshots so it is not compared
+    assert changes[1]["changed_fields"] == ["last_modified", "size"]
+
+    # Resource metadata is not checked while the dataset's metadata_modified is unchanged
+    later[0]["metadata_modified"] = datasets[0]["metadata_modified"]
+    assert [x["status"] for x in discover_changes(later, state)] == ["unchanged", "unchanged"]
+
+    removed = copy.deepcopy(datasets)
+    removed[0]["metadata_modified"] = "2024-07-21T09:04:36.132356"
+    removed[0]["resources"] = removed[0]["resources"][:1]
+    assert [x["status"] for x in discover_changes(removed, state)] == ["unchanged", "removed"]
+
+
+def test_state_round_trip(tmp_path):
+    state_path = str(tmp_path / "state" / "discovery-state.json")
+    assert read_state(state_path) == new_state()
+
+    state = seen_state(read_metadata_snapshot(METADATA_SNAPSHOT))
+    write_state(state_path, state)
+    assert read_state(state_path) == state
+
+
+def test_run_discovery_downloads_and_diffs_changed_resources(tmp_path, fixture_server):
+    base_url = f"http://127.0.0.1:{fixture_server.server_port}"
+    datasets = read_metadata_snapshot(METADATA_SNAPSHOT)
+    for resource in datasets[0]["resources"]:
+        resource["download_url"] = f"{base_url}/{os.path.basename(resource['download_url'])}"
+    download = partial(download_resource, download_directory=str(tmp_path))
+    compare = partial(keyed_compare, key_columns=["date", "code"])
+    state = new_state()
+
+    changes = run_discovery(datasets, state, download, compare=compare)
+    assert [x["status"] for x in changes] == ["new", "new"]
+    assert [os.path.basename(x["filepath"]) for x in changes] == [
+        "2024-06-23T090432.098761-wfp_food_prices_afg.csv",
+        "2024-06-23T090432.451656-wfp_food_prices_afg_qc.csv",
+    ]
+    assert "result" not in changes[1]
+
+    # Nothing is downloaded when the metadata has not changed
+    n_requests = fixture_server.n_connections
+    changes = run_discovery(datasets, state, download, compare=compare)
+    assert [x["status"] for x in changes] == ["unchanged", "unchanged"]
+    assert fixture_server.n_connections == n_requests
+
+    # The modified QC file is downloaded and diffed against the previous copy
+    changed_path = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc_changed.csv")
+    with open(changed_path, encoding="utf-8") as file_handle:
+        fixture_server.files["/wfp_food_prices_afg_qc.csv"] = file_handle.read().splitlines()
+    later = modified_snapshot(datasets, last_modified="2024-07-21T09:04:32.451656")
+    changes = run_discovery(later, state, download, compare=compare)
+    assert [x["status"] for x in changes] == ["unchanged", "changed"]
+    assert (
+        os.path.basename(changes[1]["filepath"])
+        == "2024-07-21T090432.451656-wfp_food_prices_afg_qc.csv"
+    )
+    assert changes[1]["result"]["n_lines_changed"] > 0
+    assert state["resources"][QC_RESOURCE_ID]["filepath"] == changes[1]["filepath"]
+
+    # A second update on the same day is kept in its own file and diffed against the first
+    first_path = changes[1]["filepath"]
+    fixture_server.files["/wfp_food_prices_afg_qc.csv"][-1] += "0"
+    later = modified_snapshot(datasets, last_modified="2024-07-21T15:30:00.000000")
+    later[0]["metadata_modified"] = "2024-07-21T15:30:04.000000"
+    changes = run_discovery(later, state, download, compare=compare)
+    assert changes[1]["filepath"] != first_path
+    assert os.path.exists(first_path)
+    assert changes[1]["result"]["n_lines_changed"] == 1
+
+    dry_run = run_discovery(datasets, state, download, dry_run=True)
+    assert [x["status"] for x in dry_run] == ["unchanged", "changed"]
+    assert state["resources"][QC_RESOURCE_ID]["filepath"] == changes[1]["filepath"]
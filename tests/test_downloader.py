@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from hdx_file_comparison import downloader
+from hdx_file_comparison.downloader import (
+    checkpoint_path,
+    download_to_file,
+    download_url_to_file,
+    fetch_data_from_hapi_concurrent,
+    partial_path,
+    read_checkpoint,
+)
+
+
+def query_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/api/v1/theme?output_format=csv"
+
+
+def test_fetch_data_from_hapi_concurrent(fixture_server):
+    results = fetch_data_from_hapi_concurrent(
+        query_url(fixture_server), limit=50, max_workers=4, adaptive_page_size=False
+    )
+
+    assert results == fixture_server.lines
+    # Pages are requested over at most one keep-alive connection per worker
+    assert len(fixture_server.requests) >= 17
+    assert fixture_server.n_connections <= 4
+
+
+def test_fetch_data_from_hapi_concurrent_pages_in_order(fixture_server):
+    pages = []
+    results = fetch_data_from_hapi_concurrent(
+        query_url(fixture_server),
+        limit=100,
+        max_workers=3,
+        on_page=lambda offset, header, rows: pages.append((offset, header, rows)),
+    )
+
+    assert results == []
+    offsets = [x[0] for x in pages]
+    assert offsets == sorted(offsets)
+    assert all(header == fixture_server.lines[0] for _, header, _ in pages)
+    assert [row for _, _, rows in pages for row in rows] == fixture_server.lines[1:]
+
+
+def test_fetch_data_from_hapi_concurrent_retries(fixture_server, monkeypatch):
+    monkeypatch.setattr(downloader, "BACKOFF_SECONDS", 0.01)
+    fixture_server.fail_offsets.update({0, 200})
+
+    results = fetch_data_from_hapi_concurrent(
+        query_url(fixture_server), limit=100, max_workers=2, adaptive_page_size=False
+    )
+
+    assert results == fixture_server.lines
+    assert fixture_server.requests.count((200, 100)) == 2
+
+
+def test_fetch_data_from_hapi_concurrent_gives_up(fixture_server, monkeypatch):
+    monkeypatch.setattr(downloader, "BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(downloader, "MAX_RETRIES", 0)
+    fixture_server.fail_offsets.add(0)
+
+    with pytest.raises(downloader.PageFetchError):
+        fetch_data_from_hapi_concurrent(query_url(fixture_server), limit=100, max_workers=1)
+
+
+def test_fetch_data_from_hapi_concurrent_error_past_end(fixture_server, monkeypatch):
+    monkeypatch.setattr(downloader, "MAX_RETRIES", 0)
+    # All eight pages are requested at once, the last three are past the end of the rows
+    n_pages = (len(fixture_server.lines) - 1) // 200 + 1
+    past_end = {200 * (n_pages + x) for x in range(8 - n_pages)}
+    fixture_server.fail_offsets.update(past_end)
+
+    results = fetch_data_from_hapi_concurrent(
+        query_url(fixture_server), limit=200, max_workers=8, adaptive_page_size=False
+    )
+
+    assert results == fixture_server.lines
+    assert past_end <= {offset for offset, _ in fixture_server.requests}
+
+
+def test_download_to_file(fixture_server, tmp_path):
+    output_file_path = os.path.join(tmp_path, "download.csv")
+    n_rows = download_to_file(query_url(fixture_server), output_file_path, limit=100)
+
+    assert n_rows == len(fixture_server.lines) - 1
+    with open(output_file_path, encoding="utf-8") as file_handle:
+        assert file_handle.read().splitlines() == fixture_server.lines
+    assert not os.path.exists(partial_path(output_file_path))
+    assert not os.path.exists(checkpoint_path(output_file_path))
+
+
+def test_download_to_file_resumes(fixture_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(downloader, "MAX_RETRIES", 0)
+    output_file_path = os.path.join(tmp_path, "download.csv")
+    fixture_server.fail_offsets.add(300)
+
+    with pytest.raises(downloader.PageFetchError):
+        download_to_file(
+            query_url(fixture_server),
+            output_file_path,
+            limit=100,
+            max_workers=2,
+            adaptive_page_size=False,
+        )
+
+    checkpoint = read_checkpoint(output_file_path)
+    assert checkpoint["next_offset"] == 300
+    assert checkpoint["header"] == fixture_server.lines[0]
+    assert not os.path.exists(output_file_path)
+
+    fixture_server.requests.clear()
+    download_to_file(
+        query_url(fixture_server),
+        output_file_path,
+        limit=100,
+        max_workers=2,
+        adaptive_page_size=False,
+    )
+
+    assert min(offset for offset, _ in fixture_server.requests) == 300
+    with open(output_file_path, encoding="utf-8") as file_handle:
+        assert file_handle.read().splitlines() == fixture_server.lines
+
+
+def test_download_url_to_file(fixture_server, tmp_path):
+    url = f"http://127.0.0.1:{fixture_server.server_address[1]}/resource.csv"
+    expected = ("\n".join(fixture_server.lines) + "\n").encode("utf-8")
+    output_file_path = os.path.join(tmp_path, "resource.csv")
+
+    assert download_url_to_file(url, output_file_path, chunk_size=1000) == len(expected)
+    with open(output_file_path, "rb") as file_handle:
+        assert file_handle.read() == expected
+    assert not os.path.exists(partial_path(output_file_path))
+
+    # A partial file left by an interrupted download is resumed from where it stopped
+    resumed_path = os.path.join(tmp_path, "resumed.csv")
+    with open(partial_path(resumed_path), "wb") as file_handle:
+        file_handle.write(expected[0:5000])
+    download_url_to_file(url, resumed_path)
+    assert fixture_server.ranges == [5000]
+    with open(resumed_path, "rb") as file_handle:
+        assert file_handle.read() == expected
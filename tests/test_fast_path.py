@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from hdx_file_comparison.cli import run_diff_engine
+from hdx_file_comparison.fast_path import common_affixes, files_identical, trimmed_files
+from hdx_file_comparison.instrumentation import RECORDER
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_KEY_COLUMNS = "date,admin1,admin2,market,commodity,pricetype"
+
+
+def test_files_identical(tmp_path):
+    filepath = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+    copy = tmp_path / "copy.csv"
+    copy.write_bytes(open(filepath, "rb").read())
+    assert files_identical(filepath, str(copy), chunk_size=4096)
+
+    # Same size, one byte different in the last chunk
+    data = bytearray(copy.read_bytes())
+    data[-2] = ord("X") if data[-2] != ord("X") else ord("Y")
+    copy.write_bytes(bytes(data))
+    assert not files_identical(filepath, str(copy), chunk_size=4096)
+
+    empty_1 = tmp_path / "empty_1.csv"
+    empty_2 = tmp_path / "empty_2.csv"
+    empty_1.write_bytes(b"")
+    empty_2.write_bytes(b"")
+    assert files_identical(str(empty_1), str(empty_2))
+    assert not files_identical(str(empty_1), filepath)
+
+
+@pytest.mark.parametrize(
+    "content_1,content_2,expected",
+    [
+        # Appended tail, the partial last line of file_1 is not part of the prefix
+        (b"h\na,1\nb,2\n", b"h\na,1\nb,2\nc,3\n", (10, 0)),
+        (b"h\na,1\nb,2", b"h\na,1\nb,23\n", (6, 0)),
+        # Changed middle line, the suffix starts at a line boundary in both files
+        (b"h\na,1\nb,2\nc,3\n", b"h\na,1\nb,22\nc,3\n", (6, 4)),
+        # Prefix and suffix do not overlap when a line is repeated
+        (b"h\na\n", b"h\na\na\n", (4, 0)),
+        (b"h\na\nb\n", b"h\nb\n", (2, 2)),
+        (b"x\n", b"y\n", (0, 0)),
+    ],
+)
+def test_common_affixes(tmp_path, content_1, content_2, expected):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_bytes(content_1)
+    filepath_2.write_bytes(content_2)
+
+    for chunk_size in [1, 3, 1024]:
+        assert common_affixes(str(filepath_1), str(filepath_2), chunk_size=chunk_size) == expected
+
+
+def test_trimmed_files(tmp_path):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("code,value\na,1\nb,2\nc,3\nd,4\n")
+    filepath_2.write_text("code,value\na,1\nb,5\nc,3\nd,4\n")
+
+    with trimmed_files(str(filepath_1), str(filepath_2), min_trim_bytes=0) as (
+        trimmed_1,
+        trimmed_2,
+        line_offset,
+    ):
+        assert open(trimmed_1).read() == "code,value\nb,2\n"
+        assert open(trimmed_2).read() == "code,value\nb,5\n"
+        assert line_offset == 1
+    assert not os.path.exists(trimmed_1)
+
+
+@pytest.mark.parametrize("engine", ["difflib", "keyed", "streaming", "merkle", "columnar"])
+def test_run_diff_engine_fast_path(engine):
+    filepath_1 = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+    filepath_2 = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+
+    # Most of the file is a common prefix, so only the last rows are diffed
+    prefix, suffix = common_affixes(filepath_1, filepath_2)
+    assert prefix > 0.9 * os.path.getsize(filepath_1)
+
+    expected = run_diff_engine(
+        filepath_1, filepath_2, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS, fast_path=False
+    )
+    assert (
+        run_diff_engine(filepath_1, filepath_2, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS)
+        == expected
+    )
+    assert expected[0] == {"n_lines_changed": 473, "n_lines_added": 1, "n_lines_removed": 0}
+
+    assert run_diff_engine(
+        filepath_2, filepath_2, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS
+    ) == (
+        {"n_lines_changed": 0, "n_lines_added": 0, "n_lines_removed": 0},
+        None if engine == "difflib" else [],
+    )
+
+
+def test_run_diff_engine_known_different():
+    filepath_1 = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+    filepath_2 = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+    expected = run_diff_engine(
+        filepath_1, filepath_2, engine="keyed", key_columns=BIG_FILE_KEY_COLUMNS
+    )
+
+    # Files the caller has already found to differ are trimmed without being compared again
+    RECORDER.reset()
+    assert (
+        run_diff_engine(
+            filepath_1,
+            filepath_2,
+            engine="keyed",
+            key_columns=BIG_FILE_KEY_COLUMNS,
+            known_different=True,
+        )
+        == expected
+    )
+    stages = [x["stage"] for x in RECORDER.spans]
+    assert "fast_path_identical" not in stages
+    assert stages.count("fast_path_affixes") == 1
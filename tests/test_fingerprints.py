@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+from array import array
+
+from hdx_file_comparison.digests import multiset_digest
+from hdx_file_comparison.fingerprints import LineFingerprints, first_lines, merge_unique
+from hdx_file_comparison.utilities import hash_based_file_comparison
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+SMALL_FILE = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+def test_line_fingerprints(tmp_path):
+    filepath = tmp_path / "file.csv"
+    filepath.write_bytes(b"h\r\na\r\nb\r\na\r\nc\r\na")
+    fingerprints = LineFingerprints(str(filepath))
+
+    assert len(fingerprints) == 6
+    assert fingerprints.digest == multiset_digest(["h", "a", "b", "a", "c", "a"])
+    assert list(fingerprints.offsets) == [0, 3, 6, 9, 12, 15]
+    assert fingerprints.n_unique() == 4
+    assert len(fingerprints.unique_fingerprints()) == 4
+
+    repeats = fingerprints.repeated()
+    assert list(repeats.values()) == [3]
+    assert list(fingerprints.lines(repeats)) == [(fingerprints.fingerprints[1], "a")]
+
+
+def test_line_fingerprints_matches_digest_of_lines():
+    fingerprints = LineFingerprints(SMALL_FILE, line_limit=100)
+    with open(SMALL_FILE, encoding="utf-8") as file_handle:
+        lines = file_handle.read().splitlines()
+
+    assert len(fingerprints) == 100
+    assert fingerprints.digest == multiset_digest(lines[:100])
+    assert LineFingerprints(SMALL_FILE).n_unique() == len(set(lines))
+
+
+def test_merge_unique():
+    n_common, only_1, only_2 = merge_unique(array("Q", [1, 3, 5, 7]), array("Q", [2, 3, 7, 8, 9]))
+
+    assert n_common == 2
+    assert list(only_1) == [1, 5]
+    assert list(only_2) == [2, 8, 9]
+
+
+def test_first_lines(tmp_path):
+    filepath = tmp_path / "file.csv"
+    filepath.write_text("d\nb\nc\na\n")
+    fingerprints = LineFingerprints(str(filepath))
+
+    assert first_lines(fingerprints, fingerprints.fingerprints[:3], n=2) == ["b", "c"]
+
+
+def test_hash_based_file_comparison_repeated_lines(tmp_path, capsys):
+    filepath_1 = tmp_path / "file_1.csv"
+    filepath_2 = tmp_path / "file_2.csv"
+    filepath_1.write_text("h\na\nb\nb\nc\n")
+    filepath_2.write_text("h\na\na\na\nd\n")
+
+    hash_metrics = hash_based_file_comparison(str(filepath_1), str(filepath_2))
+
+    assert hash_metrics["file_1_unique"] == 4
+    assert hash_metrics["file_2_unique"] == 3
+    assert hash_metrics["n_common"] == 2
+    assert hash_metrics["n_differing"] == 2
+    assert capsys.readouterr().out.split("\n") == [
+        "",
+        "file 1 counter",
+        "b 2",
+        "",
+        "file 2 counter",
+        "a 3",
+        "in 1 but not in 2",
+        "b",
+        "c",
+        "in 2 but not in 1",
+        "d",
+        "",
+    ]
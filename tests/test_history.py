@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from click.testing import CliRunner
+
+from hdx_file_comparison.cli import hdx_compare
+from hdx_file_comparison.history import HistoryStore, version_from_filename
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+SNAPSHOTS = [
+    os.path.join(FIXTURES_DIRECTORY, x)
+    for x in [
+        "2024-05-12-wfp_food_prices_afg.csv",
+        "2024-07-14-wfp_food_prices_afg.csv",
+        "2024-07-21-wfp_food_prices_afg.csv",
+    ]
+]
+KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+
+
+def write_csv(directory, filename: str, content: str) -> str:
+    filepath = os.path.join(directory, filename)
+    with open(filepath, "w", encoding="utf-8", newline="") as file_handle:
+        file_handle.write(content)
+    return filepath
+
+
+def read_text(filepath: str) -> str:
+    with open(filepath, encoding="utf-8") as file_handle:
+        return file_handle.read()
+
+
+def test_history_store_fixture_snapshots(tmp_path):
+    store = HistoryStore(os.path.join(tmp_path, "history"), KEY_COLUMNS)
+    stored = [store.add_version(x) for x in SNAPSHOTS]
+
+    assert [x["version_id"] for x in stored] == ["2024-05-12", "2024-07-14", "2024-07-21"]
+    assert [x["kind"] for x in stored] == ["base", "delta", "delta"]
+    assert (stored[2]["n_added"], stored[2]["n_removed"], stored[2]["n_changed"]) == (1, 0, 473)
+    # Deltas are a small fraction of a full snapshot
+    assert stored[2]["bytes"] < 0.05 * stored[0]["bytes"]
+
+    # The store is reopened from disk and every snapshot is rebuilt exactly
+    reopened = HistoryStore(os.path.join(tmp_path, "history"))
+    for version_id, filepath in zip(reopened.version_ids(), SNAPSHOTS):
+        output_path = os.path.join(tmp_path, f"{version_id}.csv")
+        reopened.write_version(version_id, output_path)
+        assert read_text(output_path) == read_text(filepath)
+
+
+def test_history_store_last_changed(tmp_path):
+    versions = [
+        "code,n,value\n#code,#n,#value\na,1,x\nb,1,y\nb,2,y\nc,1,z\n",
+        "code,n,value\n#code,#n,#value\na,1,x\nb,1,Y\nb,2,y\nd,1,w\nc,1,z\n",
+        "code,n,value\n#code,#n,#value\na,1,x\nb,1,Y\nb,2,y\nd,1,w\n",
+        "code,n,value\n#code,#n,#value\na,1,x\nb,1,Y\nb,2,y\nd,1,w\nc,1,z\n",
+    ]
+    store = HistoryStore(tmp_path, ["code"], rebase_interval=10)
+    for i, content in enumerate(versions):
+        store.add_version(write_csv(tmp_path, f"v{i}.csv", content), version_id=f"v{i}")
+
+    assert [x["kind"] for x in store.versions] == ["base", "delta", "delta", "delta"]
+    assert store.last_changed(["a"]) == "v0"
+    assert store.last_changed(["a"], column="value") == "v0"
+    # Repeated keys are told apart by occurrence
+    assert store.last_changed(["b"], column="value") == "v1"
+    assert store.last_changed(["b"], column="n") == "v0"
+    assert store.last_changed(["b"], occurrence=1) == "v0"
+    assert store.last_changed(["d"], column="value") == "v1"
+    # c was removed in v2 and added again in v3
+    assert store.last_changed(["c"], column="value") == "v3"
+    assert store.last_changed(["e"]) is None
+
+    for i, content in enumerate(versions):
+        output_path = os.path.join(tmp_path, f"rebuilt_{i}.csv")
+        store.write_version(f"v{i}", output_path)
+        assert read_text(output_path) == content
+
+
+@pytest.mark.parametrize(
+    "content,rebase_interval,expected",
+    [
+        # Rows reordered
+        ("code,value\nb,2\na,1\nc,3\nd,4\n", 10, "base"),
+        # Header changed
+        ("code,value,extra\na,1,\nb,2,\nc,3,\n", 10, "base"),
+        # Only the HXL tags changed
+        ("code,value\n#code,#value+num\na,1\nb,2\nc,3\nd,4\n", 10, "base"),
+        # Most rows changed
+        ("code,value\na,5\nb,5\nc,3\n", 10, "base"),
+        # One row changed, but the rebase interval is reached
+        ("code,value\na,1\nb,2\nc,4\nd,4\n", 1, "base"),
+        ("code,value\na,1\nb,2\nc,4\nd,4\n", 10, "delta"),
+    ],
+)
+def test_history_store_rebases(tmp_path, content, rebase_interval, expected):
+    store = HistoryStore(tmp_path, ["code"], rebase_interval=rebase_interval)
+    store.add_version(write_csv(tmp_path, "v0.csv", "code,value\na,1\nb,2\nc,3\n"), "v0")
+    store.add_version(write_csv(tmp_path, "v1.csv", "code,value\na,1\nb,2\nc,3\nd,4\n"), "v1")
+
+    assert store.add_version(write_csv(tmp_path, "v2.csv", content), "v2")["kind"] == expected
+    output_path = os.path.join(tmp_path, "rebuilt.csv")
+    store.write_version("v2", output_path)
+    assert read_text(output_path) == content
+
+
+def test_history_store_errors(tmp_path):
+    with pytest.raises(ValueError):
+        HistoryStore(tmp_path)
+    store = HistoryStore(tmp_path, ["code"])
+    filepath = write_csv(tmp_path, "2024-07-21-file.csv", "code,value\na,1\n")
+    assert version_from_filename(filepath) == "2024-07-21"
+    store.add_version(filepath)
+    with pytest.raises(ValueError):
+        store.add_version(filepath)
+    with pytest.raises(ValueError):
+        HistoryStore(tmp_path, ["value"])
+
+
+def test_history_commands(tmp_path):
+    history_directory = os.path.join(tmp_path, "history")
+    runner = CliRunner()
+    for filepath in SNAPSHOTS[1:]:
+        result = runner.invoke(
+            hdx_compare,
+            [
+                "history",
+                "add",
+                f"--history_directory={history_directory}",
+                f"--file={filepath}",
+                f"--key_columns={','.join(KEY_COLUMNS)}",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+    assert "Stored 2024-07-21 as a delta" in result.output
+
+    result = runner.invoke(
+        hdx_compare,
+        [
+            "history",
+            "last_changed",
+            f"--history_directory={history_directory}",
+            "--key=2024-07-15,Zabul,Qalat,Zabul,Pulses,Retail",
+            "--column=usdprice",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == "2024-07-21"
+
+    result = runner.invoke(
+        hdx_compare, ["history", "list", f"--history_directory={history_directory}"]
+    )
+    assert result.output.splitlines()[0].startswith("2024-07-14: base, 32562 rows")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+import os
+import pstats
+
+from hdx_file_comparison.instrumentation import RECORDER, MetricsRecorder, profile
+from hdx_file_comparison.utilities import difflib_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+SMALL_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-05-12-wfp_food_prices_afg_qc.csv")
+SMALL_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+def test_metrics_recorder(tmp_path):
+    recorder = MetricsRecorder()
+    seen = []
+    recorder.add_callback(seen.append)
+    metrics_out = str(tmp_path / "metrics.ndjson")
+    recorder.open_output(metrics_out)
+
+    with recorder.stage("diff", engine="keyed"):
+        with recorder.stage("parse") as span:
+            span.add(rows=10, bytes_read=100)
+            span.add(rows=5)
+    recorder.close_output()
+
+    assert [x["stage"] for x in seen] == ["parse", "diff"]
+    assert seen[0]["parent"] == "diff"
+    assert seen[0]["rows"] == 15
+    assert seen[0]["bytes_read"] == 100
+    assert seen[1]["engine"] == "keyed"
+    assert seen[1]["wall_seconds"] >= seen[0]["wall_seconds"]
+    with open(metrics_out, encoding="utf-8") as metrics_handle:
+        assert [json.loads(x) for x in metrics_handle] == seen
+
+    summary = recorder.summary()
+    assert summary["parse"]["n_spans"] == 1
+    assert summary["parse"]["rows"] == 15
+
+
+def test_metrics_recorder_bounded():
+    recorder = MetricsRecorder(max_spans=3)
+    for _ in range(10):
+        with recorder.stage("download_page") as span:
+            span.add(rows=2)
+
+    # Only recent records are kept but the totals cover every span
+    assert len(recorder.spans) == 3
+    assert recorder.summary()["download_page"]["n_spans"] == 10
+    assert recorder.summary()["download_page"]["rows"] == 20
+    recorder.reset()
+    assert recorder.summary() == {}
+
+
+def test_difflib_compare_records_stages():
+    RECORDER.reset()
+    difflib_compare(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED, line_diff="myers")
+
+    stages = {x["stage"]: x for x in RECORDER.spans}
+    assert stages["parse"]["rows"] == 818 + 822
+    assert stages["parse"]["bytes_read"] == os.path.getsize(SMALL_FILE_ORIGINAL) + os.path.getsize(
+        SMALL_FILE_CHANGED
+    )
+    assert stages["line_diff"]["line_diff"] == "myers"
+
+
+def test_profile(tmp_path):
+    profile_out = str(tmp_path / "profile.prof")
+    with profile(profile_out):
+        sum(range(1000))
+
+    assert pstats.Stats(profile_out).total_calls > 0
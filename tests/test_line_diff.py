@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+
+import pytest
+
+from hdx_file_comparison.cli import iter_diff_engine
+from hdx_file_comparison.line_diff import myers_matches, patience_matches, sequence_changes
+from hdx_file_comparison.utilities import difflib_compare, compute_diff_metrics
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_EDITED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_changed.csv")
+
+
+@pytest.mark.parametrize("line_diff", ["myers", "patience"])
+def test_line_diff_engines_big(line_diff):
+    t0 = time.time()
+    diff = difflib_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, line_diff=line_diff)
+    print(f"{line_diff} diff took {time.time()-t0:0.3f} seconds", flush=True)
+
+    diff_metrics = compute_diff_metrics(diff)
+    assert diff_metrics["n_lines_changed"] == 473
+    assert diff_metrics["n_lines_removed"] == 0
+    assert diff_metrics["n_lines_added"] == 1
+
+
+@pytest.mark.parametrize("line_diff", ["myers", "patience"])
+def test_line_diff_engines_match_ndiff(line_diff):
+    diff = difflib_compare(BIG_FILE_CHANGED, BIG_FILE_EDITED, line_diff=line_diff)
+
+    assert diff == difflib_compare(BIG_FILE_CHANGED, BIG_FILE_EDITED, line_diff="ndiff")
+
+
+@pytest.mark.parametrize("line_diff", ["myers", "patience"])
+def test_line_diff_engines_pair_lines_as_ndiff(line_diff):
+    # Rows are removed near the start of a long changed block, so lines are paired with the most
+    # similar line nearby rather than the first similar enough
+    expected = list(iter_diff_engine(BIG_FILE_ORIGINAL, BIG_FILE_EDITED, {}, fast_path=False))
+    cell_changes = list(
+        iter_diff_engine(
+            BIG_FILE_ORIGINAL, BIG_FILE_EDITED, {}, line_diff=line_diff, fast_path=False
+        )
+    )
+
+    assert len(expected) == 598
+    assert cell_changes == expected
+
+
+def test_myers_matches_is_longest_common_subsequence():
+    # The example from Myers' paper, the longest common subsequence has length 4
+    a = list("ABCABBA")
+    b = list("CBABAC")
+    matches = myers_matches(a, b)
+
+    assert len(matches) == 4
+    assert all(a[i] == b[j] for i, j in matches)
+
+
+def test_patience_matches_anchors_on_unique_lines():
+    a = ["header", "x", "row 1", "x", "row 2", "footer"]
+    b = ["header", "row 2", "x", "row 1", "x", "footer"]
+    matches = patience_matches(a, b)
+
+    assert (0, 0) in matches
+    assert (5, 5) in matches
+    assert all(a[i] == b[j] for i, j in matches)
+
+
+@pytest.mark.parametrize("algorithm", ["myers", "patience"])
+def test_sequence_changes(algorithm):
+    a = ["1", "2", "3", "4", "5"]
+    b = ["1", "9", "3", "5", "6"]
+
+    assert sequence_changes(a, b, algorithm=algorithm) == [
+        (1, "- 2"),
+        (2, "+ 9"),
+        (4, "- 4"),
+        (6, "+ 6"),
+    ]
+    with pytest.raises(ValueError):
+        sequence_changes(a, b, algorithm="ndiff")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from hdx_file_comparison.instrumentation import RECORDER
+
+from hdx_file_comparison.merkle import (
+    bucket_digests,
+    merkle_compare,
+    merkle_tree,
+    mismatched_buckets,
+)
+from hdx_file_comparison.utilities import keyed_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+SMALL_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+SMALL_FILE_CHANGED = os.path.join(
+    FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc_changed.csv"
+)
+
+
+def test_mismatched_buckets():
+    leaves = [f"{x:032x}" for x in range(8)]
+    changed_leaves = list(leaves)
+    changed_leaves[5] = "f" * 32
+
+    assert mismatched_buckets(merkle_tree(leaves), merkle_tree(leaves)) == []
+    assert mismatched_buckets(merkle_tree(leaves), merkle_tree(changed_leaves)) == [5]
+
+
+def test_bucket_digests_localise_changes():
+    buckets_1 = bucket_digests(SMALL_FILE_ORIGINAL, ["date", "code"], n_buckets=256)
+    buckets_2 = bucket_digests(SMALL_FILE_CHANGED, ["date", "code"], n_buckets=256)
+
+    assert sum(buckets_1["counts"]) == 821
+    differing = mismatched_buckets(buckets_1["tree"], buckets_2["tree"])
+    assert 0 < len(differing) <= 10
+
+
+def test_bucket_digests_rejects_bad_bucket_count():
+    with pytest.raises(ValueError):
+        bucket_digests(SMALL_FILE_ORIGINAL, n_buckets=1000)
+
+
+def test_merkle_compare_matches_keyed_compare():
+    RECORDER.reset()
+    diff_metrics = merkle_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS)
+
+    assert diff_metrics == keyed_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS)
+    # The number of differing buckets is recorded on the stage rather than printed
+    span = [x for x in RECORDER.spans if x["stage"] == "bucket_digests"][-1]
+    assert 0 < span["n_differing_buckets"] < span["n_buckets"]
+
+
+def test_merkle_compare_unkeyed():
+    diff_metrics = merkle_compare(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED)
+
+    assert diff_metrics["n_lines_changed"] == 0
+    assert diff_metrics["n_lines_removed"] - diff_metrics["n_lines_added"] == 9
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+from hdx_file_comparison.downloader import (
+    ConnectionPool,
+    cached_http_get,
+    download_to_file,
+    fetch_data_from_hapi_concurrent,
+)
+from hdx_file_comparison.page_cache import PageCache, cache_key, normalize_url
+
+
+def query_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/api/v1/theme?output_format=csv"
+
+
+def store(cache: PageCache, url: str, body: bytes) -> dict:
+    return cache.store(url, {"Content-Type": "text/csv; charset=utf-8", "ETag": '"1"'}, body)
+
+
+def test_normalize_url():
+    assert (
+        normalize_url("HTTPS://Hapi.HumData.org:443/api/v1/theme?limit=10&offset=0#top")
+        == "https://hapi.humdata.org/api/v1/theme?limit=10&offset=0"
+    )
+    assert cache_key("http://host/a?offset=0&limit=10") == cache_key(
+        "http://host:80/a?limit=10&offset=0"
+    )
+    assert cache_key("http://host/a?offset=0&limit=10") != cache_key(
+        "http://host/a?offset=10&limit=10"
+    )
+
+
+def test_store_and_read(tmp_path):
+    cache = PageCache(tmp_path)
+    url = "http://host/a?offset=0&limit=10"
+    store(cache, url, b"a,b\n1,2\n")
+
+    # The index is rebuilt from disk
+    reopened = PageCache(tmp_path)
+    entry = reopened.lookup("http://host/a?limit=10&offset=0")
+    headers, body = reopened.read(url, entry)
+    assert body == b"a,b\n1,2\n"
+    assert headers.get_content_charset() == "utf-8"
+    assert headers["ETag"] == '"1"'
+    assert reopened.is_fresh(entry)
+    assert reopened.total_bytes == len(body)
+    assert reopened.lookup("http://host/a?offset=10&limit=10") is None
+
+
+def test_identical_bodies_stored_once(tmp_path):
+    cache = PageCache(tmp_path)
+    store(cache, "http://host/a?offset=0", b"same")
+    store(cache, "http://host/b?offset=0", b"same")
+
+    assert len(os.listdir(os.path.join(tmp_path, "bodies"))) == 1
+    assert cache.total_bytes == 4
+
+
+def test_replaced_bodies_removed(tmp_path):
+    cache = PageCache(tmp_path)
+    url = "http://host/a?offset=0"
+    for i in range(5):
+        store(cache, url, str(i).encode("utf-8") * 100)
+    store(cache, url, b"4" * 100)
+
+    # Only the current body is on disk, so the byte budget bounds the cache directory
+    bodies_directory = os.path.join(tmp_path, "bodies")
+    assert len(os.listdir(bodies_directory)) == 1
+    assert cache.total_bytes == 100
+
+    # Bodies no entry refers to are swept when the cache is opened
+    orphan = os.path.join(bodies_directory, 64 * "0")
+    with open(orphan, "wb") as orphan_handle:
+        orphan_handle.write(b"orphan")
+    reopened = PageCache(tmp_path)
+    assert not os.path.exists(orphan)
+    assert reopened.read(url, reopened.lookup(url))[1] == b"4" * 100
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = PageCache(tmp_path, max_bytes=25)
+    store(cache, "http://host/a", 10 * b"a")
+    store(cache, "http://host/b", 10 * b"b")
+    cache.read("http://host/a", cache.lookup("http://host/a"))
+    store(cache, "http://host/c", 10 * b"c")
+
+    assert cache.lookup("http://host/b") is None
+    assert cache.lookup("http://host/a") is not None
+    assert cache.lookup("http://host/c") is not None
+    assert cache.n_evicted == 1
+    assert cache.total_bytes == 20
+    assert len(os.listdir(os.path.join(tmp_path, "bodies"))) == 2
+
+
+def test_cached_http_get_fresh_and_revalidated(fixture_server, tmp_path):
+    url = f"{query_url(fixture_server)}&offset=0&limit=100"
+    pool = ConnectionPool()
+    cache = PageCache(tmp_path)
+
+    status, _, body = cached_http_get(url, pool, cache)
+    assert status == 200
+    assert cache.n_misses == 1
+    assert len(fixture_server.requests) == 1
+
+    # Fresh entries do not touch the network
+    assert cached_http_get(url, pool, cache)[2] == body
+    assert cache.n_hits == 1
+    assert len(fixture_server.requests) == 1
+
+    # Stale entries are revalidated and the server says they are not modified
+    cache.ttl_seconds = 0
+    assert cached_http_get(url, pool, cache)[2] == body
+    assert cache.n_revalidated == 1
+    assert fixture_server.n_not_modified == 1
+
+    # A changed page is downloaded and stored again
+    fixture_server.lines = fixture_server.lines[0:50]
+    status, _, changed_body = cached_http_get(url, pool, cache)
+    assert changed_body != body
+    assert cache.n_misses == 2
+    assert cache.read(url, cache.lookup(url))[1] == changed_body
+
+
+def test_download_to_file_through_cache(fixture_server, tmp_path):
+    cache = PageCache(os.path.join(tmp_path, "cache"))
+    output_file_path = os.path.join(tmp_path, "download.csv")
+    download_to_file(query_url(fixture_server), output_file_path, limit=100, cache=cache)
+    n_requests = len(fixture_server.requests)
+
+    results = fetch_data_from_hapi_concurrent(query_url(fixture_server), limit=100, cache=cache)
+
+    assert results == fixture_server.lines
+    assert len(fixture_server.requests) == n_requests
+    # Pages past the end are requested speculatively, so the second run may need fewer pages
+    assert 0 < cache.n_hits <= n_requests
+    assert cache.n_misses == n_requests
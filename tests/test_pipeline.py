@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hdx_file_comparison.digests import file_digest, load_or_compute_digest
+from hdx_file_comparison.downloader import download_to_file
+from hdx_file_comparison.pipeline import PageComparator
+from hdx_file_comparison.utilities import hash_based_file_comparison
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+FILE_1 = os.path.join(FIXTURES_DIRECTORY, "2024-05-12-wfp_food_prices_afg_qc.csv")
+FILE_2 = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+def test_page_comparator_reports_mismatched_pages():
+    mismatches = []
+    comparator = PageComparator(on_mismatch=lambda *x: mismatches.append(x))
+
+    comparator.add_page(0, 0, "a,b", ["1,2", "3,4"])
+    comparator.add_page(1, 0, "a,b", ["3,4", "1,2"])
+    comparator.add_page(1, 2, None, ["5,6"])
+    assert mismatches == []
+    comparator.add_page(0, 2, None, ["5,7", "8,9"])
+
+    assert mismatches == [(2, 2, 1)]
+    hash_metrics = comparator.hash_metrics()
+    assert comparator.complete
+    assert hash_metrics["n_pages_compared"] == 2
+    assert hash_metrics["mismatched_pages"] == [2]
+    assert hash_metrics["file_1_length"] == 5
+    assert hash_metrics["file_2_length"] == 4
+
+
+def test_page_comparator_is_incomplete_after_resume():
+    comparator = PageComparator(on_mismatch=lambda *x: None)
+    comparator.add_page(0, 0, "a,b", ["1,2"])
+    comparator.add_page(1, 1, "a,b", ["1,2"])
+
+    assert not comparator.complete
+
+
+def test_pipelined_downloads(fixture_server, tmp_path):
+    fixture_server.files["/hapi"] = open(FILE_1, encoding="utf-8").read().splitlines()
+    fixture_server.files["/hapi-temporary"] = open(FILE_2, encoding="utf-8").read().splitlines()
+    base_url = f"http://127.0.0.1:{fixture_server.server_address[1]}"
+    mismatches = []
+    comparator = PageComparator(on_mismatch=lambda *x: mismatches.append(x))
+
+    filepaths = [str(tmp_path / "hapi.csv"), str(tmp_path / "hapi-temporary.csv")]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(
+                download_to_file,
+                f"{base_url}/{hapi_site}?output_format=csv",
+                filepath,
+                limit=100,
+                max_workers=2,
+                adaptive_page_size=False,
+                on_page=comparator.page_callback(i),
+            )
+            for i, (hapi_site, filepath) in enumerate(zip(["hapi", "hapi-temporary"], filepaths))
+        ]
+        assert [x.result() for x in futures] == [817, 821]
+
+    hash_metrics = comparator.hash_metrics()
+    expected = hash_based_file_comparison(filepaths[0], filepaths[1])
+    for key in ["file_1_length", "file_2_length", "file_1_hash", "file_2_hash"]:
+        assert hash_metrics[key] == expected[key]
+    assert hash_metrics["n_pages_compared"] == 9
+    assert hash_metrics["mismatched_pages"] == [x[0] for x in mismatches]
+    assert len(mismatches) > 0
+
+    # Digests from the pages are the same as those computed from the finished files
+    for i, filepath in enumerate(filepaths):
+        assert comparator.file_digest(i, filepath)["digest"] == file_digest(filepath)["digest"]
+        assert load_or_compute_digest(filepath)["n_rows"] == hash_metrics[f"file_{i + 1}_length"]
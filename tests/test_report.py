@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import io
+import json
+import os
+
+import pytest
+
+from click.testing import CliRunner
+
+from hdx_file_comparison.cli import hdx_compare, iter_diff_engine, run_diff_engine
+from hdx_file_comparison.report import ReportWriter, open_report
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = "date,admin1,admin2,market,commodity,pricetype"
+CHANGES = [
+    {"row": 3, "column": "price", "original_value": "1", "new_value": "2"},
+    {"row": 5, "column": "market", "original_value": "a, b", "new_value": ""},
+    {"row": 8, "column": "price", "original_value": "7", "new_value": "9"},
+]
+DIFF_METRICS = {"n_lines_changed": 3, "n_lines_added": 1, "n_lines_removed": 0}
+
+
+def write_report(report_format: str) -> str:
+    output = io.StringIO()
+    report = ReportWriter(output, report_format)
+    assert report.write_changes(iter(CHANGES)) == 3
+    report.write_summary(DIFF_METRICS)
+    return output.getvalue()
+
+
+def test_report_writer_formats():
+    lines = [json.loads(x) for x in write_report("ndjson").splitlines()]
+    assert lines[0] == {"type": "cell_change", **CHANGES[0]}
+    assert lines[-1] == {"type": "summary", **DIFF_METRICS, "n_cell_changes": 3}
+
+    assert write_report("csv").splitlines() == [
+        "row,column,original_value,new_value",
+        "3,price,1,2",
+        '5,market,"a, b",',
+        "8,price,7,9",
+    ]
+
+    assert json.loads(write_report("summary")) == {
+        **DIFF_METRICS,
+        "n_cell_changes": 3,
+        "cell_changes_by_column": {"price": 2, "market": 1},
+    }
+
+    with pytest.raises(ValueError):
+        ReportWriter(io.StringIO(), "xml")
+
+
+def test_open_report_file(tmp_path):
+    filepath = os.path.join(tmp_path, "report.ndjson")
+    with open_report(filepath) as report:
+        report.write_change(CHANGES[0])
+        report.flush()
+        # A reader sees the changes written so far before the report is finished
+        with open(filepath, encoding="utf-8") as file_handle:
+            assert json.loads(file_handle.readline())["row"] == 3
+        report.write_summary(DIFF_METRICS)
+    with open(filepath, encoding="utf-8") as file_handle:
+        assert len(file_handle.readlines()) == 2
+
+
+@pytest.mark.parametrize("engine", ["keyed", "streaming", "indexed", "merkle", "difflib"])
+def test_iter_diff_engine_streams_changes(engine):
+    diff_metrics = {}
+    cell_changes = iter_diff_engine(
+        BIG_FILE, BIG_FILE_CHANGED, diff_metrics, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS
+    )
+
+    # The changed rows of the fixture are one block of the line diff, so difflib only yields once
+    # the block is complete, while the keyed engines yield before counting every changed row
+    first_change = next(cell_changes)
+    if engine != "difflib":
+        assert diff_metrics.get("n_lines_changed", 0) < 473
+    n_changes = 1 + sum(1 for _ in cell_changes)
+
+    # The line counts match run_diff_engine once the engine is finished, with row numbers in the
+    # untrimmed files
+    expected_metrics, expected_cell_changes = run_diff_engine(
+        BIG_FILE, BIG_FILE_CHANGED, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS
+    )
+    assert diff_metrics == expected_metrics
+    assert n_changes == 603
+    if expected_cell_changes is not None:
+        assert first_change in expected_cell_changes
+
+
+def test_compare_report_out(tmp_path):
+    arguments = [
+        "compare",
+        f"--download_directory={FIXTURES_DIRECTORY}",
+        f"--file_1={os.path.basename(BIG_FILE)}",
+        f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+        "--engine=keyed",
+        f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+    ]
+    report_path = os.path.join(tmp_path, "report.csv")
+    result = CliRunner().invoke(
+        hdx_compare, [*arguments, f"--report_out={report_path}", "--report_format=csv"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "'n_lines_changed': 473" in result.output
+    with open(report_path, encoding="utf-8") as file_handle:
+        assert len(file_handle.readlines()) == 604
+
+    # On stdout the report is the only output, everything else the command prints is on stderr
+    result = CliRunner().invoke(
+        hdx_compare, [*arguments, "--report_out=-", "--report_format=summary"]
+    )
+    assert result.exit_code == 0, result.output
+    summary = json.loads(result.stdout)
+    assert summary["n_lines_changed"] == 473
+    assert summary["n_cell_changes"] == 603
+    assert sum(summary["cell_changes_by_column"].values()) == 603
+    assert "'n_lines_changed': 473" in result.stderr
+
+
+@pytest.mark.parametrize(
+    "engine, report_out",
+    [
+        ("keyed", None),
+        ("keyed", "-"),
+        ("columnar", None),
+        ("streaming", None),
+        ("streaming", "-"),
+        ("indexed", "-"),
+    ],
+)
+def test_compare_missing_key_column(engine, report_out):
+    arguments = [
+        "compare",
+        f"--download_directory={FIXTURES_DIRECTORY}",
+        f"--file_1={os.path.basename(BIG_FILE)}",
+        f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+        f"--engine={engine}",
+        "--key_columns=date,region",
+    ]
+    if report_out is not None:
+        arguments.append(f"--report_out={report_out}")
+    result = CliRunner().invoke(hdx_compare, arguments)
+
+    assert result.exit_code == 2
+    assert "--key_columns region not found" in result.stderr
+    assert "Traceback" not in result.output
+
+
+def test_compare_report_out_rejects_columnar(tmp_path):
+    report_path = os.path.join(tmp_path, "report.ndjson")
+    result = CliRunner().invoke(
+        hdx_compare,
+        [
+            "compare",
+            f"--download_directory={FIXTURES_DIRECTORY}",
+            f"--file_1={os.path.basename(BIG_FILE)}",
+            f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+            "--engine=columnar",
+            f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+            f"--report_out={report_path}",
+        ],
+    )
+
+    assert result.exit_code == 2
+    assert "--report_out can not be used with the columnar engine" in result.stderr
+    assert not os.path.exists(report_path)
+
+    with pytest.raises(ValueError, match="columnar engine can not stream"):
+        next(iter_diff_engine(BIG_FILE, BIG_FILE_CHANGED, {}, engine="columnar"))
+
+
+@pytest.mark.parametrize("engine", ["merkle", "difflib"])
+def test_compare_report_on_stdout_parses(engine):
+    result = CliRunner().invoke(
+        hdx_compare,
+        [
+            "compare",
+            f"--download_directory={FIXTURES_DIRECTORY}",
+            f"--file_1={os.path.basename(BIG_FILE)}",
+            f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+            f"--engine={engine}",
+            f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+            "--server=http://127.0.0.1:1",
+            "--report_out=-",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    records = [json.loads(x) for x in result.stdout.splitlines()]
+    assert len(records) == 604
+    assert records[-1]["type"] == "summary"
+    assert "No comparison service" in result.stderr
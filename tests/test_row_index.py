@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+
+import pytest
+
+from hdx_file_comparison.row_index import (
+    build_row_index,
+    changed_columns,
+    index_path,
+    indexed_compare,
+    load_or_build_row_index,
+    read_row_index,
+    write_row_index,
+)
+from hdx_file_comparison.utilities import keyed_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+SMALL_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
+
+
+class FailingArray:
+    def tofile(self, file_handle):
+        raise OSError("No space left on device")
+
+
+def test_write_row_index_interrupted(tmp_path):
+    filepath = os.path.join(tmp_path, "snapshot.csv")
+    shutil.copy(SMALL_FILE_ORIGINAL, filepath)
+    row_index = load_or_build_row_index(filepath, key_columns=["date", "code"])
+    with open(index_path(filepath), "rb") as index_handle:
+        written = index_handle.read()
+
+    # A write which fails part way leaves the index written before, and no temporary file
+    row_index.key_hashes = FailingArray()
+    with pytest.raises(OSError):
+        write_row_index(row_index)
+
+    with open(index_path(filepath), "rb") as index_handle:
+        assert index_handle.read() == written
+    assert sorted(os.listdir(tmp_path)) == ["snapshot.csv", os.path.basename(index_path(filepath))]
+
+
+def test_row_index_round_trip(tmp_path):
+    filepath = os.path.join(tmp_path, "snapshot.csv")
+    shutil.copy(SMALL_FILE_ORIGINAL, filepath)
+
+    assert read_row_index(filepath, key_columns=["date", "code"]) is None
+    row_index = load_or_build_row_index(filepath, key_columns=["date", "code"])
+    assert os.path.exists(index_path(filepath))
+
+    reread = read_row_index(filepath, key_columns=["date", "code"])
+    assert reread.metadata == row_index.metadata
+    assert reread.offsets == row_index.offsets
+    assert reread.row_hashes == row_index.row_hashes
+    assert reread.key_hashes == row_index.key_hashes
+    with open(filepath, "rb") as file_handle:
+        assert reread.read_line(file_handle, 0) == "date,code,usdprice"
+
+    # A different key, or a change to the file, invalidates the index
+    assert read_row_index(filepath, key_columns=["code"]) is None
+    with open(filepath, "a", encoding="utf-8") as file_handle:
+        file_handle.write("2024-07-15,Kabul-Kabul-Kabul-Bread-KG-Retail-AFN,0.7055\n")
+    assert read_row_index(filepath, key_columns=["date", "code"]) is None
+
+
+def test_indexed_compare_matches_keyed_compare(tmp_path):
+    filepath_1 = os.path.join(tmp_path, "original.csv")
+    filepath_2 = os.path.join(tmp_path, "changed.csv")
+    shutil.copy(BIG_FILE_ORIGINAL, filepath_1)
+    shutil.copy(BIG_FILE_CHANGED, filepath_2)
+
+    expected = keyed_compare(filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS)
+    # The first call builds the indexes, the second reads them back
+    assert indexed_compare(filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS) == expected
+    assert os.path.exists(index_path(filepath_1))
+    assert indexed_compare(filepath_1, filepath_2, BIG_FILE_KEY_COLUMNS) == expected
+
+
+def test_changed_columns():
+    row_index_1 = build_row_index(BIG_FILE_ORIGINAL)
+    row_index_2 = build_row_index(BIG_FILE_ORIGINAL)
+
+    assert changed_columns(row_index_1, row_index_2) == []
+    row_index_2.metadata["column_digests"]["usdprice"] = "0"
+    assert changed_columns(row_index_1, row_index_2) == ["usdprice"]
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+
+from hdx_file_comparison.cli import hdx_compare, iter_diff_engine, run_diff_engine
+from hdx_file_comparison.service import (
+    ComparisonService,
+    SnapshotCache,
+    create_server,
+    get_remote_job,
+    iter_remote_changes,
+    run_remote_job,
+    server_available,
+    server_url,
+    service_status,
+)
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = "date,admin1,admin2,market,commodity,pricetype"
+
+
+@pytest.fixture
+def service_url():
+    service = ComparisonService(
+        run_diff_engine, max_workers=2, cache_entries=4, iter_diff_engine=iter_diff_engine
+    )
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server_url(port=server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def test_snapshot_cache(tmp_path):
+    filepaths = []
+    for i in range(3):
+        filepaths.append(os.path.join(tmp_path, f"{i}.csv"))
+        with open(filepaths[-1], "w", encoding="utf-8") as file_handle:
+            file_handle.write(f"{i}\n")
+    loads = []
+
+    def loader(filepath):
+        loads.append(filepath)
+        return len(loads)
+
+    cache = SnapshotCache(max_entries=2)
+    assert cache.get(filepaths[0], "rows", loader) == 1
+    assert cache.get(filepaths[0], "rows", loader) == 1
+    assert cache.get(filepaths[0], "columns", loader) == 2
+    assert cache.get(filepaths[1], "rows", loader) == 3
+    assert cache.summary()["n_evicted"] == 1
+
+    # A file which changes is loaded again
+    with open(filepaths[1], "w", encoding="utf-8") as file_handle:
+        file_handle.write("changed\n")
+    assert cache.get(filepaths[1], "rows", loader) == 4
+    assert (cache.n_hits, cache.n_misses) == (1, 4)
+
+
+@pytest.mark.parametrize("engine", ["keyed", "columnar", "difflib"])
+def test_service_matches_run_diff_engine(service_url, engine):
+    options = {"engine": engine, "key_columns": BIG_FILE_KEY_COLUMNS}
+    expected_metrics, expected_cell_changes = run_diff_engine(BIG_FILE, BIG_FILE_CHANGED, **options)
+    job = {
+        "filepath_1": BIG_FILE,
+        "filepath_2": BIG_FILE_CHANGED,
+        "options": options,
+        "include_cell_changes": True,
+    }
+
+    for _ in range(2):
+        record = run_remote_job(service_url, job, timeout=60)
+        assert record["status"] == "complete", record["error"]
+        assert record["result"]["diff_metrics"] == expected_metrics
+        assert record["result"]["cell_changes"] == expected_cell_changes
+
+    # The second keyed or columnar job used the files parsed for the first
+    status = service_status(service_url)
+    assert status["jobs"]["complete"] == 2
+    if engine in ["keyed", "columnar"]:
+        assert status["cache"]["n_hits"] == 2
+        assert status["cache"]["n_misses"] == 2
+
+
+def test_service_failed_job(service_url):
+    record = run_remote_job(
+        service_url,
+        {
+            "filepath_1": os.path.join(FIXTURES_DIRECTORY, "missing.csv"),
+            "filepath_2": BIG_FILE,
+            "options": {"engine": "keyed", "key_columns": BIG_FILE_KEY_COLUMNS},
+        },
+        timeout=60,
+    )
+    assert record["status"] == "failed"
+    assert "missing.csv" in record["error"]
+
+    with pytest.raises(ValueError):
+        run_remote_job(service_url, {"filepath_1": BIG_FILE}, timeout=60)
+    with pytest.raises(ValueError, match="not known"):
+        get_remote_job(service_url, "999")
+
+
+def test_compare_with_server(service_url):
+    assert server_available(service_url)
+    assert not server_available("http://127.0.0.1:1")
+    arguments = [
+        "compare",
+        f"--download_directory={FIXTURES_DIRECTORY}",
+        f"--file_1={os.path.basename(BIG_FILE)}",
+        f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+        "--engine=keyed",
+        f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+    ]
+    expected = "{'n_lines_changed': 473, 'n_lines_added': 1, 'n_lines_removed': 0}"
+
+    result = CliRunner().invoke(hdx_compare, [*arguments, f"--server={service_url}"])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == expected
+    assert service_status(service_url)["jobs"]["complete"] == 1
+
+    # Without a service the comparison runs in the command
+    result = CliRunner().invoke(hdx_compare, [*arguments, "--server=http://127.0.0.1:1"])
+    assert result.exit_code == 0, result.output
+    assert "No comparison service" in result.output
+    assert expected in result.output
+
+
+@pytest.mark.parametrize("engine", ["difflib", "keyed"])
+def test_compare_report_with_server(service_url, tmp_path, engine):
+    arguments = [
+        "compare",
+        f"--download_directory={FIXTURES_DIRECTORY}",
+        f"--file_1={os.path.basename(BIG_FILE)}",
+        f"--file_2={os.path.basename(BIG_FILE_CHANGED)}",
+        f"--engine={engine}",
+        f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+    ]
+    reports = []
+    for server in [service_url, "http://127.0.0.1:1"]:
+        reports.append(os.path.join(tmp_path, f"{len(reports)}.ndjson"))
+        result = CliRunner().invoke(
+            hdx_compare, [*arguments, f"--server={server}", f"--report_out={reports[-1]}"]
+        )
+        assert result.exit_code == 0, result.output
+
+    # The report streamed from the service is the report written by a local comparison
+    assert service_status(service_url)["n_streams"] == 1
+    with open(reports[0], encoding="utf-8") as remote, open(reports[1], encoding="utf-8") as local:
+        remote_lines = remote.readlines()
+        assert remote_lines == local.readlines()
+    assert len(remote_lines) == 604
+
+
+def test_iter_remote_changes_failed(service_url):
+    job = {
+        "filepath_1": os.path.join(FIXTURES_DIRECTORY, "missing.csv"),
+        "filepath_2": BIG_FILE,
+        "options": {"engine": "keyed", "key_columns": BIG_FILE_KEY_COLUMNS},
+    }
+    with pytest.raises(ValueError, match="missing.csv"):
+        list(iter_remote_changes(service_url, job, {}))
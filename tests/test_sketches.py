@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+
+import pytest
+
+from hdx_file_comparison.sketches import (
+    FileSketch,
+    compare_sketches,
+    load_or_compute_sketch,
+    read_sketch_sidecar,
+    sketch_file,
+    sketch_file_comparison,
+    sketch_path,
+)
+from hdx_file_comparison.synthetic import generate_pair
+from hdx_file_comparison.utilities import hash_based_file_comparison
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+
+
+def within(estimate: float, actual: float, error: float, n_errors: float = 4.0) -> bool:
+    return abs(estimate - actual) <= n_errors * error
+
+
+def test_sketch_file_comparison_estimates_within_error():
+    sketch_metrics = compare_sketches(sketch_file(BIG_FILE_ORIGINAL), sketch_file(BIG_FILE_CHANGED))
+    exact = hash_based_file_comparison(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED)
+
+    assert sketch_metrics["file_1_length"] == exact["file_1_length"]
+    assert sketch_metrics["file_2_length"] == exact["file_2_length"]
+    assert not sketch_metrics["hashes_match"]
+    relative_error = sketch_metrics["unique_relative_error"]
+    for key in ["file_1_unique", "file_2_unique"]:
+        assert within(sketch_metrics[key], exact[key], relative_error * exact[key])
+    actual_jaccard = exact["n_common"] / (
+        exact["file_1_unique"] + exact["file_2_unique"] - exact["n_common"]
+    )
+    assert within(sketch_metrics["jaccard"], actual_jaccard, sketch_metrics["jaccard_error"])
+    assert within(
+        sketch_metrics["n_differing"], exact["n_differing"], sketch_metrics["n_differing_error"]
+    )
+
+
+def test_small_files_are_exact(tmp_path):
+    filepath_1 = str(tmp_path / "file_1.csv")
+    filepath_2 = str(tmp_path / "file_2.csv")
+    generate_pair(filepath_1, filepath_2, 500, edit_profile="cell_edits", rate=0.1)
+
+    sketch_metrics = compare_sketches(sketch_file(filepath_1), sketch_file(filepath_2))
+    exact = hash_based_file_comparison(filepath_1, filepath_2)
+
+    # With fewer lines than k the MinHash sketches hold every line
+    assert sketch_metrics["jaccard_error"] == 0.0
+    assert sketch_metrics["jaccard"] == pytest.approx(
+        exact["n_common"] / (exact["file_1_unique"] + exact["file_2_unique"] - exact["n_common"])
+    )
+
+    identical = compare_sketches(sketch_file(filepath_1), sketch_file(filepath_1))
+    assert identical["hashes_match"]
+    assert identical["jaccard"] == 1.0
+    assert identical["n_differing"] == 0
+
+
+def test_sketch_round_trip():
+    sketch = FileSketch(precision=6, k=4)
+    for i in range(100):
+        sketch.add(f"line {i % 50}".encode("utf-8"))
+
+    assert sketch.n_rows == 100
+    assert len(sketch.bottom_k) == 4
+    restored = FileSketch.from_dict(sketch.to_dict())
+    assert restored.to_dict() == sketch.to_dict()
+    assert 30 < restored.unique_estimate() < 70
+
+    with pytest.raises(ValueError):
+        FileSketch(precision=2)
+
+
+def test_sketch_sidecar(tmp_path):
+    filepath = str(tmp_path / "file.csv")
+    shutil.copy(BIG_FILE_ORIGINAL, filepath)
+
+    assert read_sketch_sidecar(filepath) is None
+    sketch = load_or_compute_sketch(filepath)
+    assert os.path.exists(sketch_path(filepath))
+    assert read_sketch_sidecar(filepath) == sketch
+    # Sketches made with other settings are not reused
+    assert read_sketch_sidecar(filepath, k=16) is None
+
+    with open(filepath, "a", encoding="utf-8") as file_handle:
+        file_handle.write("extra,line\n")
+    assert read_sketch_sidecar(filepath) is None
+    assert sketch_file_comparison(filepath, filepath)["file_1_length"] == sketch["n_rows"] + 1
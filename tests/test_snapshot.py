@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from click.testing import CliRunner
+
+from hdx_file_comparison.cli import hdx_compare, run_diff_engine
+from hdx_file_comparison.columnar import load_columns
+from hdx_file_comparison.snapshot import (
+    is_snapshot,
+    projected_files,
+    read_columns,
+    read_snapshot_index,
+    write_projected_csv,
+    write_snapshot,
+)
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = "date,admin1,admin2,market,commodity,pricetype"
+
+
+def test_write_snapshot_round_trip(tmp_path):
+    snapshot = write_snapshot(BIG_FILE, os.path.join(tmp_path, "big.hdxcol"), row_group_size=5000)
+
+    assert is_snapshot(snapshot)
+    assert not is_snapshot(BIG_FILE)
+    assert os.path.getsize(snapshot) < os.path.getsize(BIG_FILE) / 10
+    index = read_snapshot_index(snapshot)
+    assert index["hxl"][0:2] == ["#date", "#adm1+name"]
+    assert len(index["row_groups"]) == 7
+
+    # The HXL row is metadata rather than the first row of values
+    expected = load_columns(BIG_FILE)
+    columns = read_columns(snapshot, ["usdprice", "date", "missing"])
+    assert columns["header"] == ["usdprice", "date"]
+    assert columns["hxl"] == ["#value+usd", "#date"]
+    assert columns["n_rows"] == expected["n_rows"] - 1
+    assert columns["columns"]["usdprice"] == expected["columns"]["usdprice"][1:]
+
+    projected_path = os.path.join(tmp_path, "big.csv")
+    write_projected_csv(snapshot, projected_path)
+    with open(projected_path, encoding="utf-8") as projected, open(
+        BIG_FILE, encoding="utf-8"
+    ) as original:
+        assert projected.read() == original.read()
+
+
+def test_write_snapshot_awkward_values(tmp_path):
+    filepath = os.path.join(tmp_path, "awkward.csv")
+    with open(filepath, "w", encoding="utf-8", newline="") as file_handle:
+        file_handle.write('code,value\na,"1,5"\nb,""\nc,"two\nlines"\nd\n')
+
+    snapshot = write_snapshot(filepath)
+
+    assert snapshot == os.path.join(tmp_path, "awkward.hdxcol")
+    assert read_snapshot_index(snapshot)["hxl"] is None
+    assert read_columns(snapshot)["columns"] == {
+        "code": ("a", "b", "c", "d"),
+        "value": ("1,5", "", "two\nlines", ""),
+    }
+
+
+def test_projected_files(tmp_path):
+    snapshot = write_snapshot(BIG_FILE_CHANGED, os.path.join(tmp_path, "changed.hdxcol"))
+
+    with projected_files(BIG_FILE, BIG_FILE_CHANGED) as (filepath_1, filepath_2):
+        assert (filepath_1, filepath_2) == (BIG_FILE, BIG_FILE_CHANGED)
+
+    with projected_files(BIG_FILE, snapshot, ["date", "usdprice"]) as (filepath_1, filepath_2):
+        for filepath in [filepath_1, filepath_2]:
+            with open(filepath, encoding="utf-8") as file_handle:
+                assert file_handle.readline() == "date,usdprice\n"
+                assert file_handle.readline() == "#date,#value+usd\n"
+    assert not os.path.exists(filepath_1)
+
+
+@pytest.mark.parametrize("engine", ["difflib", "keyed", "columnar"])
+def test_run_diff_engine_on_snapshots(tmp_path, engine):
+    snapshot_1 = write_snapshot(BIG_FILE, os.path.join(tmp_path, "1.hdxcol"))
+    snapshot_2 = write_snapshot(BIG_FILE_CHANGED, os.path.join(tmp_path, "2.hdxcol"))
+
+    expected = run_diff_engine(
+        BIG_FILE, BIG_FILE_CHANGED, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS
+    )
+    assert (
+        run_diff_engine(snapshot_1, snapshot_2, engine=engine, key_columns=BIG_FILE_KEY_COLUMNS)
+        == expected
+    )
+
+    # Every row which changes has a different usdprice
+    diff_metrics, cell_changes = run_diff_engine(
+        snapshot_1,
+        snapshot_2,
+        engine=engine,
+        key_columns=BIG_FILE_KEY_COLUMNS,
+        columns="usdprice",
+    )
+    assert diff_metrics == expected[0]
+    if cell_changes is not None:
+        assert {x["column"] for x in cell_changes} == {"usdprice"}
+
+
+def test_compare_columns_option(tmp_path):
+    write_snapshot(BIG_FILE, os.path.join(tmp_path, "1.hdxcol"))
+    write_snapshot(BIG_FILE_CHANGED, os.path.join(tmp_path, "2.hdxcol"))
+
+    result = CliRunner().invoke(
+        hdx_compare,
+        [
+            "compare",
+            f"--download_directory={tmp_path}",
+            "--file_1=1.hdxcol",
+            "--file_2=2.hdxcol",
+            "--engine=keyed",
+            f"--key_columns={BIG_FILE_KEY_COLUMNS}",
+            "--columns=price",
+        ],
+    )
+
+    # Of the 473 rows which change, 130 have a different price in local currency
+    assert result.exit_code == 0, result.output
+    assert "{'n_lines_changed': 130, 'n_lines_added': 1, 'n_lines_removed': 0}" in result.output
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+
+from hdx_file_comparison.streaming import (
+    external_sort,
+    streaming_compare,
+    streaming_file_comparison,
+)
+from hdx_file_comparison.utilities import keyed_compare
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
+BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
+# Small enough to force several spilled runs for the big fixture files
+SMALL_MEMORY_LIMIT = 500_000
+
+
+def test_external_sort_spills_runs(tmp_path):
+    records = [[str(x % 97), str(x)] for x in range(2000)]
+    sorted_records = list(
+        external_sort(records, lambda x: (x[0], int(x[1])), str(tmp_path), memory_limit=10_000)
+    )
+
+    assert len(os.listdir(tmp_path)) > 1
+    assert sorted_records == sorted(records, key=lambda x: (x[0], int(x[1])))
+
+
+def test_streaming_file_comparison():
+    t0 = time.time()
+    hash_metrics = streaming_file_comparison(
+        BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, memory_limit=SMALL_MEMORY_LIMIT
+    )
+    print(f"Streaming file comparison took {time.time()-t0:0.3f} seconds", flush=True)
+
+    assert hash_metrics["file_1_length"] == 32564
+    assert hash_metrics["file_2_length"] == 32565
+    assert hash_metrics["file_1_unique"] == 32564
+    assert hash_metrics["file_2_unique"] == 32565
+    assert hash_metrics["n_common"] == 32091
+    assert hash_metrics["n_differing"] == 473
+    assert hash_metrics["file_1_hash"] != hash_metrics["file_2_hash"]
+
+
+def test_streaming_compare_keyed_matches_keyed_compare():
+    t0 = time.time()
+    diff_metrics = streaming_compare(
+        BIG_FILE_ORIGINAL,
+        BIG_FILE_CHANGED,
+        BIG_FILE_KEY_COLUMNS,
+        memory_limit=SMALL_MEMORY_LIMIT,
+    )
+    print(f"Streaming keyed compare took {time.time()-t0:0.3f} seconds", flush=True)
+
+    assert diff_metrics == keyed_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS)
+
+
+def test_streaming_compare_unkeyed():
+    diff_metrics = streaming_compare(
+        BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, memory_limit=SMALL_MEMORY_LIMIT
+    )
+
+    assert diff_metrics == {
+        "n_lines_changed": 0,
+        "n_lines_added": 474,
+        "n_lines_removed": 473,
+        "cell_changes": [],
+    }
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import pytest
+
+from hdx_file_comparison.synthetic import EDIT_PROFILES, KEY_COLUMNS, generate_pair
+from hdx_file_comparison.utilities import hash_based_file_comparison, keyed_compare
+
+
+@pytest.mark.parametrize("edit_profile", EDIT_PROFILES)
+def test_generate_pair(tmp_path, edit_profile):
+    filepath_1 = str(tmp_path / "file_1.csv")
+    filepath_2 = str(tmp_path / "file_2.csv")
+    expected = generate_pair(filepath_1, filepath_2, 5000, edit_profile=edit_profile, rate=0.02)
+
+    hash_metrics = hash_based_file_comparison(filepath_1, filepath_2)
+    # The header and HXL rows are included in the line counts
+    assert hash_metrics["file_1_length"] == expected["n_rows_1"] + 2
+    assert hash_metrics["file_2_length"] == expected["n_rows_2"] + 2
+
+    diff_metrics = keyed_compare(filepath_1, filepath_2, KEY_COLUMNS)
+    assert diff_metrics["n_lines_changed"] == expected["n_lines_changed"]
+    assert diff_metrics["n_lines_added"] == (
+        expected["n_lines_added"] + expected["n_lines_duplicated"]
+    )
+    assert diff_metrics["n_lines_removed"] == expected["n_lines_removed"]
+    if edit_profile in ["identical", "reordered"]:
+        assert hash_metrics["file_1_hash"] == hash_metrics["file_2_hash"]
+    else:
+        assert hash_metrics["file_1_hash"] != hash_metrics["file_2_hash"]
+
+
+def test_generate_pair_is_reproducible(tmp_path):
+    paths = [str(tmp_path / f"file_{i}.csv") for i in range(4)]
+    generate_pair(paths[0], paths[1], 1000, seed=7)
+    generate_pair(paths[2], paths[3], 1000, seed=7)
+
+    for i in [0, 1]:
+        with open(paths[i], encoding="utf-8") as first, open(
+            paths[i + 2], encoding="utf-8"
+        ) as second:
+            assert first.read() == second.read()
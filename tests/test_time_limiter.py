@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+
+from hdx_file_comparison.time_limiter import (
+    DeadlinePool,
+    TimeExceededException,
+    map_with_deadline,
+)
+
+
+def lookup(shared_state, key):
+    if key == "slow":
+        time.sleep(30)
+    if key == "missing":
+        raise KeyError(key)
+    return shared_state[key]
+
+
+def test_map_with_deadline():
+    shared_state = {"a": 1, "b": 2, "c": 3}
+    results = map_with_deadline(lookup, ["c", "a", "b"], 5, shared_state=shared_state, processes=2)
+
+    assert results == [3, 1, 2]
+
+
+def test_map_with_deadline_times_out_and_reports_errors():
+    t0 = time.time()
+    # With a single worker "b" is queued behind "slow", so it should not share its deadline
+    results = map_with_deadline(
+        lookup, ["slow", "b", "missing"], 1, shared_state={"b": 2}, processes=1
+    )
+    elapsed = time.time() - t0
+    print(f"map_with_deadline took {elapsed:0.2f} seconds", flush=True)
+
+    assert isinstance(results[0], TimeExceededException)
+    assert results[1] == 2
+    assert isinstance(results[2], KeyError)
+    assert elapsed < 10
+
+
+def worker_pid(shared_state, key):
+    time.sleep(shared_state[key])
+    return os.getpid()
+
+
+def test_deadline_pool_only_replaces_worker_over_deadline():
+    with DeadlinePool(processes=2) as pool:
+        # "late" runs after "short" on the same worker, and is still running when "slow" passes
+        # its deadline
+        shared_state = {"slow": 30, "short": 0.6, "late": 0.8, "quick": 0.3}
+        results = pool.map(worker_pid, ["slow", "short", "late"], 1, shared_state=shared_state)
+        assert isinstance(results[0], TimeExceededException)
+        assert results[1] == results[2]
+
+        # The worker is kept for the next call with the same shared state
+        assert results[1] in pool.map(worker_pid, ["quick", "quick"], 5, shared_state=shared_state)
+        assert pool.map(lookup, ["b"], 5, shared_state={"b": 2}) == [2]
@@ -8,6 +8,10 @@ from hdx_file_comparison.utilities import (
     process,
     compute_diff_metrics,
     difflib_column_changes,
+    iter_cell_changes,
+    iter_difflib_cell_changes,
+    iter_keyed_compare,
+    keyed_compare,
 )
 
 FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -15,6 +19,7 @@ SMALL_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-05-12-wfp_food_pric
 SMALL_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg_qc.csv")
 BIG_FILE_ORIGINAL = os.path.join(FIXTURES_DIRECTORY, "2024-07-14-wfp_food_prices_afg.csv")
 BIG_FILE_CHANGED = os.path.join(FIXTURES_DIRECTORY, "2024-07-21-wfp_food_prices_afg.csv")
+BIG_FILE_KEY_COLUMNS = ["date", "admin1", "admin2", "market", "commodity", "pricetype"]
 
 
 def test_difflib_compare_small():
@@ -69,6 +74,68 @@ def test_process():
     }
 
 
+def test_iter_difflib_cell_changes():
+    diff_metrics = {}
+    cell_changes = iter_difflib_cell_changes(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED, diff_metrics)
+
+    # Changes are yielded before the line counts are known
+    assert next(cell_changes)["row"] == 291
+    assert diff_metrics == {}
+    assert len(list(cell_changes)) == 1
+    expected = process(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED)
+    expected.pop("cell_changes")
+    assert diff_metrics == expected
+
+
+def test_iter_keyed_compare():
+    diff_metrics = {}
+    cell_changes = list(
+        iter_keyed_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS, diff_metrics)
+    )
+    expected = keyed_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS)
+
+    assert sorted(cell_changes, key=lambda x: x["row"]) == expected.pop("cell_changes")
+    assert diff_metrics == expected
+
+
+def test_iter_cell_changes():
+    header_1 = ["date", "name", "price"]
+    header_2 = ["date", "name", "price", "unit"]
+    diff = [
+        # A changed line marked by ndiff, with a comma inside a quoted field
+        (3, '- 2024-05-15,"Wheat, flour",1.0'),
+        (4, "?                         ^\n"),
+        (5, '+ 2024-05-15,"Wheat, flour",2.0,KG'),
+        (6, "?                         ^    +++\n"),
+        # A block of two dissimilar lines replaced by two others, with no "? " lines
+        (10, "- 2024-06-15,Rice,3.0"),
+        (11, "- 2024-06-15,Salt,4.0"),
+        (12, "+ 2024-07-15,Beans,3.5,KG"),
+        (13, "+ 2024-07-15,Sugar,4.0,KG"),
+        # An added line is not a change
+        (20, "+ 2024-08-15,Salt,4.0,KG"),
+    ]
+
+    cell_changes = iter_cell_changes(header_1, header_2, diff)
+
+    assert next(cell_changes) == {
+        "row": 3,
+        "column": "price",
+        "original_value": "1.0",
+        "new_value": "2.0",
+    }
+    assert [(x["row"], x["column"]) for x in cell_changes] == [
+        (3, "unit"),
+        (10, "date"),
+        (10, "name"),
+        (10, "price"),
+        (10, "unit"),
+        (11, "date"),
+        (11, "name"),
+        (11, "unit"),
+    ]
+
+
 def test_difflib_column_changes():
     t0 = time.time()
     diff_columns = difflib_column_changes(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED)
@@ -101,3 +168,71 @@ def test_difflib_column_changes():
             (654, "- 0.3225"),
         ],
     }
+
+
+def test_difflib_column_changes_full_length():
+    t0 = time.time()
+    diff_columns = difflib_column_changes(
+        SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED, column_diff="patience"
+    )
+    print(f"Process took {time.time()-t0:0.3f} seconds", flush=True)
+
+    assert diff_columns == {
+        "date": [
+            (291, "+ 2024-06-15"),
+            (292, "+ 2024-07-15"),
+            (585, "+ 2024-06-15"),
+            (586, "+ 2024-07-15"),
+        ],
+        "code": [
+            (291, "+ Kandahar-Kandahar-Kandahar-Wheat-KG-Retail-AFN"),
+            (292, "+ Kandahar-Kandahar-Kandahar-Wheat-KG-Retail-AFN"),
+            (293, "+ Kabul-Kabul-Kabul-Bread-KG-Retail-AFN"),
+            (294, "+ Kabul-Kabul-Kabul-Bread-KG-Retail-AFN"),
+        ],
+        "usdprice": [
+            (290, "- 0.3606"),
+            (291, "+ 0.331"),
+            (292, "+ 0.2365"),
+            (293, "+ 0.2681"),
+            (585, "+ 0.6962"),
+            (587, "+ 0.7055"),
+        ],
+    }
+
+
+def test_keyed_compare_small():
+    t0 = time.time()
+    diff_metrics = keyed_compare(SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED, ["date", "code"])
+    print(f"Keyed compare took {time.time()-t0:0.3f} seconds", flush=True)
+
+    print(diff_metrics, flush=True)
+    assert diff_metrics == {
+        "n_lines_changed": 2,
+        "n_lines_added": 4,
+        "n_lines_removed": 0,
+        "cell_changes": [
+            {"row": 291, "column": "usdprice", "original_value": "0.3606", "new_value": "0.331"},
+            {"row": 583, "column": "usdprice", "original_value": "0.6439", "new_value": "0.6962"},
+        ],
+    }
+
+
+def test_keyed_compare_big():
+    t0 = time.time()
+    diff_metrics = keyed_compare(BIG_FILE_ORIGINAL, BIG_FILE_CHANGED, BIG_FILE_KEY_COLUMNS)
+    print(f"Keyed compare took {time.time()-t0:0.3f} seconds", flush=True)
+
+    assert diff_metrics["n_lines_changed"] == 473
+    assert diff_metrics["n_lines_removed"] == 0
+    assert diff_metrics["n_lines_added"] == 1
+    assert len(diff_metrics["cell_changes"]) == 603
+
+
+def test_process_keyed():
+    diff_metrics = process(
+        SMALL_FILE_ORIGINAL, SMALL_FILE_CHANGED, engine="keyed", key_columns=["date", "code"]
+    )
+
+    assert diff_metrics["n_lines_changed"] == 2
+    assert len(diff_metrics["cell_changes"]) == 2